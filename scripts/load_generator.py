@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+import time
+import random
+import rospy
+from std_msgs.msg import Header
+from uwds_msgs.msg import Changes
+from pyuwds.uwds_client import UwdsClient
+from pyuwds.uwds import PROVIDER
+from pyuwds.types.nodes import CAMERA
+from pyuwds.tools.synthetic import synthetic_node, synthetic_situation
+
+
+class LoadGenerator(UwdsClient):
+    """
+    Synthetic provider to stress the server and the clients
+
+    Creates nodes and situations in the output world, then moves a fraction
+    of the nodes at a fixed rate, updates some situations and replaces
+    nodes (deletion + creation) to simulate churn. The achieved rates are
+    periodically compared to the targeted ones.
+    """
+    def __init__(self):
+        super(LoadGenerator, self).__init__("load_generator", PROVIDER)
+        if self.output_world == "":
+            self.output_world = "load"
+        self.nb_nodes = rospy.get_param("~nb_nodes", 100)
+        self.nb_situations = rospy.get_param("~nb_situations", 20)
+        self.update_rate = rospy.get_param("~update_rate", 10.0)
+        self.update_ratio = rospy.get_param("~update_ratio", 0.1)
+        self.situation_update_ratio = rospy.get_param("~situation_update_ratio", 0.1)
+        self.churn_rate = rospy.get_param("~churn_rate", 1.0)
+        self.max_speed = rospy.get_param("~max_speed", 0.5)
+        self.report_period = rospy.get_param("~report_period", 5.0)
+        self.rand = random.Random(rospy.get_param("~seed", 0))
+        # a situation relates two distinct nodes
+        if self.nb_situations > 0 and self.nb_nodes < 2:
+            raise ValueError("~nb_situations = %d requires ~nb_nodes >= 2, got %d" % (self.nb_situations, self.nb_nodes))
+
+        self.nodes = {}
+        self.situations = {}
+        self.velocities = {}
+        self.nb_created = 0
+        self.churn = 0.0
+        self.reset_report()
+
+        header = Header(stamp=rospy.Time.now(), frame_id=self.global_frame_id)
+        changes = Changes()
+        changes.nodes_to_update = [self.createNode() for i in range(0, self.nb_nodes)]
+        changes.situations_to_update = [self.createSituation(header.stamp) for i in range(0, self.nb_situations)]
+        self.ctx.worlds()[self.output_world].update(changes, header)
+
+        rospy.loginfo("[%s::init] Generating %d nodes and %d situations in <%s> at %.1fHz" % (self.ctx.name(), self.nb_nodes, self.nb_situations, self.output_world, self.update_rate))
+        self.timer = rospy.Timer(rospy.Duration(1.0/self.update_rate), self.profiler.wrap(self.handleTimer))
+
+    def createNode(self):
+        node = synthetic_node(self.nb_created, self.rand)
+        self.nb_created += 1
+        self.nodes[node.id] = node
+        if node.type != CAMERA:
+            angle = self.rand.uniform(0.0, 2 * math.pi)
+            speed = self.rand.uniform(0.0, self.max_speed)
+            self.velocities[node.id] = (speed * math.cos(angle), speed * math.sin(angle))
+        else:
+            self.velocities[node.id] = (0.0, 0.0)
+        return node
+
+    def deleteNode(self, node_id):
+        del self.nodes[node_id]
+        del self.velocities[node_id]
+        situation_ids = [s.id for s in self.situations.values() if s.properties[0].data == node_id or s.properties[1].data == node_id]
+        for situation_id in situation_ids:
+            del self.situations[situation_id]
+        return situation_ids
+
+    def createSituation(self, stamp):
+        subject, object = self.rand.sample(list(self.nodes.values()), 2)
+        situation = synthetic_situation(subject, object, self.rand, stamp)
+        self.situations[situation.id] = situation
+        return situation
+
+    def moveNode(self, node, dt):
+        vx, vy = self.velocities[node.id]
+        position = node.position.pose.position
+        # bounce on the borders of the area
+        if abs(position.x + vx * dt) > 5.0:
+            vx = -vx
+        if abs(position.y + vy * dt) > 5.0:
+            vy = -vy
+        self.velocities[node.id] = (vx, vy)
+        position.x += vx * dt
+        position.y += vy * dt
+        node.velocity.twist.linear.x = vx
+        node.velocity.twist.linear.y = vy
+
+    def handleTimer(self, event):
+        start = time.time()
+        header = Header(stamp=rospy.Time.now(), frame_id=self.global_frame_id)
+        dt = 1.0/self.update_rate
+        changes = Changes()
+
+        # churn : replace some nodes by new ones, the nodes created by this tick are not replaced
+        replaceable_ids = list(self.nodes.keys())
+        self.churn += self.churn_rate * dt
+        while self.churn >= 1.0 and len(replaceable_ids) > 0:
+            node_id = replaceable_ids.pop(self.rand.randrange(len(replaceable_ids)))
+            changes.situations_to_delete += self.deleteNode(node_id)
+            changes.nodes_to_delete.append(node_id)
+            changes.nodes_to_update.append(self.createNode())
+            self.churn -= 1.0
+        # the replacements the nodes could not absorb are not accumulated
+        self.churn = min(self.churn, 1.0)
+
+        created_ids = set(n.id for n in changes.nodes_to_update)
+        nb_moved = int(round(self.update_ratio * len(self.nodes)))
+        for node in self.rand.sample(list(self.nodes.values()), min(nb_moved, len(self.nodes))):
+            self.moveNode(node, dt)
+            if node.id not in created_ids:
+                changes.nodes_to_update.append(node)
+
+        while len(self.situations) < self.nb_situations:
+            changes.situations_to_update.append(self.createSituation(header.stamp))
+        nb_situations_updated = int(round(self.situation_update_ratio * len(self.situations)))
+        for situation in self.rand.sample(list(self.situations.values()), min(nb_situations_updated, len(self.situations))):
+            situation.confidence = self.rand.uniform(0.5, 1.0)
+            changes.situations_to_update.append(situation)
+
+        self.ctx.worlds()[self.output_world].update(changes, header)
+
+        self.nb_ticks += 1
+        self.nb_nodes_updated += len(changes.nodes_to_update)
+        self.nb_nodes_deleted += len(changes.nodes_to_delete)
+        self.nb_situations_updated += len(changes.situations_to_update)
+        self.tick_duration += time.time() - start
+        elapsed = time.time() - self.report_start
+        if elapsed >= self.report_period:
+            self.report(elapsed)
+
+    def reset_report(self):
+        self.report_start = time.time()
+        self.nb_ticks = 0
+        self.nb_nodes_updated = 0
+        self.nb_nodes_deleted = 0
+        self.nb_situations_updated = 0
+        self.tick_duration = 0.0
+
+    def report(self, elapsed):
+        target_nodes_rate = self.update_rate * int(round(self.update_ratio * self.nb_nodes)) + self.churn_rate
+        rospy.loginfo("[%s::report] updates : %.1f/%.1fHz, nodes : %.1f/%.1f per sec (%.1f deleted/s), situations : %.1f per sec, tick : %.2fms" % (
+                      self.ctx.name(),
+                      self.nb_ticks / elapsed, self.update_rate,
+                      self.nb_nodes_updated / elapsed, target_nodes_rate,
+                      self.nb_nodes_deleted / elapsed,
+                      self.nb_situations_updated / elapsed,
+                      self.tick_duration * 1000.0 / self.nb_ticks if self.nb_ticks > 0 else 0.0))
+        if self.nb_ticks < 0.9 * self.update_rate * elapsed:
+            rospy.logwarn("[%s::report] Target rate not reached, the provider is saturated" % self.ctx.name())
+        self.reset_report()
+
+
+if __name__ == '__main__':
+    rospy.init_node("load_generator", anonymous=False)
+    generator = LoadGenerator()
+    rospy.spin()
@@ -99,7 +99,7 @@ class PhysicsReasoner(ReconfigurableClient):
 
         super(PhysicsReasoner, self).__init__("gravity_filter", FILTER)
 
-        self.timer = rospy.Timer(rospy.Duration(1.0/self.reasoning_frequency), self.reasoningCallback)
+        self.timer = rospy.Timer(rospy.Duration(1.0/self.reasoning_frequency), self.profiler.wrap(self.reasoningCallback))
 
     def onReconfigure(self, worlds_names):
         """
@@ -0,0 +1,527 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Microbenchmarks of the pyuwds hot paths over synthetic scenes
+
+Runs without ROS master thanks to the in-process transport, writes the
+results as JSON and compares them against a stored baseline:
+
+  uwds_benchmark.py --output results.json
+  uwds_benchmark.py --save-baseline baseline.json
+  uwds_benchmark.py --baseline baseline.json --tolerance 0.25
+
+The reference results are stored in test/benchmark_baseline.json, the
+scenes of 100k nodes can be added with --sizes 10 100 1000 10000 100000.
+"""
+
+import os
+import sys
+import imp
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import types
+import numpy as np
+from pyuwds.proxy.transport import InProcessTransport
+from pyuwds.proxy.meshes_proxy import MeshesProxy
+from pyuwds.proxy.world_proxy import WorldProxy
+from pyuwds.server import UnderworldsServer
+from pyuwds.types.concurrent_container import ConcurrentContainer
+from pyuwds.types.nodes import Nodes, MESH
+from pyuwds.types.scene import Scene
+from pyuwds.types.meshes import Meshes
+from pyuwds.types.world import World
+from pyuwds.types.gen_uuid import gen_uuid
+from pyuwds.tools.synthetic import synthetic_nodes, CLASSES, COLORS
+from uwds_msgs.msg import Changes, ChangesInContextStamped, Client
+from std_msgs.msg import Header
+import rospy
+
+# the scenes of 100k nodes are opt-in with --sizes, their setup being quadratic
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+DEFAULT_OPS = 1000
+DEFAULT_REPEAT = 5
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """
+    Register a benchmark, the decorated function receives the scene size and
+    the maximum number of operations and returns a (setup, run, nb_ops)
+    tuple, only run being timed on the state returned by setup, optionally
+    followed by a dict of metrics added to the results. The state is closed
+    after each run if it has a close method.
+    """
+    def register(function):
+        BENCHMARKS.append((name, function))
+        return function
+    return register
+
+
+@benchmark("ConcurrentContainer.update")
+def bench_container_update(size, ops):
+    nodes = synthetic_nodes(size)
+    batch = nodes[:min(size, ops)]
+
+    def setup():
+        container = ConcurrentContainer()
+        container.update([n.id for n in nodes], nodes)
+        return container
+    return setup, lambda container: container.update([n.id for n in batch], batch), len(batch)
+
+
+@benchmark("ConcurrentContainer.remove")
+def bench_container_remove(size, ops):
+    nodes = synthetic_nodes(size)
+    ids = [n.id for n in nodes[:min(size, ops)]]
+
+    def setup():
+        container = ConcurrentContainer()
+        container.update([n.id for n in nodes], nodes)
+        return container
+    return setup, lambda container: container.remove(ids), len(ids)
+
+
+@benchmark("ConcurrentContainer.has")
+def bench_container_has(size, ops):
+    nodes = synthetic_nodes(size)
+    ids = [n.id for n in nodes[:min(size, ops)]]
+    container = ConcurrentContainer()
+    container.update([n.id for n in nodes], nodes)
+
+    def run(container):
+        for id in ids:
+            container.has(id)
+    return lambda: container, run, len(ids)
+
+
+@benchmark("Nodes.by_property")
+def bench_nodes_by_property(size, ops):
+    nodes = Nodes()
+    nodes.update(synthetic_nodes(size))
+    return lambda: nodes, lambda nodes: nodes.by_property("class", "Cup"), size
+
+
+@benchmark("Nodes.by_name")
+def bench_nodes_by_name(size, ops):
+    nodes = Nodes()
+    all_nodes = synthetic_nodes(size)
+    nodes.update(all_nodes)
+    name = all_nodes[-1].name
+    return lambda: nodes, lambda nodes: nodes.by_name(name), size
+
+
+@benchmark("Scene.update")
+def bench_scene_update(size, ops):
+    nodes = synthetic_nodes(size)
+    batch = nodes[:min(size, ops)]
+
+    def setup():
+        scene = Scene()
+        scene.update(nodes)
+        return scene
+    return setup, lambda scene: scene.update(batch), len(batch)
+
+
+@benchmark("World.apply_changes")
+def bench_world_apply_changes(size, ops):
+    nodes = synthetic_nodes(size)
+    changes = Changes()
+    changes.nodes_to_update = nodes[:min(size, ops)]
+    changes.nodes_to_delete = [n.id for n in nodes[len(nodes) - min(size, ops) // 10:]]
+
+    def setup():
+        world = World("bench", Meshes())
+        initial = Changes()
+        initial.nodes_to_update = nodes
+        world.apply_changes(Header(), initial)
+        return world
+    return setup, lambda world: world.apply_changes(Header(), changes), len(changes.nodes_to_update)
+
+
+class ProxyFixture(object):
+    """
+    A world proxy connected to its own in-process server
+    """
+    def __init__(self, client, world_name, nodes):
+        self.transport = InProcessTransport()
+        self.server = UnderworldsServer(self.transport)
+        self.world = WorldProxy(client, MeshesProxy(client, self.transport), world_name, transport=self.transport)
+        initial = ChangesInContextStamped()
+        initial.changes.nodes_to_update = nodes
+        self.world.changes_callback(initial)
+
+    def close(self):
+        self.world.close()
+        self.server.shutdown()
+
+
+@benchmark("WorldProxy.changes_callback")
+def bench_world_proxy_changes_callback(size, ops):
+    client = Client(name="uwds_benchmark", id=gen_uuid(), type=Client.READER)
+    nodes = synthetic_nodes(size)
+    msg = ChangesInContextStamped()
+    msg.ctxt.client = client
+    msg.ctxt.world = "bench/world"
+    msg.changes.nodes_to_update = nodes[:min(size, ops)]
+
+    def run(fixture):
+        msg.header.stamp = rospy.Time.now()
+        fixture.world.changes_callback(msg)
+    return lambda: ProxyFixture(client, "bench/world", nodes), run, len(msg.changes.nodes_to_update)
+
+
+_glove_file = []
+
+
+def glove_manager(quantization=None):
+    """
+    Build a GloveManager over a synthetic embeddings file
+    """
+    from pyuwds.tools.glove import GloveManager
+    if len(_glove_file) == 0:
+        rand = random.Random(0)
+        words = [w.lower() for w in CLASSES + COLORS] + ["word%d" % i for i in range(0, 5000)]
+        path = os.path.join(tempfile.mkdtemp(prefix="uwds_benchmark"), "glove.synthetic.50d.txt")
+        with open(path, "w") as f:
+            for word in words:
+                f.write(word + " " + " ".join("%.5f" % rand.uniform(-1.0, 1.0) for i in range(0, 50)) + "\n")
+        _glove_file.append(path)
+    return GloveManager(_glove_file[0], stoplist=-1, quantization=quantization)
+
+
+@benchmark("GloveManager.sentence_vector")
+def bench_glove_sentence_vector(size, ops):
+    glove = glove_manager()
+    sentences = [n.name.replace("_", " ") for n in synthetic_nodes(min(size, ops))]
+
+    def run(glove):
+        for sentence in sentences:
+            glove.sentence_vector(sentence)
+    return lambda: glove, run, len(sentences)
+
+
+@benchmark("GloveManager.match")
+def bench_glove_match(size, ops):
+    glove = glove_manager()
+    sentences = [n.name.replace("_", " ") for n in synthetic_nodes(min(size, ops))]
+
+    def run(glove):
+        for sentence in sentences:
+            glove.match("red cup", sentence)
+    return lambda: glove, run, len(sentences)
+
+
+@benchmark("GloveManager.match_many")
+def bench_glove_match_many(size, ops):
+    glove = glove_manager()
+    sentences = [n.name.replace("_", " ") for n in synthetic_nodes(min(size, ops))]
+
+    def run(glove):
+        glove.match_many("red cup", sentences)
+    return lambda: glove, run, len(sentences)
+
+
+@benchmark("SemanticIndex.search")
+def bench_semantic_index_search(size, ops):
+    from pyuwds.tools.semantic_index import SemanticIndex
+    index = SemanticIndex(glove_manager(), preprocess=lambda sentence: sentence.replace("_", " "))
+    nodes = synthetic_nodes(size)
+    index.update_many([n.id for n in nodes], [n.name for n in nodes])
+    queries = ["red cup", "blue box", "table", "green bottle"] * (ops // 4)
+
+    def run(index):
+        for query in queries:
+            index.search(query, 0.85)
+    return lambda: index, run, len(queries)
+
+
+def bench_semantic_index_top(ann):
+    def bench(size, ops):
+        from pyuwds.tools.semantic_index import SemanticIndex
+        from pyuwds.tools.ann import LSHIndex
+        glove = glove_manager()
+        rand = random.Random(0)
+        # diverse sentences, the node names sharing a few directions
+        sentences = ["word%d word%d" % (rand.randint(0, 4999), rand.randint(0, 4999)) for i in range(0, size)]
+        exact = SemanticIndex(glove)
+        index = SemanticIndex(glove, ann=LSHIndex(glove.vector_dim) if ann else None)
+        for i in set([exact, index]):
+            i.update_many(range(0, size), sentences)
+        queries = [sentences[rand.randint(0, size - 1)] for i in range(0, min(ops, 100))]
+        # the recall@10 against the exact search
+        found = 0
+        for query in queries[:20]:
+            exact_results = set(owner for owner, score in exact.search(query, k=10))
+            found += len(exact_results & set(owner for owner, score in index.search(query, k=10)))
+
+        def run(index):
+            for query in queries:
+                index.search(query, k=10)
+        return lambda: index, run, len(queries), {"recall": found / (10.0 * min(len(queries), 20))}
+    return bench
+
+
+benchmark("SemanticIndex.search[top10]")(bench_semantic_index_top(False))
+benchmark("SemanticIndex.search[top10,lsh]")(bench_semantic_index_top(True))
+
+
+@benchmark("TripleStore.query")
+def bench_triple_store_query(size, ops):
+    from pyuwds.tools.triple_store import TripleStore
+    from pyuwds.tools.synthetic import PREDICATES
+    store = TripleStore()
+    nodes = synthetic_nodes(size)
+    rand = random.Random(0)
+    for node in nodes:
+        store.set_triples(node.id, [(node.id, "rdf:type", node.properties[0].data), (node.id, "rdfs:label", node.name)])
+    for i in range(0, size):
+        store.set_triples(i, [(rand.choice(nodes).id, rand.choice(PREDICATES), rand.choice(nodes).id)])
+    objects = [rand.choice(nodes).id for i in range(0, ops)]
+    queries = ["?o, ?o isIn %s, ?o rdf:type %s" % (object, rand.choice(CLASSES)) for object in objects]
+
+    def run(store):
+        for query in queries:
+            store.query(query)
+    return lambda: store, run, len(queries)
+
+
+class LocalKBFixture(object):
+    """
+    A server, the local knowledge base and a reader world querying it through the service
+    """
+    def __init__(self, world_name, nodes, situations):
+        self.transport = InProcessTransport(params={"~verbose": False})
+        self.server = UnderworldsServer(self.transport)
+        changes = Changes()
+        changes.nodes_to_update = nodes
+        changes.situations_to_update = situations
+        self.server.worlds()[world_name].apply_changes(Header(stamp=rospy.Time.now()), changes)
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uwds_local_kb.py")
+        self.kb = imp.load_source("uwds_local_kb", path).UwdsLocalKB(self.transport)
+        client = Client(name="uwds_benchmark", id=gen_uuid(), type=Client.READER)
+        self.world = WorldProxy(client, MeshesProxy(client, self.transport), world_name, transport=self.transport)
+        # the world is loaded by the first query, not timed
+        self.world["?o rdf:type Cup"]
+
+    def close(self):
+        self.world.close()
+        self.kb.ctx.worlds().close()
+        self.server.shutdown()
+
+
+@benchmark("UwdsLocalKB.query")
+def bench_local_kb_query(size, ops):
+    from pyuwds.tools.synthetic import synthetic_situation
+    nodes = synthetic_nodes(size)
+    rand = random.Random(0)
+    situations = [synthetic_situation(rand.choice(nodes), rand.choice(nodes), rand, rospy.Time(0)) for i in range(0, size)]
+    queries = ["?o, ?o isIn %s, ?o rdf:type %s" % (rand.choice(nodes).id, rand.choice(CLASSES)) for i in range(0, ops)]
+
+    def run(fixture):
+        for query in queries:
+            fixture.world[query]
+    return lambda: LocalKBFixture("bench/world", nodes, situations), run, len(queries)
+
+
+def bench_glove_quantized_match(quantization):
+    def bench(size, ops):
+        reference = glove_manager()
+        glove = glove_manager(quantization)
+        sentences = [n.name.replace("_", " ") for n in synthetic_nodes(min(size, ops))]
+        # the accuracy against the float64 scipy path
+        errors = [abs(glove.match("red cup", s) - reference.match("red cup", s)) for s in sentences]
+        metrics = {"max_error": max(errors),
+                   "mean_error": sum(errors) / len(errors),
+                   "memory_ratio": float(reference.memory_size()) / glove.memory_size()}
+
+        def run(glove):
+            for sentence in sentences:
+                glove.match("red cup", sentence)
+        return lambda: glove, run, len(sentences), metrics
+    return bench
+
+
+benchmark("GloveManager.match[float16]")(bench_glove_quantized_match("float16"))
+benchmark("GloveManager.match[int8]")(bench_glove_quantized_match("int8"))
+
+
+class MissingModule(types.ModuleType):
+    """
+    Stands for a module imported by a benchmarked script but not installed,
+    any use of it raising the ImportError the import would have raised
+    """
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        raise ImportError("No module named %s" % self.__name__.split(".")[0])
+
+
+def is_installed(module_name):
+    try:
+        __import__(module_name)
+        return True
+    except ImportError:
+        return False
+
+
+def physics_reasoner():
+    """
+    Return a PhysicsReasoner usable for its geometric predicates, without
+    initializing the client nor the simulator
+
+    The predicates use neither pybullet nor tf, so the script is loaded with
+    placeholders for them when they are not installed, only aabb needing tf.
+    """
+    placeholders = {}
+    if not is_installed("pybullet"):
+        placeholders["pybullet"] = MissingModule("pybullet")
+    if not is_installed("tf"):
+        placeholders["tf"] = MissingModule("tf")
+        placeholders["tf.transformations"] = placeholders["tf"].transformations = MissingModule("tf.transformations")
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "physics_reasoner.py")
+    sys.modules.update(placeholders)
+    try:
+        module = imp.load_source("physics_reasoner", path)
+    finally:
+        for name in placeholders:
+            del sys.modules[name]
+    return object.__new__(module.PhysicsReasoner)
+
+
+def axis_aligned_bb(node):
+    """
+    Return the bounding box of a synthetic mesh, whose orientation is the identity
+    """
+    size = np.array([float(v) for v in [p.data for p in node.properties if p.name == "aabb"][0].split(",")])
+    position = node.position.pose.position
+    center = np.array([position.x, position.y, position.z])
+    return center - size / 2, center + size / 2
+
+
+@benchmark("PhysicsReasoner.aabb")
+def bench_physics_aabb(size, ops):
+    reasoner = physics_reasoner()
+    nodes = [n for n in synthetic_nodes(size) if n.type == MESH][:ops]
+
+    def run(reasoner):
+        for node in nodes:
+            reasoner.aabb(node)
+    return lambda: reasoner, run, len(nodes)
+
+
+@benchmark("PhysicsReasoner.isin/isontop")
+def bench_physics_predicates(size, ops):
+    reasoner = physics_reasoner()
+    nodes = [n for n in synthetic_nodes(size) if n.type == MESH]
+    # the boxes computed without aabb, which needs tf
+    bbs = [axis_aligned_bb(n) for n in nodes[:ops]]
+    pairs = [(bbs[i], bbs[(i + 1) % len(bbs)]) for i in range(0, len(bbs))]
+
+    def run(reasoner):
+        for bb1, bb2 in pairs:
+            reasoner.isin(bb1, bb2)
+            reasoner.isontop(bb1, bb2)
+    return lambda: reasoner, run, len(pairs)
+
+
+def measure(setup, run, nb_ops, repeat):
+    timings = []
+    for i in range(0, repeat):
+        state = setup()
+        start = time.time()
+        run(state)
+        timings.append(time.time() - start)
+        if hasattr(state, "close"):
+            state.close()
+    timings.sort()
+    return {"ops": nb_ops,
+            "min": timings[0],
+            "median": timings[len(timings) // 2],
+            "min_per_op": timings[0] / max(nb_ops, 1)}
+
+
+def run_benchmarks(sizes, ops, repeat, selection=None):
+    results = {}
+    for name, function in BENCHMARKS:
+        if selection is not None and not any(s in name for s in selection):
+            continue
+        results[name] = {}
+        for size in sizes:
+            try:
+                case = function(size, ops)
+                setup, run, nb_ops = case[:3]
+                results[name][str(size)] = measure(setup, run, nb_ops, repeat)
+                print("%-32s %8d nodes : %12.3f us/op" % (name, size, results[name][str(size)]["min_per_op"] * 1e6))
+                # the benchmarks may return some metrics besides the timings
+                if len(case) > 3:
+                    results[name][str(size)].update(case[3])
+                    print("%-32s %14s : %s" % ("", "", ", ".join("%s %.4g" % (k, v) for k, v in sorted(case[3].items()))))
+            except Exception as e:
+                results[name][str(size)] = {"error": str(e)}
+                print("%-32s %8d nodes : skipped (%s)" % (name, size, e))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return the benchmarks slower than the baseline by more than the tolerance,
+    and the ones that could not be compared with the reason why
+    """
+    regressions = []
+    unchecked = []
+    for name, by_size in sorted(results.items()):
+        for size, result in sorted(by_size.items(), key=lambda item: int(item[0])):
+            reference = baseline.get("results", {}).get(name, {}).get(size)
+            if reference is None:
+                unchecked.append((name, size, "missing from the baseline"))
+            elif "min_per_op" not in reference:
+                unchecked.append((name, size, "errored in the baseline (%s)" % reference.get("error", "no timing")))
+            elif "min_per_op" not in result:
+                unchecked.append((name, size, "errored (%s)" % result.get("error", "no timing")))
+            else:
+                ratio = result["min_per_op"] / max(reference["min_per_op"], 1e-12)
+                if ratio > 1.0 + tolerance:
+                    regressions.append((name, size, ratio))
+    return regressions, unchecked
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the pyuwds hot paths over synthetic scenes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="The scene sizes (number of nodes)")
+    parser.add_argument("--ops", type=int, default=DEFAULT_OPS, help="The maximum number of operations timed per run")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="The number of runs, the fastest is kept")
+    parser.add_argument("--only", nargs="+", default=None, help="Only run the benchmarks whose name contains one of these strings")
+    parser.add_argument("--output", default="", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default="", help="Compare the results against this JSON file")
+    parser.add_argument("--save-baseline", default="", help="Write the results as a new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="The relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    results = {"meta": {"python": platform.python_version(),
+                        "machine": platform.machine(),
+                        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        "sizes": args.sizes,
+                        "ops": args.ops,
+                        "repeat": args.repeat},
+               "results": run_benchmarks(args.sizes, args.ops, args.repeat, args.only)}
+
+    for path in [args.output, args.save_baseline]:
+        if path != "":
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline != "":
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions, unchecked = compare(results["results"], baseline, args.tolerance)
+        for name, size, reason in unchecked:
+            print("UNCHECKED  %-32s %8s nodes : %s" % (name, size, reason))
+        for name, size, ratio in regressions:
+            print("REGRESSION %-32s %8s nodes : x%.2f" % (name, size, ratio))
+        if len(regressions) > 0:
+            sys.exit(1)
@@ -8,9 +8,8 @@ from pyuwds.uwds import READER
 from pyuwds.types.nodes import CAMERA, MESH, ENTITY
 from pyuwds.types.situations import FACT, ACTION, GENERIC, INTERNAL
 from pyuwds.tools.glove import GloveManager
-
-def getDictValue(elem):
-    return elem[1]
+from pyuwds.tools.semantic_index import SemanticIndex
+from pyuwds.tools.ann import LSHIndex
 
 
 class UwdsKBLite(UwdsClient):
@@ -21,13 +20,70 @@ class UwdsKBLite(UwdsClient):
         words_to_keep = rospy.get_param("~words_to_keep", "in on under above was below").split(" ")
         dim = rospy.get_param("~dim", 300)
         stoplist = rospy.get_param("~stop_list", 50)
-        self.__glove = GloveManager(self.__data_dir+"/glove/glove.6B."+str(dim)+"d.txt", stoplist=stoplist, keep=words_to_keep)
+        cache_dir = rospy.get_param("~glove_cache_dir", "")
+        quantization = rospy.get_param("~glove_quantization", "")
+        self.__glove = GloveManager(self.__data_dir+"/glove/glove.6B."+str(dim)+"d.txt", stoplist=stoplist, keep=words_to_keep,
+                                    cache_dir=cache_dir if cache_dir != "" else None,
+                                    quantization=quantization if quantization != "" else None)
         rospy.loginfo("["+self.ctx.name()+"::queryKnowledgeBase] Underworlds KB ready !")
-        self.__query_service = rospy.Service("uwds/query_knowledge_base", QueryInContext, self.handle_query)
+        self.__query_service = rospy.Service("uwds/query_knowledge_base", QueryInContext, self.profiler.wrap(self.handle_query))
         self.__latent_dim = rospy.get_param("~latent_dim", 128)
+        self.__top_k = rospy.get_param("~top_k", 0)
+        # approximate search of the worlds with tens of thousands of elements, exact if 0 tables
+        self.__ann_tables = rospy.get_param("~ann_tables", 0)
+        self.__ann_bits = rospy.get_param("~ann_bits", 12)
+        self.__ann_probes = rospy.get_param("~ann_probes", 2)
+        self.__indexes = {}
 
     def onChanges(self, world_name, header, invalidations):
-        pass
+        index = self.__indexes[world_name]
+        scene = self.ctx.worlds()[world_name].scene()
+        timeline = self.ctx.worlds()[world_name].timeline()
+        for node_id in invalidations.node_ids_deleted:
+            index.remove(node_id)
+        for situation_id in invalidations.situation_ids_deleted:
+            index.remove(situation_id)
+        nodes = [scene.nodes()[node_id] for node_id in invalidations.node_ids_updated]
+        index.update_many([node.id for node in nodes], [node.name for node in nodes])
+        self.index_situations(world_name, [timeline.situations()[situation_id] for situation_id in invalidations.situation_ids_updated])
+
+    def index_world(self, world_name):
+        """
+        Index the node names and the active situations of a world, then follow its changes
+        """
+        ann = None
+        if self.__ann_tables > 0:
+            ann = LSHIndex(self.__glove.vector_dim, self.__ann_tables, self.__ann_bits, self.__ann_probes)
+        index = SemanticIndex(self.__glove, preprocess=self.clean_sentence, ann=ann)
+        self.__indexes[world_name] = index
+        scene = self.ctx.worlds()[world_name].scene()
+        timeline = self.ctx.worlds()[world_name].timeline()
+        self.ctx.worlds()[world_name].connect(self.profiler.wrap(self.onChanges))
+        nodes = list(scene.nodes())
+        index.update_many([node.id for node in nodes], [node.name for node in nodes])
+        self.index_situations(world_name, list(timeline.situations()))
+        rospy.loginfo("[%s::indexWorld] <%s> indexed : %d nodes and situations" % (self.ctx.name(), world_name, len(index)))
+
+    def index_situations(self, world_name, situations):
+        """
+        Index the active situations by their subject, remove the others
+        """
+        index = self.__indexes[world_name]
+        timeline = self.ctx.worlds()[world_name].timeline()
+        ids = []
+        descriptions = []
+        subjects = []
+        for situation in situations:
+            subject = ""
+            if situation.end.data == rospy.Time(0):
+                subject = timeline.situations().get_situation_property(situation.id, "subject")
+            if subject != "":
+                ids.append(situation.id)
+                descriptions.append(situation.description)
+                subjects.append(subject)
+            else:
+                index.remove(situation.id)
+        index.update_many(ids, descriptions, subjects)
 
     def clean_sentence(self, sentence):
         sentence = sentence.replace("_", " ").replace(".", " ").replace("-", " ").lower()
@@ -57,33 +113,29 @@ class UwdsKBLite(UwdsClient):
     def query_knowledge_base(self, world_name, query):
         """
         """
+        if world_name not in self.__indexes:
+            self.index_world(world_name)
         scene = self.ctx.worlds()[world_name].scene()
-        timeline = self.ctx.worlds()[world_name].timeline()
-
-        node_id_to_score = {}
 
         result = []
-
-        for node in scene.nodes():
-            node_id_to_score[node.id] = self.match(node.name, query)
-        for situation in timeline.situations():
-            if situation.end.data == rospy.Time(0):
-                subject = timeline.situations().get_situation_property(situation.id, "subject")
-                if subject != "":
-                    score = self.match(situation.description, query)
-                    if subject in node_id_to_score:
-                        if score > node_id_to_score[subject]:
-                            node_id_to_score[subject] = score
-
-        match = sorted(node_id_to_score.items(), reverse=True, key=getDictValue)
-
-        for id, score in match:
-            if score > self.__match_threshold:
+        # the situations whose subject is not a node of the scene are ignored
+        for id, score in self.__indexes[world_name].search(query, self.__match_threshold, self.__top_k):
+            if scene.nodes().has(id):
+                if(self.verbose):
+                    print "similarity("+id+" , "+self.clean_sentence(query)+") = "+ str(score)
                 result.append(id)
-            else:
-                return result
         return result
 
+    def handle_query(self, req):
+        """
+        """
+        try:
+            result = self.query_knowledge_base(req.ctxt.world, req.query)
+            return result, True, ""
+        except Exception as e:
+            rospy.logwarn("[%s::queryKnowledgeBase] Exception occurred : %s" % (self.ctx.name(), e))
+            return [], False, str(e)
+
 
 if __name__ == '__main__':
     rospy.init_node("uwds_kb_lite", anonymous=False)
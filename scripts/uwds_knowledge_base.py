@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
+from threading import Thread, Event, Lock
+from Queue import Queue, Empty
 import rospy
 from uwds_msgs.srv import QueryInContext
 from pyuwds.uwds_client import UwdsClient
@@ -10,168 +12,529 @@ from pyuwds.types.situations import FACT, ACTION, GENERIC, INTERNAL
 from pyoro import Oro
 from word_to_vector import WordVectorManager
 
+# the ingestion tasks merged in the same Oro batch
+MAX_MERGED_TASKS = 100
+
+
+def getProperty(element, property_name):
+    for property in element.properties:
+        if property.name == property_name:
+            return property.data
+    return ""
+
+
+class OroBatch(object):
+    """
+    The statements to add and remove, per agent, flushed with one call per agent and operation
+
+    The duplicates are dropped and a statement both added and removed in
+    the batch is only sent for the last operation.
+    """
+    def __init__(self):
+        self.__to_add = {}
+        self.__to_remove = {}
+
+    def __queue(self, queues, cancelled, agent, statements):
+        queue = queues.setdefault(agent, ([], set()))
+        cancel = cancelled.get(agent)
+        for statement in statements:
+            if cancel is not None and statement in cancel[1]:
+                cancel[1].discard(statement)
+                cancel[0].remove(statement)
+            if statement not in queue[1]:
+                queue[1].add(statement)
+                queue[0].append(statement)
+
+    def add(self, agent, statements):
+        self.__queue(self.__to_add, self.__to_remove, agent, statements)
+
+    def remove(self, agent, statements):
+        self.__queue(self.__to_remove, self.__to_add, agent, statements)
+
+    def flush(self, kb):
+        """
+        Send the statements, the removals first
+        """
+        for agent, (statements, _) in self.__to_remove.items():
+            if len(statements) > 0:
+                kb.removeForAgent(agent, statements)
+        for agent, (statements, _) in self.__to_add.items():
+            if len(statements) > 0:
+                kb.safeAddForAgent(agent, statements)
+        self.__to_add = {}
+        self.__to_remove = {}
+
+
+def oroAgent(world_name):
+    """
+    Return the Oro agent of a world, the namespace of its name
+    """
+    agent = world_name.split("/")[0]
+    return "myself" if agent == "robot" else agent
+
+
+class AgentStatements(object):
+    """
+    The statements asserted in Oro for an agent, counted over its worlds
+
+    The worlds of an agent share its Oro model, so a statement is only
+    added by the first world asserting it and removed by the last one
+    retracting it.
+    """
+    def __init__(self, agent):
+        self.agent = agent
+        self.references = {}
+
+    def __len__(self):
+        return len(self.references)
+
+    def acquire(self, statements):
+        """
+        Return the statements to add, the ones not asserted by another world of the agent
+        """
+        to_add = []
+        for statement in statements:
+            nb_references = self.references.get(statement, 0)
+            self.references[statement] = nb_references + 1
+            if nb_references == 0:
+                to_add.append(statement)
+        return to_add
+
+    def release(self, statements):
+        """
+        Return the statements to remove, the ones no more asserted by any world of the agent
+        """
+        to_remove = []
+        for statement in statements:
+            self.references[statement] -= 1
+            if self.references[statement] == 0:
+                del self.references[statement]
+                to_remove.append(statement)
+        return to_remove
+
+
+class WorldFacts(object):
+    """
+    The statements asserted in Oro for a world
+
+    They are tracked per node (types and label, side facts) and per
+    situation, so that they are retracted with their node or situation, or
+    all together when the world is unloaded. The statements returned are
+    the ones to send to Oro, counted with the other worlds of the agent.
+    """
+    def __init__(self, agent_statements):
+        self.agent = agent_statements.agent
+        self.agent_statements = agent_statements
+        self.nodes = {}
+        self.side_facts = {}
+        self.nb_side_facts = 0
+        # situation id -> (statement, subject, object)
+        self.situations = {}
+        # the number of situations asserting each statement
+        self.references = {}
+        # node id -> the ids of the situations about the node
+        self.node_situations = {}
+
+    def update_node(self, node_id, statements):
+        """
+        Return the statements to add and to remove for a created or updated node
+        """
+        statements = [s for i, s in enumerate(statements) if s not in statements[:i]]
+        previous = self.nodes.get(node_id, [])
+        self.nodes[node_id] = statements
+        to_add = [s for s in statements if s not in previous]
+        to_remove = [s for s in previous if s not in statements]
+        return self.agent_statements.acquire(to_add), self.agent_statements.release(to_remove)
+
+    def add_side_fact(self, node_id, statement):
+        """
+        Return the statements to add for a side fact of a node (isSupport...)
+        """
+        facts = self.side_facts.setdefault(node_id, set())
+        if statement in facts:
+            return []
+        facts.add(statement)
+        self.nb_side_facts += 1
+        return self.agent_statements.acquire([statement])
+
+    def remove_node(self, node_id):
+        """
+        Return the statements to remove with a node: its types, label, side facts and situations
+        """
+        to_remove = self.nodes.pop(node_id, [])
+        side_facts = self.side_facts.pop(node_id, set())
+        self.nb_side_facts -= len(side_facts)
+        to_remove += list(side_facts)
+        for situation_id in list(self.node_situations.get(node_id, [])):
+            to_remove += self.__retract_situation(situation_id)
+        return self.agent_statements.release(to_remove)
+
+    def assert_situation(self, situation_id, statement, subject, object):
+        """
+        Return the statements to add and to remove for an active situation
+        """
+        to_remove = []
+        if situation_id in self.situations:
+            if self.situations[situation_id][0] == statement:
+                return [], []
+            to_remove = self.__retract_situation(situation_id)
+        self.situations[situation_id] = (statement, subject, object)
+        for node_id in [subject, object]:
+            self.node_situations.setdefault(node_id, set()).add(situation_id)
+        self.references[statement] = self.references.get(statement, 0) + 1
+        to_add = [statement] if self.references[statement] == 1 else []
+        return self.agent_statements.acquire(to_add), self.agent_statements.release(to_remove)
+
+    def retract_situation(self, situation_id):
+        """
+        Return the statements to remove for an ended or deleted situation
+        """
+        return self.agent_statements.release(self.__retract_situation(situation_id))
+
+    def __retract_situation(self, situation_id):
+        if situation_id not in self.situations:
+            return []
+        statement, subject, object = self.situations.pop(situation_id)
+        for node_id in [subject, object]:
+            situation_ids = self.node_situations.get(node_id)
+            if situation_ids is not None:
+                situation_ids.discard(situation_id)
+                if len(situation_ids) == 0:
+                    del self.node_situations[node_id]
+        self.references[statement] -= 1
+        if self.references[statement] == 0:
+            del self.references[statement]
+            return [statement]
+        return []
+
+    def statements(self):
+        statements = list(self.references.keys())
+        for node_statements in self.nodes.values():
+            statements += node_statements
+        for side_facts in self.side_facts.values():
+            statements += list(side_facts)
+        return statements
+
+    def unload(self):
+        """
+        Return the statements to remove with the world
+        """
+        to_remove = self.agent_statements.release(self.statements())
+        self.nodes = {}
+        self.side_facts = {}
+        self.nb_side_facts = 0
+        self.situations = {}
+        self.references = {}
+        self.node_situations = {}
+        return to_remove
+
+    def sizes(self):
+        return {"nodes": len(self.nodes),
+                "side_facts": self.nb_side_facts,
+                "situations": len(self.situations),
+                "situation_statements": len(self.references)}
+
+
+class IngestionTask(object):
+    """
+    Changes of a world to assert, the snapshot of a world to load or its unloading
+    """
+    def __init__(self, world_name, nodes=[], node_ids_deleted=[], situations=[], situation_ids_deleted=[], loaded=None, unload=False):
+        self.world_name = world_name
+        self.nodes = nodes
+        self.node_ids_deleted = node_ids_deleted
+        self.situations = situations
+        self.situation_ids_deleted = situation_ids_deleted
+        self.loaded = loaded
+        self.unload = unload
+
+
 class KnowledgeBase(UwdsClient):
+    """
+    The Oro knowledge base of the Underworlds worlds
+
+    The changes are asserted by an ingestion worker with its own Oro
+    connection: onChanges only queues the changed elements, and the worker
+    merges the pending ones in a single batch. The queries are served by a
+    pool of other connections, so that they do not wait behind the
+    ingestion. The worlds of the topology are loaded in the background, a
+    query on a world not loaded yet waits for its loading, and the worlds
+    leaving the topology are unloaded with their statements.
+    """
     def __init__(self):
         UwdsClient.__init__(self, "uwds_knowledge_base", READER)
-        hostname = rospy.get_param("~oro_host", "localhost")
-        port = rospy.get_param("~oro_port", "6969")
+        self.__hostname = rospy.get_param("~oro_host", "localhost")
+        self.__port = rospy.get_param("~oro_port", "6969")
         self.ontology_path = rospy.get_param("~ontology_path", "")
-        success = False
-        while not success and not rospy.is_shutdown():
+        self.__bootstrap_timeout = rospy.get_param("~bootstrap_timeout", 10.0)
+        preload_period = rospy.get_param("~preload_period", 5.0)
+        # the ingestion connection, only used by the ingestion worker
+        self.kb = self.connectOro()
+        self.__query_connections = Queue()
+        for i in range(0, rospy.get_param("~nb_query_connections", 2)):
+            self.__query_connections.put(self.connectOro())
+        rospy.loginfo("Connected to the Oro knowledge base")
+
+        # updated by the ingestion worker only, the statistics read their sizes from the preload timer
+        self.__worlds_facts = {}
+        # Oro agent -> its AgentStatements, shared by the worlds of the agent
+        self.__agents_statements = {}
+
+        self.__loaded_worlds = {}
+        self.__loaded_worlds_mutex = Lock()
+        self.__ingestion_queue = Queue()
+        self.__ingestion_thread = Thread(target=self.ingestionWorker)
+        self.__ingestion_thread.daemon = True
+        self.__ingestion_thread.start()
+
+        if preload_period > 0:
+            self.handlePreloadTimer(None)
+            self.preload_timer = rospy.Timer(rospy.Duration(preload_period), self.profiler.wrap(self.handlePreloadTimer))
+        self.query_service = rospy.Service("uwds/query_knowledge_base", QueryInContext, self.profiler.wrap(self.handleQuery))
+        rospy.loginfo("Underworlds KB ready !")
+
+    def connectOro(self):
+        while not rospy.is_shutdown():
             try:
-                self.kb = Oro(hostname, int(port))
-                success = True
+                return Oro(self.__hostname, int(self.__port))
             except Exception as e:
                 pass
-        rospy.loginfo("Connected to the Oro knowledge base")
-        self.query_service = rospy.Service("uwds/query_knowledge_base", QueryInContext, self.handleQuery)
-        rospy.loginfo("Underworlds KB ready !")
 
-        self.__created_nodes = {}
-        self.__created_situations = {}
-        self.__support = {}
-        self.__graspable = {}
-        self.__container = {}
-
-    def addNode(self, world_name, node):
-        if world_name+node.id not in self.__created_nodes:
-            namespace = world_name.split("/")
-            agent = namespace[0]
-            world = namespace[1]
-            oro_agent = "myself" if agent == "robot" else agent
-            types = []
-            scene = self.ctx.worlds()[world_name].scene()
-
-            types_str = scene.nodes().get_node_property(node.id, "class")
-            if types_str != "":
-                types = types_str.split(",")
-            else:
-                if node.type == MESH: types.append("TangibleThing")
-                if node.type == ENTITY: types.append("LocalizedThing")
-                if node.type == CAMERA: types.append("ExistingThing")
+    def loadWorld(self, world_name):
+        """
+        Follow the changes of a world and queue the assertion of its scene and timeline
 
-            seq = []
-            for type in types:
-                seq.append(node.id+" rdf:type "+type)
-            seq.append(node.id+" rdfs:label "+node.name)
+        Return the event set once they are asserted.
+        """
+        self.__loaded_worlds_mutex.acquire()
+        if world_name in self.__loaded_worlds:
+            self.__loaded_worlds_mutex.release()
+            return self.__loaded_worlds[world_name]
+        loaded = Event()
+        self.__loaded_worlds[world_name] = loaded
+        self.__loaded_worlds_mutex.release()
+        scene = self.ctx.worlds()[world_name].scene()
+        timeline = self.ctx.worlds()[world_name].timeline()
+        # connected first, the changes received meanwhile are asserted again by the snapshot
+        self.ctx.worlds()[world_name].connect(self.profiler.wrap(self.onChanges))
+        nodes = [node for node in scene.nodes() if node.name != "root"]
+        situations = list(timeline.situations())
+        rospy.loginfo("[%s::loadWorld] <%s> : %d nodes and %d situations" % (self.ctx.name(), world_name, len(nodes), len(situations)))
+        self.__ingestion_queue.put(IngestionTask(world_name, nodes=nodes, situations=situations, loaded=loaded))
+        return loaded
 
-            self.kb.safeAddForAgent(oro_agent, seq)
+    def unloadWorld(self, world_name):
+        """
+        Queue the retraction of the statements of a world, it is loaded again by its next query
+        """
+        self.__loaded_worlds_mutex.acquire()
+        loaded = self.__loaded_worlds.pop(world_name, None)
+        self.__loaded_worlds_mutex.release()
+        if loaded is not None:
+            rospy.loginfo("[%s::unloadWorld] <%s> left the topology" % (self.ctx.name(), world_name))
+            self.__ingestion_queue.put(IngestionTask(world_name, unload=True))
+
+    def handlePreloadTimer(self, event):
+        worlds = self.ctx.topology().worlds()
+        for world_name in worlds:
+            # the knowledge base agent is the namespace of the world
+            if "/" in world_name and world_name not in self.__loaded_worlds:
+                self.loadWorld(world_name)
+        if len(worlds) > 0:
+            for world_name in list(self.__loaded_worlds.keys()):
+                if world_name not in worlds:
+                    self.unloadWorld(world_name)
+        for world_name, sizes in self.statistics().items():
+            rospy.logdebug("[%s::statistics] <%s> : %d nodes, %d side facts, %d situations" % (self.ctx.name(), world_name, sizes["nodes"], sizes["side_facts"], sizes["situations"]))
+
+    def statistics(self):
+        """
+        Return the number of tracked nodes, side facts and situations of each world
+        """
+        # items() copies the worlds at once, the ingestion worker may add or remove one meanwhile
+        return dict((world_name, facts.sizes()) for world_name, facts in self.__worlds_facts.items())
+
+    def ingestionWorker(self):
+        while not rospy.is_shutdown():
+            try:
+                tasks = [self.__ingestion_queue.get(timeout=0.5)]
+            except Empty:
+                continue
+            while len(tasks) < MAX_MERGED_TASKS:
+                try:
+                    tasks.append(self.__ingestion_queue.get_nowait())
+                except Empty:
+                    break
+            batch = OroBatch()
+            for task in tasks:
+                try:
+                    self.ingest(task, batch)
+                except Exception as e:
+                    rospy.logwarn("[%s::ingestion] Exception occurred while processing the changes of <%s> : %s" % (self.ctx.name(), task.world_name, e))
+            try:
+                batch.flush(self.kb)
+            except Exception as e:
+                rospy.logwarn("[%s::ingestion] Exception occurred while updating Oro : %s" % (self.ctx.name(), e))
+            for task in tasks:
+                if task.loaded is not None:
+                    task.loaded.set()
+
+    def ingest(self, task, batch):
+        if task.unload:
+            facts = self.__worlds_facts.pop(task.world_name, None)
+            if facts is not None:
+                self.remove(facts.agent, facts.unload(), batch)
+                # the counts are shared until the last world of the agent is unloaded
+                if not any(other.agent == facts.agent for other in self.__worlds_facts.values()):
+                    del self.__agents_statements[facts.agent]
+            return
+        if task.world_name not in self.__worlds_facts:
+            if task.loaded is None:
+                # the changes of an unloaded world
+                return
+            agent = oroAgent(task.world_name)
+            if agent not in self.__agents_statements:
+                self.__agents_statements[agent] = AgentStatements(agent)
+            self.__worlds_facts[task.world_name] = WorldFacts(self.__agents_statements[agent])
+        for node in task.nodes:
+            self.addNode(task.world_name, node, batch)
+        for node_id in task.node_ids_deleted:
+            self.removeNode(task.world_name, node_id, batch)
+        for situation in task.situations:
+            self.updateSituation(task.world_name, situation, batch)
+        for situation_id in task.situation_ids_deleted:
+            self.removeSituation(task.world_name, situation_id, batch)
+
+    def addNode(self, world_name, node, batch=None):
+        facts = self.__worlds_facts[world_name]
+        types = []
+
+        types_str = getProperty(node, "class")
+        if types_str != "":
+            types = types_str.split(",")
+        else:
+            if node.type == MESH: types.append("TangibleThing")
+            if node.type == ENTITY: types.append("LocalizedThing")
+            if node.type == CAMERA: types.append("ExistingThing")
 
-            self.__created_nodes[world_name+node.id] = True
+        seq = []
+        for type in types:
+            seq.append(node.id+" rdf:type "+type)
+        seq.append(node.id+" rdfs:label "+node.name)
+
+        # only the new statements of a renamed or re-classified node are sent
+        to_add, to_remove = facts.update_node(node.id, seq)
+        self.remove(facts.agent, to_remove, batch)
+        self.add(facts.agent, to_add, batch)
         return True
 
-    def removeNode(self, world_name, node_id):
+    def add(self, agent, statements, batch=None):
         """
+        Add the statements, now or with the batch
         """
-        pass
+        if len(statements) == 0:
+            return True
+        if batch is not None:
+            batch.add(agent, statements)
+        else:
+            self.kb.safeAddForAgent(agent, statements)
+        return True
 
-    def save(self):
-        self.kb.save(self.ontology_path)
+    def remove(self, agent, statements, batch=None):
+        """
+        Remove the statements, now or with the batch
+        """
+        if len(statements) == 0:
+            return True
+        if batch is not None:
+            batch.remove(agent, statements)
+        else:
+            self.kb.removeForAgent(agent, statements)
+        return True
 
-    def updateSituation(self, world_name, situation):
+    def removeNode(self, world_name, node_id, batch=None):
         """
+        Retract the types, label, side facts and situations of a deleted node
         """
-        success = False
-        namespace = world_name.split("/")
-        agent = namespace[0]
-        world = namespace[1]
-        oro_agent = "myself" if agent == "robot" else agent
+        facts = self.__worlds_facts[world_name]
+        return self.remove(facts.agent, facts.remove_node(node_id), batch)
 
-        timeline = self.ctx.worlds()[world_name].timeline()
+    def save(self):
+        self.kb.save(self.ontology_path)
 
-        subject = timeline.situations().get_situation_property(situation.id, "subject")
-        object = timeline.situations().get_situation_property(situation.id, "object")
+    def updateSituation(self, world_name, situation, batch=None):
+        """
+        """
+        facts = self.__worlds_facts[world_name]
 
+        subject = getProperty(situation, "subject")
+        object = getProperty(situation, "object")
 
         if situation.type == ACTION:
-            predicate = timeline.situations().get_situation_property(situation.id, "action")
+            predicate = getProperty(situation, "action")
         else:
-            predicate = timeline.situations().get_situation_property(situation.id, "predicate")
+            predicate = getProperty(situation, "predicate")
 
         if object == "":
             if predicate == "Pick" or predicate == "Place":
-                if subject not in self.__graspable:
-                    self.kb.safeAddForAgent(oro_agent, [subject+" isGraspable true"])
-                    self.__graspable[subject] = True
+                if subject != "":
+                    self.add(facts.agent, facts.add_side_fact(subject, subject+" isGraspable true"), batch)
             return True
 
         if predicate == "isOn":
-            if object not in self.__support:
-                self.kb.safeAddForAgent(oro_agent, [object+" isSupport true"])
-                self.__support[object] = True
+            self.add(facts.agent, facts.add_side_fact(object, object+" isSupport true"), batch)
 
         if predicate == "isIn":
-            if object not in self.__container:
-                self.kb.safeAddForAgent(oro_agent, [object+" isContainer true"])
-                self.__container[object] = True
+            self.add(facts.agent, facts.add_side_fact(object, object+" isContainer true"), batch)
 
-        situation_str = ""
-        if subject != "":
-            if predicate != "":
-                if object != "":
-                    situation_str = subject+" "+predicate+" "+object
+        if subject == "" or predicate == "":
+            return self.removeSituation(world_name, situation.id, batch)
+        situation_str = subject+" "+predicate+" "+object
 
-        if situation_str=="":
-            return
         if situation.end.data == rospy.Time(0):
-            if situation_str not in self.__created_situations:
-                if situation != "":
-                    if agent == "robot":
-                        success = self.kb.safeAddForAgent("myself", [situation_str])
-                    else:
-                        success = self.kb.safeAddForAgent(agent, [situation_str])
-                self.__created_situations[situation_str] = True
-            else:
-                return True
+            to_add, to_remove = facts.assert_situation(situation.id, situation_str, subject, object)
+            self.remove(facts.agent, to_remove, batch)
+            return self.add(facts.agent, to_add, batch)
         else:
-            if situation_str in self.__created_situations:
-                if situation_str != "":
-                    self.kb.removeForAgent(oro_agent, [situation_str])
-                    success = True
-                    del self.__created_situations[situation_str]
-            else:
-                return True
-        return success
+            return self.removeSituation(world_name, situation.id, batch)
+
+    def removeSituation(self, world_name, situation_id, batch=None):
+        """
+        Retract the statement of an ended or deleted situation
+        """
+        facts = self.__worlds_facts[world_name]
+        return self.remove(facts.agent, facts.retract_situation(situation_id), batch)
 
     def onChanges(self, world_name, header, invalidations):
         scene = self.ctx.worlds()[world_name].scene()
         timeline = self.ctx.worlds()[world_name].timeline()
-
-        for node_id in invalidations.node_ids_updated:
-            self.addNode(world_name, scene.nodes()[node_id])
-        for node_id in invalidations.node_ids_deleted:
-            self.removeNode(world_name, scene.nodes()[node_id])
-        for situation_id in invalidations.situation_ids_updated:
-            self.updateSituation(world_name, timeline.situations()[situation_id])
+        # the elements are taken now, the mirror may change before their ingestion
+        nodes = [scene.nodes()[node_id] for node_id in invalidations.node_ids_updated]
+        situations = [timeline.situations()[situation_id] for situation_id in invalidations.situation_ids_updated]
+        self.__ingestion_queue.put(IngestionTask(world_name, nodes=nodes, node_ids_deleted=list(invalidations.node_ids_deleted),
+                                                 situations=situations, situation_ids_deleted=list(invalidations.situation_ids_deleted)))
 
     def queryKnowledgeBase(self, world_name, query):
         """
         """
-        if not self.ctx.worlds().has(world_name):
-            scene = self.ctx.worlds()[world_name].scene()
-            timeline = self.ctx.worlds()[world_name].timeline()
-            self.ctx.worlds()[world_name].connect(self.onChanges)
-            rospy.loginfo("nb nodes : "+str(len(scene.nodes()))+" (root included)")
-            for node in scene.nodes():
-                if node.name != "root":
-                    self.addNode(world_name, node)
-            rospy.loginfo("nb situations : "+str(len(timeline.situations())))
-            for situation in timeline.situations():
-                self.updateSituation(world_name, situation)
-        namespace = world_name.split("/")
-        agent = namespace[0]
-        world = namespace[1]
+        loaded = self.loadWorld(world_name)
+        if not loaded.wait(self.__bootstrap_timeout):
+            rospy.logwarn("[%s::queryKnowledgeBase] <%s> is not loaded yet, the results may be partial" % (self.ctx.name(), world_name))
         result = []
         if(self.verbose):
             rospy.loginfo("Query the <"+world_name+"> world : "+query)
 
         result_final = []
-        oro_agent = "myself" if agent == "robot" else agent
+        oro_agent = oroAgent(world_name)
         query_seq = query.split(",")
-        if len(query_seq) > 1:
-            results = self.kb.findForAgent(oro_agent, query_seq[0].split(" ")[0], query_seq[1:])
-        else:
-            results = self.kb.findForAgent(oro_agent, query_seq[0].split(" ")[0], query_seq)
+        kb = self.__query_connections.get()
+        try:
+            if len(query_seq) > 1:
+                results = kb.findForAgent(oro_agent, query_seq[0].split(" ")[0], query_seq[1:])
+            else:
+                results = kb.findForAgent(oro_agent, query_seq[0].split(" ")[0], query_seq)
+        finally:
+            self.__query_connections.put(kb)
         for result in results:
             if self.ctx.worlds()[world_name].scene().nodes().has(result):
                 result_final.append(result)
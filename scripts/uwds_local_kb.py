@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import rospy
+from threading import Lock
+from uwds_msgs.srv import QueryInContext
+from pyuwds.uwds_client import UwdsClient
+from pyuwds.uwds import READER
+from pyuwds.types.nodes import CAMERA, MESH, ENTITY
+from pyuwds.types.situations import ACTION
+from pyuwds.proxy.knowledge_base_proxy import get_property
+from pyuwds.tools.triple_store import TripleStore
+
+
+class UwdsLocalKB(UwdsClient):
+    """
+    Answer the knowledge base queries of the worlds without Oro
+
+    The facts Oro would receive from the uwds_knowledge_base (the types and
+    label of the nodes, the active situations and their side facts) are
+    kept in a triple store per world, updated by the changes of the world.
+    The queries are conjunctive patterns over these facts, without any
+    ontology reasoning.
+    """
+    def __init__(self, transport=None):
+        super(UwdsLocalKB, self).__init__("uwds_knowledge_base", READER, transport)
+        self.__stores = {}
+        self.__stores_mutex = Lock()
+        self.__query_service = self.transport.service("uwds/query_knowledge_base", QueryInContext, self.profiler.wrap(self.handle_query))
+        rospy.loginfo("["+self.ctx.name()+"::queryKnowledgeBase] Underworlds local KB ready !")
+
+    def onChanges(self, world_name, header, invalidations):
+        store = self.__stores[world_name]
+        scene = self.ctx.worlds()[world_name].scene()
+        timeline = self.ctx.worlds()[world_name].timeline()
+        for node_id in invalidations.node_ids_deleted:
+            store.remove_triples(node_id)
+            store.remove_triples((node_id, "side"))
+        for situation_id in invalidations.situation_ids_deleted:
+            store.remove_triples(situation_id)
+        for node_id in invalidations.node_ids_updated:
+            self.update_node(store, scene.nodes()[node_id])
+        for situation_id in invalidations.situation_ids_updated:
+            self.update_situation(store, timeline.situations()[situation_id])
+
+    def load_world(self, world_name):
+        """
+        Return the store of a world, filled with its nodes and situations on the first call
+        """
+        self.__stores_mutex.acquire()
+        try:
+            if world_name in self.__stores:
+                return self.__stores[world_name]
+            store = TripleStore()
+            self.__stores[world_name] = store
+            scene = self.ctx.worlds()[world_name].scene()
+            timeline = self.ctx.worlds()[world_name].timeline()
+            self.ctx.worlds()[world_name].connect(self.profiler.wrap(self.onChanges))
+            for node in list(scene.nodes()):
+                self.update_node(store, node)
+            for situation in list(timeline.situations()):
+                self.update_situation(store, situation)
+            rospy.loginfo("[%s::loadWorld] <%s> loaded : %d facts" % (self.ctx.name(), world_name, len(store)))
+            return store
+        finally:
+            self.__stores_mutex.release()
+
+    def update_node(self, store, node):
+        types = []
+        types_str = get_property(node, "class")
+        if types_str != "":
+            types = types_str.split(",")
+        else:
+            if node.type == MESH: types.append("TangibleThing")
+            if node.type == ENTITY: types.append("LocalizedThing")
+            if node.type == CAMERA: types.append("ExistingThing")
+        triples = [(node.id, "rdf:type", type) for type in types]
+        triples.append((node.id, "rdfs:label", node.name))
+        store.set_triples(node.id, triples)
+
+    def update_situation(self, store, situation):
+        subject = get_property(situation, "subject")
+        object = get_property(situation, "object")
+        if situation.type == ACTION:
+            predicate = get_property(situation, "action")
+        else:
+            predicate = get_property(situation, "predicate")
+
+        # the side facts are kept with their node, as the uwds_knowledge_base does
+        if object == "":
+            if (predicate == "Pick" or predicate == "Place") and subject != "":
+                store.add_triples((subject, "side"), [(subject, "isGraspable", "true")])
+            # no fact without object, the one of a situation that lost its object is retracted
+            store.remove_triples(situation.id)
+            return
+        if predicate == "isOn":
+            store.add_triples((object, "side"), [(object, "isSupport", "true")])
+        if predicate == "isIn":
+            store.add_triples((object, "side"), [(object, "isContainer", "true")])
+
+        if subject != "" and predicate != "" and object != "" and situation.end.data == rospy.Time(0):
+            store.set_triples(situation.id, [(subject, predicate, object)])
+        else:
+            store.remove_triples(situation.id)
+
+    def query_knowledge_base(self, world_name, query):
+        """
+        """
+        store = self.load_world(world_name)
+        scene = self.ctx.worlds()[world_name].scene()
+        timeline = self.ctx.worlds()[world_name].timeline()
+        if(self.verbose):
+            rospy.loginfo("Query the <"+world_name+"> world : "+query)
+        result = []
+        # the facts of the situations about a deleted node may remain, has is a dict lookup
+        for id in store.query(query):
+            if scene.nodes().has(id) or timeline.situations().has(id):
+                result.append(id)
+        return result
+
+    def handle_query(self, req):
+        """
+        """
+        try:
+            result = self.query_knowledge_base(req.ctxt.world, req.query)
+            return result, True, ""
+        except Exception as e:
+            rospy.logwarn("[%s::queryKnowledgeBase] Exception occurred : %s" % (self.ctx.name(), e))
+            return [], False, str(e)
+
+
+if __name__ == '__main__':
+    rospy.init_node("uwds_local_kb", anonymous=False)
+    kb = UwdsLocalKB()
+    rospy.spin()
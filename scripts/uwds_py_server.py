@@ -0,0 +1,12 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import rospy
+from pyuwds.server import UnderworldsServer
+
+if __name__ == '__main__':
+    rospy.init_node("uwds_server", anonymous=False)
+    verbose = rospy.get_param("~verbose", True)
+    subscriber_buffer_size = rospy.get_param("~subscriber_buffer_size", 30)
+    server = UnderworldsServer(subscriber_buffer_size=subscriber_buffer_size, verbose=verbose)
+    rospy.spin()
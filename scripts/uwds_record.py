@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import rospy
+from pyuwds.tools.record import ChangesRecorder
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Record the initial state and the change stream of Underworlds worlds")
+    parser.add_argument("worlds", nargs="+", help="The worlds to record")
+    parser.add_argument("-o", "--output", default="uwds.rec", help="The record file")
+    parser.add_argument("--no_compress", action="store_true", help="Do not compress the records")
+    args = parser.parse_args(rospy.myargv()[1:])
+    rospy.init_node("uwds_record", anonymous=True)
+    recorder = ChangesRecorder(args.output, args.worlds, compress=not args.no_compress)
+    rospy.loginfo("[uwds_record] Recording <%s> in '%s'" % (", ".join(args.worlds), args.output))
+    rospy.spin()
+    recorder.close()
+    rospy.loginfo("[uwds_record] %d records written in '%s'" % (recorder.nb_records(), args.output))
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import imp
+import json
+import argparse
+from pyuwds.tools.record import ChangesReplayer
+
+
+def load_client_class(client):
+    """
+    Load a client class given as 'path/to/script.py:ClassName'
+    """
+    filename, class_name = client.rsplit(":", 1)
+    module = imp.load_source(os.path.splitext(os.path.basename(filename))[0], filename)
+    return getattr(module, class_name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a record of Underworlds change streams into a client, in-process")
+    parser.add_argument("record", help="The record file")
+    parser.add_argument("client", help="The client to feed, as 'path/to/script.py:ClassName'")
+    parser.add_argument("--speed", type=float, default=1.0, help="The replay speed factor, as fast as possible if <= 0")
+    parser.add_argument("--inputs", default=None, help="The input worlds of the client, all the recorded worlds by default")
+    parser.add_argument("--no_restamp", action="store_true", help="Keep the recorded stamps (the delays are not measured)")
+    parser.add_argument("--output", default=None, help="Write the results in a JSON file")
+    args = parser.parse_args()
+
+    client_class = load_client_class(args.client)
+    replayer = ChangesReplayer(args.record, params={"~default_inputs": args.inputs} if args.inputs is not None else None)
+    client = client_class()
+    results = replayer.replay(client, speed=args.speed, restamp=not args.no_restamp)
+    replayer.close()
+
+    print "%d messages, %d elements replayed in %.3fs : %.1f msgs/s, %.1f elements/s" % (results["messages"], results["elements"], results["duration"], results["messages_per_sec"], results["elements_per_sec"])
+    for world_name, statistics in sorted(results["worlds"].items()):
+        print "<%s> onChanges : mean %.3fms, p50 %.3fms, p90 %.3fms, p99 %.3fms, max %.3fms" % (world_name,
+            statistics["on_changes"]["mean"] * 1000.0, statistics["on_changes"]["p50"] * 1000.0,
+            statistics["on_changes"]["p90"] * 1000.0, statistics["on_changes"]["p99"] * 1000.0,
+            statistics["on_changes"]["max"] * 1000.0)
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
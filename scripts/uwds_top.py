@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import argparse
+from threading import Lock
+import rospy
+from std_msgs.msg import Header, String
+from uwds_msgs.msg import ChangesInContextStamped
+from uwds_msgs.srv import GetTopology
+from pyuwds.tools.statistics import WorldStatistics, nb_changes_elements, message_size
+
+Context = type(ChangesInContextStamped().ctxt)
+
+CLEAR = "\033[H\033[J"
+BOLD = "\033[1m"
+RESET = "\033[0m"
+
+
+class UwdsTop(object):
+    """
+    Live monitor of the Underworlds change streams
+
+    Subscribes to the change topic of every world of the topology without
+    deserializing the changes: only the header and the context are decoded
+    to attribute each message to its writer, the changed elements are only
+    counted on demand. The reader clients that
+    publish their statistics (~statistics_rate) are shown too.
+    """
+    def __init__(self, count_elements=False):
+        self.__count_elements = count_elements
+        self.__get_topology = rospy.ServiceProxy("uwds/get_topology", GetTopology)
+        self.__changes_subscribers = {}
+        self.__statistics_subscribers = {}
+        self.__worlds_statistics = {}
+        self.__writers_statistics = {}
+        self.__readers_statistics = {}
+        self.__mutex = Lock()
+
+    def update_topology(self):
+        try:
+            response = self.__get_topology()
+        except rospy.ServiceException as e:
+            rospy.logwarn("[uwds_top::updateTopology] Unable to get the topology : %s" % e)
+            return
+        for world_name in response.worlds:
+            if world_name and world_name not in self.__changes_subscribers:
+                self.__changes_subscribers[world_name] = rospy.Subscriber(world_name+"/changes", rospy.AnyMsg, self.changesCallback, callback_args=world_name, queue_size=50)
+        for client in response.clients:
+            if client.name and client.name not in self.__statistics_subscribers:
+                self.__statistics_subscribers[client.name] = rospy.Subscriber(client.name+"/statistics", String, self.statisticsCallback, callback_args=client.name, queue_size=1)
+
+    def changesCallback(self, msg, world_name):
+        now = rospy.Time.now()
+        # decode only the beginning of the message
+        header = Header()
+        header.deserialize(msg._buff)
+        ctxt = Context()
+        ctxt.deserialize(msg._buff[message_size(header):])
+        nb_elements = 0
+        if self.__count_elements:
+            changes_msg = ChangesInContextStamped()
+            changes_msg.deserialize(msg._buff)
+            nb_elements = nb_changes_elements(changes_msg.changes)
+        self.__mutex.acquire()
+        if world_name not in self.__worlds_statistics:
+            self.__worlds_statistics[world_name] = WorldStatistics()
+        if (world_name, ctxt.client.name) not in self.__writers_statistics:
+            self.__writers_statistics[(world_name, ctxt.client.name)] = WorldStatistics()
+        self.__mutex.release()
+        for statistics in [self.__worlds_statistics[world_name], self.__writers_statistics[(world_name, ctxt.client.name)]]:
+            if not header.stamp.is_zero():
+                statistics.delay.record((now - header.stamp).to_sec())
+            statistics.throughput.record(nb_elements, len(msg._buff))
+
+    def statisticsCallback(self, msg, client_name):
+        try:
+            self.__readers_statistics[client_name] = json.loads(msg.data)
+        except ValueError:
+            pass
+
+    def __throughput_row(self, name, statistics):
+        messages, elements, nb_bytes = statistics.throughput.rates()
+        average_size = nb_bytes / messages if messages > 0 else 0.0
+        return "%-40s %10.1f %12.1f %12.0f %10.2f %10.2f" % (name[:40], messages, elements, average_size,
+                                                             statistics.delay.mean() * 1000.0,
+                                                             statistics.delay.percentile(90) * 1000.0)
+
+    def render(self):
+        lines = [CLEAR + BOLD + "Underworlds top - %d worlds, %d writers" % (len(self.__worlds_statistics), len(self.__writers_statistics)) + RESET, ""]
+        columns = ("msgs/s", "elements/s", "avg size(B)", "delay(ms)", "p90(ms)")
+        lines.append(BOLD + "%-40s %10s %12s %12s %10s %10s" % (("WORLD",) + columns) + RESET)
+        for world_name in sorted(self.__worlds_statistics):
+            lines.append(self.__throughput_row(world_name, self.__worlds_statistics[world_name]))
+        lines.append("")
+        lines.append(BOLD + "%-40s %10s %12s %12s %10s %10s" % (("WRITER -> WORLD",) + columns) + RESET)
+        for world_name, client_name in sorted(self.__writers_statistics, key=lambda k: (k[1], k[0])):
+            lines.append(self.__throughput_row(client_name + " -> " + world_name, self.__writers_statistics[(world_name, client_name)]))
+        if len(self.__readers_statistics) > 0:
+            lines.append("")
+            lines.append(BOLD + "%-40s %10s %10s %12s %12s %10s" % ("READER <- WORLD", "msgs/s", "delay(ms)", "apply(ms)", "onChanges(ms)", "p90(ms)") + RESET)
+            for client_name in sorted(self.__readers_statistics):
+                for world_name, statistics in sorted(self.__readers_statistics[client_name].items()):
+                    lines.append("%-40s %10.1f %10.2f %12.3f %12.2f %10.2f" % ((client_name + " <- " + world_name)[:40],
+                                                                               statistics["throughput"]["messages_per_sec"],
+                                                                               statistics["delay"]["mean"] * 1000.0,
+                                                                               statistics["apply"]["mean"] * 1000.0,
+                                                                               statistics["on_changes"]["mean"] * 1000.0,
+                                                                               statistics["on_changes"]["p90"] * 1000.0))
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Live monitor of the Underworlds worlds update rates and clients costs")
+    parser.add_argument("--rate", type=float, default=1.0, help="The refresh rate in Hz")
+    parser.add_argument("--topology_period", type=float, default=5.0, help="The period in seconds between the topology updates")
+    parser.add_argument("--elements", action="store_true", help="Count the changed elements (deserialize the changes)")
+    args = parser.parse_args(rospy.myargv()[1:])
+    rospy.init_node("uwds_top", anonymous=True)
+    rospy.wait_for_service("uwds/get_topology")
+    top = UwdsTop(count_elements=args.elements)
+    last_topology_update = None
+    rate = rospy.Rate(args.rate)
+    while not rospy.is_shutdown():
+        if last_topology_update is None or (rospy.Time.now() - last_topology_update).to_sec() > args.topology_period:
+            top.update_topology()
+            last_topology_update = rospy.Time.now()
+        top.render()
+        try:
+            rate.sleep()
+        except rospy.ROSInterruptException:
+            break
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import argparse
+from pyuwds.tools.tracing import load_events
+from pyuwds.tools.statistics import Histogram
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarize the per-hop latencies of an Underworlds spans file (~trace_file)")
+    parser.add_argument("trace_file", help="The spans file written by the clients")
+    parser.add_argument("--chrome", default=None, help="Convert the spans into a Chrome trace file (chrome://tracing, Perfetto)")
+    args = parser.parse_args()
+
+    events = load_events(args.trace_file)
+    if args.chrome is not None:
+        with open(args.chrome, "w") as chrome_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, chrome_file)
+
+    process_names = {}
+    for event in events:
+        if event["ph"] == "M" and event["name"] == "process_name":
+            process_names[event["pid"]] = event["args"]["name"]
+
+    hops = {}
+    traces = {}
+    for event in events:
+        if event["ph"] != "X":
+            continue
+        hop = (process_names.get(event["pid"], str(event["pid"])), event["name"])
+        if hop not in hops:
+            hops[hop] = Histogram()
+        hops[hop].record(event["dur"] / 1e6)
+        start, end = traces.get(event["args"]["trace_id"], (event["ts"], event["ts"] + event["dur"]))
+        traces[event["args"]["trace_id"]] = (min(start, event["ts"]), max(end, event["ts"] + event["dur"]))
+
+    print "%-24s %-40s %8s %10s %10s %10s" % ("CLIENT", "SPAN", "COUNT", "MEAN(ms)", "P90(ms)", "MAX(ms)")
+    for (client_name, span_name), histogram in sorted(hops.items(), key=lambda h: -h[1].mean()):
+        statistics = histogram.to_dict()
+        print "%-24s %-40s %8d %10.3f %10.3f %10.3f" % (client_name[:24], span_name[:40], statistics["count"],
+                                                        statistics["mean"] * 1000.0, statistics["p90"] * 1000.0, statistics["max"] * 1000.0)
+    end_to_end = Histogram()
+    for start, end in traces.values():
+        end_to_end.record((end - start) / 1e6)
+    print "\n%d traces, end-to-end : mean %.3fms, p90 %.3fms, max %.3fms" % (end_to_end.count(), end_to_end.mean() * 1000.0,
+                                                                              end_to_end.percentile(90) * 1000.0, end_to_end.to_dict()["max"] * 1000.0)
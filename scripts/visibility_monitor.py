@@ -5,6 +5,7 @@ import rospy
 import math
 import uuid
 import numpy
+import multiprocessing
 import pybullet as p
 import pybullet_data
 from pyuwds.reconfigurable_client import ReconfigurableClient
@@ -14,20 +15,254 @@ from pyuwds.types.situations import FACT
 from pyuwds.uwds import FILTER
 import tf
 
+def clipCorners(view_matrix, proj_matrix, aabb_mins, aabb_maxs):
+    """
+    Return the (N, 8, 4) clip coordinates of the corners of N bounding boxes
+    """
+    aabb_mins = numpy.asarray(aabb_mins, dtype=numpy.float64).reshape((-1, 3))
+    aabb_maxs = numpy.asarray(aabb_maxs, dtype=numpy.float64).reshape((-1, 3))
+    corners = numpy.ones((len(aabb_mins), 8, 4))
+    for corner in range(0, 8):
+        for axis in range(0, 3):
+            corners[:, corner, axis] = aabb_maxs[:, axis] if corner & (1 << axis) else aabb_mins[:, axis]
+    # the bullet matrices are column-major
+    matrix = numpy.dot(numpy.reshape(proj_matrix, (4, 4)).T, numpy.reshape(view_matrix, (4, 4)).T)
+    return numpy.dot(corners, matrix.T)
+
+
+def inFrustum(clip):
+    """
+    Return the mask of the bounding boxes that may be in the frustum, the
+    others having all their corners out of the same clipping plane
+    """
+    w = clip[:, :, 3:4]
+    outside = numpy.all(clip[:, :, :3] > w, axis=1) | numpy.all(clip[:, :, :3] < -w, axis=1)
+    return ~numpy.any(outside, axis=1)
+
+
+def aabbInFrustum(view_matrix, proj_matrix, aabb):
+    """
+    Return False if the bounding box is out of the frustum of the (OpenGL) matrices, True if it may be in it
+    """
+    return bool(inFrustum(clipCorners(view_matrix, proj_matrix, [aabb[0]], [aabb[1]]))[0])
+
+
+def subWindowProjection(proj_matrix, col_min, row_min, col_max, row_max, width, height):
+    """
+    Return the projection rendering the given pixels of the image of proj_matrix, the row 0 being the top of the image
+    """
+    left = 2.0 * col_min / width - 1.0
+    right = 2.0 * col_max / width - 1.0
+    top = 1.0 - 2.0 * row_min / height
+    bottom = 1.0 - 2.0 * row_max / height
+    # maps the window to the normalized device coordinates
+    window = numpy.array([[2.0 / (right - left), 0.0, 0.0, -(right + left) / (right - left)],
+                          [0.0, 2.0 / (top - bottom), 0.0, -(top + bottom) / (top - bottom)],
+                          [0.0, 0.0, 1.0, 0.0],
+                          [0.0, 0.0, 0.0, 1.0]])
+    projection = numpy.dot(window, numpy.reshape(proj_matrix, (4, 4)).T)
+    return list(projection.T.flatten())
+
+
+class BulletScene(object):
+    """
+    A bullet client mirroring the meshes of a scene, rendered to find the nodes seen by the cameras
+    """
+    def __init__(self, ressource_folder):
+        p.connect(p.DIRECT) # Initialize bullet non-graphical version
+        p.setAdditionalSearchPath(ressource_folder)
+        self.root_id = None
+        self.node_id_map = {}
+        self.reverse_node_id_map = {}
+        self.bullet_lookup = None
+        self.distances_from_center = {}
+        # the bounding boxes of the bodies of the nodes
+        self.aabbs = {}
+        self.nb_culled_renders = 0
+
+    def update(self, root_id, node_id, name, node_type, position, orientation):
+        """
+        Load or move the body of a node, return True if its urdf was just loaded
+        """
+        if root_id not in self.node_id_map:
+            self.root_id = root_id
+            self.node_id_map[root_id] = p.loadURDF("plane.urdf")
+        if node_type == MESH:
+            if node_id not in self.node_id_map:
+                try:
+                    self.node_id_map[node_id] = p.loadURDF(name+".urdf", position, orientation)
+                except Exception as e:
+                    self.node_id_map[node_id] = -1
+                if self.node_id_map[node_id] > 0:
+                    self.reverse_node_id_map[self.node_id_map[node_id]] = node_id
+                    self.bullet_lookup = None
+                    self.aabbs[node_id] = p.getAABB(self.node_id_map[node_id])
+                    return True
+            else:
+                if self.node_id_map[node_id] > 0:
+                    p.resetBaseVelocity(self.node_id_map[node_id], [0.0, 0.0, 0.0], [0.0, 0.0, 0.0])
+                    p.resetBasePositionAndOrientation(self.node_id_map[node_id], position, orientation)
+                    self.aabbs[node_id] = p.getAABB(self.node_id_map[node_id])
+        else:
+            self.node_id_map[node_id] = -1
+        return False
+
+    def bodyAABB(self, node_id):
+        """
+        Return the bullet bounding box of a node, None if it has no body
+        """
+        if node_id in self.aabbs:
+            aabb_min, aabb_max = self.aabbs[node_id]
+            return tuple(aabb_min), tuple(aabb_max)
+        return None
+
+    def render(self, view_matrix, proj_matrix, width, height):
+        """
+        Return the width and height of the image and the mean distance from the center of each node seen
+
+        The bounding boxes of the nodes are first tested against the camera
+        frustum: the image is not rendered if none of them is in it,
+        otherwise only the pixels covered by their projection are rendered.
+        """
+        node_ids = [node_id for node_id in self.aabbs if node_id != self.root_id]
+        window = None
+        if len(node_ids) > 0:
+            clip = clipCorners(view_matrix, proj_matrix, [self.aabbs[n][0] for n in node_ids], [self.aabbs[n][1] for n in node_ids])
+            clip = clip[inFrustum(clip)]
+            if len(clip) == 0:
+                self.nb_culled_renders += 1
+                return width, height, {}
+            # the projection of the corners behind the camera is not bounded
+            if numpy.all(clip[:, :, 3] > 0.0):
+                ndc = clip[:, :, :2] / clip[:, :, 3:]
+                # with a pixel of margin for the rounding errors
+                window = (max(0, int(math.floor((ndc[:, :, 0].min() + 1.0) / 2.0 * width)) - 1),
+                          max(0, int(math.floor((1.0 - ndc[:, :, 1].max()) / 2.0 * height)) - 1),
+                          min(width, int(math.ceil((ndc[:, :, 0].max() + 1.0) / 2.0 * width)) + 1),
+                          min(height, int(math.ceil((1.0 - ndc[:, :, 1].min()) / 2.0 * height)) + 1))
+                if window[0] >= window[2] or window[1] >= window[3]:
+                    self.nb_culled_renders += 1
+                    return width, height, {}
+                if window == (0, 0, width, height):
+                    window = None
+        if window is None:
+            width, height, rgb, depth, seg = p.getCameraImage(width, height, viewMatrix=view_matrix, projectionMatrix=proj_matrix, flags = p.ER_SEGMENTATION_MASK_OBJECT_AND_LINKINDEX)
+            return width, height, self.analyseSegmentation(seg, width, height)
+        col_min, row_min, col_max, row_max = window
+        sub_proj_matrix = subWindowProjection(proj_matrix, col_min, row_min, col_max, row_max, width, height)
+        sub_width, sub_height, rgb, depth, sub_seg = p.getCameraImage(col_max - col_min, row_max - row_min, viewMatrix=view_matrix, projectionMatrix=sub_proj_matrix, flags = p.ER_SEGMENTATION_MASK_OBJECT_AND_LINKINDEX)
+        # the pixels out of the window are background
+        seg = -numpy.ones((height, width), dtype=numpy.int64)
+        seg[row_min:row_max, col_min:col_max] = numpy.asarray(sub_seg).reshape((sub_height, sub_width))
+        return width, height, self.analyseSegmentation(seg, width, height)
+
+    def analyseSegmentation(self, seg, width, height):
+        """
+        Return the mean distance from the center of each node seen in a segmentation mask
+        """
+        seg = numpy.asarray(seg).reshape((height, width))
+        mask = seg >= 0
+        bullet_ids = seg[mask] & ((1 << 24)-1)
+        distances = self.distancesFromCenter(width, height)[mask]
+        uwds_ids, lookup = self.bulletLookup()
+        # the bullet bodies that are not nodes of the scene are ignored
+        known = bullet_ids < len(lookup)
+        indexes = lookup[bullet_ids[known]]
+        distances = distances[known][indexes >= 0]
+        indexes = indexes[indexes >= 0]
+        # summed in the pixels order, like the former per pixel loop
+        nb_pixel = numpy.bincount(indexes, minlength=len(uwds_ids))
+        sum_distances = numpy.bincount(indexes, weights=distances, minlength=len(uwds_ids))
+        mean_distances_from_center = {}
+        for index in numpy.flatnonzero(nb_pixel):
+            mean_distances_from_center[uwds_ids[index]] = float(sum_distances[index] / nb_pixel[index])
+        return mean_distances_from_center
+
+    def distancesFromCenter(self, width, height):
+        """
+        Return the distance from the center of each pixel, computed once per resolution
+        """
+        if (width, height) not in self.distances_from_center:
+            col_dist = numpy.arange(0, width) / 2.0
+            self.distances_from_center[(width, height)] = numpy.tile(numpy.sqrt(col_dist*col_dist), (height, 1))
+        return self.distances_from_center[(width, height)]
+
+    def bulletLookup(self):
+        """
+        Return the uwds ids of the bullet bodies and the array mapping a bullet id to its index in them (-1 if none)
+        """
+        if self.bullet_lookup is None:
+            uwds_ids = []
+            lookup = -numpy.ones(max(self.reverse_node_id_map.keys() + [-1]) + 1, dtype=numpy.int64)
+            for bullet_id, uwds_id in self.reverse_node_id_map.items():
+                if uwds_id != self.root_id:
+                    lookup[bullet_id] = len(uwds_ids)
+                    uwds_ids.append(uwds_id)
+            self.bullet_lookup = (uwds_ids, lookup)
+        return self.bullet_lookup
+
+
+def renderWorker(connection, ressource_folder):
+    """
+    The loop of a render process, mirroring the scene with the updates
+    broadcast by the monitor and rendering the cameras it receives
+    """
+    bullet = BulletScene(ressource_folder)
+    while True:
+        try:
+            message, content = connection.recv()
+        except EOFError:
+            break
+        if message == "update":
+            try:
+                for update in content:
+                    bullet.update(*update)
+            except Exception as e:
+                # the mirror is out of date, the worker stops and the monitor renders its cameras
+                break
+        elif message == "render":
+            try:
+                connection.send(bullet.render(*content))
+            except Exception as e:
+                connection.send(e)
+        else:
+            break
+
+
 class VisibilityMonitor(ReconfigurableClient):
     def __init__(self):
         """
         """
         self.ressource_folder = rospy.get_param("~ressource_folder")
-        p.connect(p.DIRECT) # Initialize bullet non-graphical version
-        p.setAdditionalSearchPath(self.ressource_folder)
+        # the cameras are rendered by these processes, each with its own bullet client, if any
+        self.nb_workers = rospy.get_param("~nb_workers", 0)
+        # a worker not answering a render within this time (in seconds) is stopped, its cameras rendered here
+        self.render_timeout = rospy.get_param("~render_timeout", 1.0)
+        self.workers = []
+        self.camera_workers = {}
+        # forked before this process connects to bullet
+        for i in range(0, self.nb_workers):
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=renderWorker, args=(worker_connection, self.ressource_folder))
+            process.daemon = True
+            process.start()
+            # only the worker holds its end, so that its death is seen as the end of the pipe
+            worker_connection.close()
+            self.workers.append((process, connection))
+        self.bullet = BulletScene(self.ressource_folder)
         self.urdf_available = {}
-        self.node_id_map = {}
-        self.reverse_node_id_map = {}
         self.min_treshold = rospy.get_param("~min_treshold", 0.4)
         self.width = rospy.get_param("~width", 480/8)
         self.height = rospy.get_param("~height", 360/8)
+        # a camera moving less than these thresholds (in meters and radians) is not rendered again
+        self.pose_threshold = rospy.get_param("~pose_threshold", 0.01)
+        self.angle_threshold = rospy.get_param("~angle_threshold", 0.01)
+        # the pose and the visibilities of the last render of each camera
+        self.last_renders = {}
+        self.nb_renders = 0
+        self.nb_skipped_renders = 0
         super(VisibilityMonitor, self).__init__("visibility_monitor", FILTER)
+        rospy.on_shutdown(self.stopWorkers)
 
     def onReconfigure(self, worlds):
         """
@@ -48,27 +283,52 @@ class VisibilityMonitor(ReconfigurableClient):
         """
         changes = self.monitor(world_name, header, invalidations)
         if len(changes.situations_to_update) > 0:
-            self.ctx.worlds()[world_name+"_visibilities"].update(header, changes)
-            rospy.loginfo("[%s::onChanges] Changes send (%d situations) in world <%s>", self.node_name, len(changes.situations_to_update), "visibilities")
+            self.ctx.worlds()[world_name+"_visibilities"].update(changes, header)
+            rospy.logdebug("[%s::onChanges] Changes send (%d situations) in world <%s>" % (self.ctx.name(), len(changes.situations_to_update), world_name+"_visibilities"))
 
     def monitor(self, world_name, header, invalidations):
         """
         """
         changes = Changes()
+        # the bounding boxes of the objects before and after their move
+        moved_aabbs = []
+        updates = []
         for node_id in invalidations.node_ids_updated:
-            self.updateBulletNodes(world_name, node_id)
+            aabb_before = self.bullet.bodyAABB(node_id)
+            updates.append(self.updateBulletNodes(world_name, node_id))
+            aabb_after = self.bullet.bodyAABB(node_id)
+            if aabb_after != aabb_before:
+                moved_aabbs += [aabb for aabb in [aabb_before, aabb_after] if aabb is not None]
+        self.broadcast(updates)
 
-        evaluated = []
-        not_evaluated = []
+        cameras = []
+        to_render = []
+        poses = {}
         for node in self.ctx.worlds()[world_name].scene().nodes():
-            #if node_id in invalidations.node_ids_updated:
             if node.type == CAMERA:
-                if node.id in invalidations.node_ids_updated:
-                    visibilities = self.computeVisibilities(world_name, node.id)
-                    situations = self.updateSituations(world_name, header, node.id, visibilities)
-                    for situation in situations:
-                        changes.situations_to_update.append(situation)
-                    evaluated.append(node.id)
+                updated = node.id in invalidations.node_ids_updated
+                if self.isDirty(world_name, node, updated, moved_aabbs):
+                    to_render.append(node.id)
+                    poses[node.id] = self.cameraPose(node)
+                    self.nb_renders += 1
+                elif updated:
+                    self.nb_skipped_renders += 1
+                else:
+                    continue
+                cameras.append(node.id)
+
+        renders = self.renderCameras(world_name, to_render)
+        for camera_id in cameras:
+            if camera_id in renders:
+                visibilities = self.computeVisibilities(world_name, camera_id, *renders[camera_id])
+                self.last_renders[camera_id] = (poses[camera_id], dict(visibilities))
+            else:
+                # the previous render is still valid, the situations are updated as before
+                visibilities = dict(self.last_renders[camera_id][1])
+            situations = self.updateSituations(world_name, header, camera_id, visibilities)
+            for situation in situations:
+                changes.situations_to_update.append(situation)
+        rospy.logdebug("[%s::monitor] %d renders, %d skipped" % (self.ctx.name(), self.nb_renders, self.nb_skipped_renders))
 
         for node in self.ctx.worlds()[world_name].scene().nodes():
             if node.type == CAMERA:
@@ -78,67 +338,64 @@ class VisibilityMonitor(ReconfigurableClient):
                         changes.situations_to_update.append(situation)
         return changes
 
-    def computeVisibilities(self, world_name, camera_id):
+    def isDirty(self, world_name, camera_node, updated, moved_aabbs):
+        """
+        Return True if the camera has to be rendered again: it moved beyond
+        the thresholds, or an object moved in (or out of) its frustum
+        """
+        if camera_node.id not in self.last_renders:
+            return updated
+        if updated:
+            last_position, last_orientation = self.last_renders[camera_node.id][0]
+            position, orientation = self.cameraPose(camera_node)
+            if numpy.linalg.norm(numpy.subtract(position, last_position)) > self.pose_threshold:
+                return True
+            angle = 2.0 * math.acos(min(1.0, abs(numpy.dot(orientation, last_orientation))))
+            if angle > self.angle_threshold:
+                return True
+        if len(moved_aabbs) > 0:
+            view_matrix, proj_matrix = self.cameraMatrices(world_name, camera_node.id)
+            for aabb in moved_aabbs:
+                if aabbInFrustum(view_matrix, proj_matrix, aabb):
+                    return True
+        return False
+
+    def cameraPose(self, camera_node):
+        position = [camera_node.position.pose.position.x, camera_node.position.pose.position.y, camera_node.position.pose.position.z]
+        orientation = [camera_node.position.pose.orientation.x, camera_node.position.pose.orientation.y, camera_node.position.pose.orientation.z, camera_node.position.pose.orientation.w]
+        return position, orientation
+
+    def cameraMatrices(self, world_name, camera_id):
+        """
+        Return the view and projection matrices used to render a camera
+        """
+        camera_node = self.ctx.worlds()[world_name].scene().nodes()[camera_id]
+        position, orientation = self.cameraPose(camera_node)
+        euler = tf.transformations.euler_from_quaternion(orientation)
+        view_matrix = p.computeViewMatrixFromYawPitchRoll(position, -0.5, math.degrees(euler[2]), math.degrees(euler[1]), math.degrees(euler[1]), 2)
+        clipnear = float(self.ctx.worlds()[world_name].scene().nodes().get_node_property(camera_id, "clipnear"))
+        clipfar = float(self.ctx.worlds()[world_name].scene().nodes().get_node_property(camera_id, "clipfar"))
+        aspect = float(self.ctx.worlds()[world_name].scene().nodes().get_node_property(camera_id, "aspect"))
+        proj_matrix = p.computeProjectionMatrixFOV(40.0, aspect, clipnear, clipfar)
+        return view_matrix, proj_matrix
+
+    def computeVisibilities(self, world_name, camera_id, width, height, mean_distances_from_center):
         """
         """
         visibilities = {}
-        mean_distances_from_center = {}
-        nb_pixel = {}
-        relative_sizes = {}
         if camera_id in self.ctx.worlds()[world_name].scene().nodes():
-            camera_node = self.ctx.worlds()[world_name].scene().nodes()[camera_id]
-            position = [camera_node.position.pose.position.x, camera_node.position.pose.position.y, camera_node.position.pose.position.z]
-            orientation = [camera_node.position.pose.orientation.x, camera_node.position.pose.orientation.y, camera_node.position.pose.orientation.z, camera_node.position.pose.orientation.w]
-            euler = tf.transformations.euler_from_quaternion(orientation)
-            view_matrix = p.computeViewMatrixFromYawPitchRoll(position, -0.5, math.degrees(euler[2]), math.degrees(euler[1]), math.degrees(euler[1]), 2)
-            fov = float(self.ctx.worlds()[world_name].scene().nodes().get_node_property(camera_id, "hfov"))
-            clipnear = float(self.ctx.worlds()[world_name].scene().nodes().get_node_property(camera_id, "clipnear"))
-            clipfar = float(self.ctx.worlds()[world_name].scene().nodes().get_node_property(camera_id, "clipfar"))
-            aspect = float(self.ctx.worlds()[world_name].scene().nodes().get_node_property(camera_id, "aspect"))
-            proj_matrix = p.computeProjectionMatrixFOV(40.0, aspect, clipnear, clipfar)
-            width, height, rgb, depth, seg = p.getCameraImage(self.width, self.height, viewMatrix=view_matrix, projectionMatrix=proj_matrix, flags = p.ER_SEGMENTATION_MASK_OBJECT_AND_LINKINDEX)
-            max_nb_pixel = 0
-            background_nb_pixel = 0
-            max_visibility = 0
             r = min(width, height)
-            for line in range(0, height):
-                for col in range(0, width):
-                    pixel = seg[line][col]
-                    if (pixel >= 0):
-                        bullet_id = pixel & ((1 << 24)-1)
-                        if bullet_id in self.reverse_node_id_map:
-                            uwds_id = self.reverse_node_id_map[bullet_id]
-                            if uwds_id != self.ctx.worlds()[world_name].scene().root_id():
-                                if uwds_id not in mean_distances_from_center:
-                                    mean_distances_from_center[uwds_id] = 0.0
-                                line_dist = (line-(line/2.0))
-                                col_dist = (col-(col/2.0))
-                                #dist_from_center = math.sqrt(line_dist*line_dist+col_dist*col_dist)
-                                dist_from_center = math.sqrt(col_dist*col_dist)
-                                mean_distances_from_center[uwds_id] += dist_from_center
-                                if uwds_id not in nb_pixel:
-                                    nb_pixel[uwds_id] = 0
-                                nb_pixel[uwds_id] += 1
-                                if uwds_id not in visibilities:
-                                    visibilities[uwds_id] = 0
-                                visibilities[uwds_id] += 1 - min(1, dist_from_center/r)
-                                if max_visibility < visibilities[uwds_id]:
-                                    max_visibility = visibilities[uwds_id]
-                    else:
-                        background_nb_pixel += 1.0
-
             if len(mean_distances_from_center) > 0:
-                print "camera <%s> :" % self.worlds[world_name].scene.nodes[camera_id].name
+                nodes = self.ctx.worlds()[world_name].scene().nodes()
+                rospy.logdebug("[%s::monitor] camera <%s> :" % (self.ctx.name(), nodes[camera_id].name))
                 for node_id, mean_dist in mean_distances_from_center.items():
-                    mean_distances_from_center[node_id] = mean_dist / nb_pixel[node_id]
-                    camera_node = self.worlds[world_name].scene.nodes[camera_id]
-                    object_node = self.worlds[world_name].scene.nodes[node_id]
-                    if mean_distances_from_center[node_id] < r:
-                        visibilities[node_id] = 1 - mean_distances_from_center[node_id]/r
+                    object_node = nodes[node_id]
+                    if mean_dist < r:
+                        visibilities[node_id] = 1 - mean_dist/r
                     else:
                         visibilities[node_id] = 0
                     if visibilities[node_id] > self.min_treshold:
-                        print " - see object <%s> with %5f confidence" % (object_node.name, visibilities[node_id])
+                        rospy.logdebug("[%s::monitor]  - see object <%s> with %5f confidence" % (self.ctx.name(), object_node.name, visibilities[node_id]))
                     else:
                         del visibilities[node_id]
         return visibilities
@@ -157,20 +414,21 @@ class VisibilityMonitor(ReconfigurableClient):
                     if camera_id == subject_id:
                         if object_id in visibilities:
                             situation.confidence = visibilities[object_id]
-                            print "update : %s with %f confidence" % (situation.description, visibilities[object_id])
+                            rospy.logdebug("[%s::monitor] update : %s with %f confidence" % (self.ctx.name(), situation.description, visibilities[object_id]))
                             del visibilities[object_id]
                             situations_to_update.append(situation)
                         else:
                             situation.end.data = header.stamp
-                            print "end : %s" % situation.description
+                            rospy.logdebug("[%s::monitor] end : %s" % (self.ctx.name(), situation.description))
                             situations_ids_ended.append(situation.id)
                         situations.append(situation)
 
+        nodes = self.ctx.worlds()[world_name].scene().nodes()
         for id_seen, visibility_score in visibilities.items():
             situation = Situation()
             situation.id = str(uuid.uuid4())
             situation.type = FACT
-            situation.description = self.worlds[world_name].scene.nodes[id_seen].name + " is visible by " + self.worlds[world_name].scene.nodes[camera_id].name
+            situation.description = nodes[id_seen].name + " is visible by " + nodes[camera_id].name
             predicate = Property()
             predicate.name = "predicate"
             predicate.data = "isVisibleBy"
@@ -198,28 +456,97 @@ class VisibilityMonitor(ReconfigurableClient):
     def updateBulletNodes(self, world_name, node_id):
         """ This function load the urdf corresponding to the uwds node and set it in the environment
         The urdf need to have the same name than the node name
-        :return:
+        :return: the update, to be applied by the render workers too
         """
-        if self.ctx.worlds()[world_name].scene().root_id() not in self.node_id_map:
-            self.node_id_map[self.ctx.worlds()[world_name].scene().root_id()] = p.loadURDF("plane.urdf")
         node = self.ctx.worlds()[world_name].scene().nodes()[node_id]
-        if node.type == MESH:
-            position = [node.position.pose.position.x, node.position.pose.position.y, node.position.pose.position.z]
-            orientation = [node.position.pose.orientation.x, node.position.pose.orientation.y, node.position.pose.orientation.z, node.position.pose.orientation.w]
-            if node_id not in self.node_id_map:
+        position = [node.position.pose.position.x, node.position.pose.position.y, node.position.pose.position.z]
+        orientation = [node.position.pose.orientation.x, node.position.pose.orientation.y, node.position.pose.orientation.z, node.position.pose.orientation.w]
+        update = (self.ctx.worlds()[world_name].scene().root_id(), node_id, node.name, node.type, position, orientation)
+        if self.bullet.update(*update):
+            rospy.loginfo("[%s::updateBulletNodes] "+node.name+".urdf' loaded successfully", self.ctx.name())
+        return update
+
+    def broadcast(self, updates):
+        """
+        Send the updates of the bullet bodies to the render workers, in one message per worker
+        """
+        if len(updates) > 0:
+            for process, connection in list(self.workers):
                 try:
-                    self.node_id_map[node_id] = p.loadURDF(node.name+".urdf", position, orientation)
-                    rospy.loginfo("[%s::updateBulletNodes] "+node.name+".urdf' loaded successfully", self.node_name)
-                except Exception as e:
-                    self.node_id_map[node_id] = -1
-                if self.node_id_map[node_id] > 0:
-                    self.reverse_node_id_map[self.node_id_map[node_id]] = node_id
+                    connection.send(("update", updates))
+                except (IOError, OSError) as e:
+                    self.dropWorker(connection, e)
+
+    def renderCameras(self, world_name, camera_ids):
+        """
+        Render the cameras, in parallel if there are render workers
+
+        @rtype: dict
+        @return: The width, height and mean distances from the center of the nodes seen, by camera
+        """
+        renders = {}
+        pending = []
+        for camera_id in camera_ids:
+            view_matrix, proj_matrix = self.cameraMatrices(world_name, camera_id)
+            if len(self.workers) == 0:
+                renders[camera_id] = self.bullet.render(view_matrix, proj_matrix, self.width, self.height)
             else:
-                if self.node_id_map[node_id] > 0:
-                    p.resetBaseVelocity(self.node_id_map[node_id], [0.0, 0.0, 0.0], [0.0, 0.0, 0.0])
-                    p.resetBasePositionAndOrientation(self.node_id_map[node_id], position, orientation)
-        else:
-            self.node_id_map[node_id] = -1
+                connection = self.cameraWorker(camera_id)
+                try:
+                    connection.send(("render", (view_matrix, proj_matrix, self.width, self.height)))
+                    pending.append((camera_id, connection, view_matrix, proj_matrix))
+                except (IOError, OSError) as e:
+                    self.dropWorker(connection, e)
+                    renders[camera_id] = self.bullet.render(view_matrix, proj_matrix, self.width, self.height)
+        # each worker answers its requests in order
+        for camera_id, connection, view_matrix, proj_matrix in pending:
+            render = None
+            if connection in self.camera_workers.values():
+                try:
+                    if connection.poll(self.render_timeout):
+                        render = connection.recv()
+                    else:
+                        self.dropWorker(connection, "no render after %.1fs" % self.render_timeout)
+                except (EOFError, IOError, OSError) as e:
+                    self.dropWorker(connection, e)
+            if render is None:
+                # the worker is dead or hung, the camera is rendered here
+                render = self.bullet.render(view_matrix, proj_matrix, self.width, self.height)
+            elif isinstance(render, Exception):
+                rospy.logerr("[%s::renderCameras] Exception occurred while rendering <%s> : %s" % (self.ctx.name(), camera_id, render))
+                render = (self.width, self.height, {})
+            renders[camera_id] = render
+        return renders
+
+    def cameraWorker(self, camera_id):
+        """
+        Return the connection to the worker rendering a camera, the cameras being distributed in turn
+        """
+        if camera_id not in self.camera_workers:
+            self.camera_workers[camera_id] = self.workers[len(self.camera_workers) % len(self.workers)][1]
+        return self.camera_workers[camera_id]
+
+    def dropWorker(self, connection, reason):
+        """
+        Stop a dead or hung worker, its cameras being distributed to the others or rendered here
+        """
+        for process, worker_connection in list(self.workers):
+            if worker_connection is connection:
+                rospy.logerr("[%s::renderCameras] Render worker %d stopped : %s" % (self.ctx.name(), process.pid, reason))
+                self.workers.remove((process, worker_connection))
+                if process.is_alive():
+                    process.terminate()
+                connection.close()
+        self.camera_workers = dict((camera_id, c) for camera_id, c in self.camera_workers.items() if c is not connection)
+
+    def stopWorkers(self):
+        for process, connection in self.workers:
+            try:
+                connection.send(("stop", None))
+            except (IOError, OSError):
+                pass
+        for process, connection in self.workers:
+            process.join(1.0)
 
 
 if __name__ == '__main__':
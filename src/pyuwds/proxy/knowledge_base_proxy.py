@@ -1,13 +1,50 @@
 from proxy import ServiceProxy
+from threading import Lock
 from uwds_msgs.msg import Invalidations
 from uwds_msgs.srv import QueryInContextRequest, QueryInContext
 from pyuwds.types.scene import Scene
+from pyuwds.tools.statistics import CacheStatistics
 import rospy
 
+KB_CACHE_NONE = "none"
+KB_CACHE_SITUATIONS = "situations"
+KB_CACHE_PREDICATES = "predicates"
+
+KB_CACHE_POLICIES = [KB_CACHE_NONE, KB_CACHE_SITUATIONS, KB_CACHE_PREDICATES]
+
+# the facts the knowledge base asserts besides the situations ones
+SIDE_PREDICATES = {"isOn": ["isSupport"], "isIn": ["isContainer"], "Pick": ["isGraspable"], "Place": ["isGraspable"]}
+NODE_PREDICATES = ["rdf:type", "rdfs:label"]
+
+
+def query_predicates(query):
+    """
+    Return the predicates of the patterns of an Oro query, or None if it may depend on any fact
+    """
+    patterns = query.split(",")
+    if len(patterns) > 1:
+        patterns = patterns[1:]
+    predicates = set()
+    for pattern in patterns:
+        tokens = pattern.split()
+        # not a "subject predicate object" pattern with a variable, e.g. a free text query
+        if len(tokens) != 3 or tokens[1].startswith("?") or not any(t.startswith("?") for t in tokens):
+            return None
+        predicates.add(tokens[1])
+    return predicates
+
+
+def get_property(element, property_name):
+    for property in element.properties:
+        if property.name == property_name:
+            return property.data
+    return ""
+
+
 class QueryKnowledgeBaseProxy(ServiceProxy):
 
-    def __init__(self, client, world_name):
-        super(QueryKnowledgeBaseProxy, self).__init__(client, 'uwds/query_knowledge_base', QueryInContext)
+    def __init__(self, client, world_name, transport=None):
+        super(QueryKnowledgeBaseProxy, self).__init__(client, 'uwds/query_knowledge_base', QueryInContext, transport)
         self.__world_name = world_name
 
     def _fill_request(self, query):
@@ -19,15 +56,137 @@ class QueryKnowledgeBaseProxy(ServiceProxy):
 
 
 class KnowledgeBaseProxy(object):
+    """
+    The knowledge base queries of a world, with an optional cache of their results
 
-    def __init__(self, client, world_name):
-        self.__query_proxy = QueryKnowledgeBaseProxy(client, world_name)
+    The cache is disabled by default ("none" policy). When enabled, the
+    results are cached per query and invalidated by the changes of the
+    world: with the "situations" policy, any situation change, node
+    creation, deletion or renaming drops the whole cache, with the
+    "predicates" policy only the queries using the predicates of the
+    changed facts are dropped. The knowledge base receives the same changes
+    asynchronously, so a query made right after a change may still return
+    (and cache) its former result, kept until the next invalidation: only
+    enable the cache for clients that tolerate such stale results.
+    """
+    def __init__(self, client, world_name, transport=None, cache_policy=KB_CACHE_NONE, statistics=None):
+        """
+        @type cache_policy: string
+        @param cache_policy: "none" (default), "situations" or "predicates"
+        @type statistics: CacheStatistics
+        @param statistics: The hit/miss counters to update
+        """
+        if cache_policy not in KB_CACHE_POLICIES:
+            raise ValueError("Unknown knowledge base cache policy '%s', expected one of %s" % (cache_policy, ", ".join(KB_CACHE_POLICIES)))
+        self.__query_proxy = QueryKnowledgeBaseProxy(client, world_name, transport)
+        self.__cache_policy = cache_policy
+        self.__statistics = statistics if statistics is not None else CacheStatistics()
+        self.__cache = {}
+        # incremented by each invalidation, so that the results of the queries running meanwhile are not cached
+        self.__generation = 0
+        self.__nb_running = 0
+        self.__mutex = Lock()
 
     def query_knowledge_base(self, query):
+        if self.__cache_policy == KB_CACHE_NONE:
+            result = self.__call(query)
+            return result if result is not None else []
+        self.__mutex.acquire()
+        entry = self.__cache.get(query)
+        generation = self.__generation
+        if entry is None:
+            self.__nb_running += 1
+        self.__mutex.release()
+        if entry is not None:
+            self.__statistics.record_hit()
+            return list(entry[0])
+        self.__statistics.record_miss()
+        try:
+            result = self.__call(query)
+        finally:
+            self.__mutex.acquire()
+            self.__nb_running -= 1
+            self.__mutex.release()
+        if result is not None:
+            predicates = query_predicates(query) if self.__cache_policy == KB_CACHE_PREDICATES else None
+            self.__mutex.acquire()
+            if generation == self.__generation:
+                self.__cache[query] = (list(result), predicates)
+            self.__mutex.release()
+            return result
+        return []
+
+    def __call(self, query):
         res = self.__query_proxy.call(query)
         if res is not None:
             if res.success is True:
                 return res.result
             else:
                 rospy.logerr("[%s::knowledge] Exception occured when processing '%s' query" % (self.__query_proxy.client.name, query))
-        return []
+        return None
+
+    def invalidate(self, changes, scene, timeline):
+        """
+        Drop the cached results the changes may affect, called before applying them
+
+        @type changes: Changes
+        @param changes: The received changes
+        @type scene: Scene
+        @param scene: The scene, not yet updated
+        @type timeline: Timeline
+        @param timeline: The timeline, not yet updated
+        """
+        if self.__cache_policy == KB_CACHE_NONE:
+            return
+        if len(self.__cache) == 0 and self.__nb_running == 0:
+            return
+        predicates = self.changed_predicates(changes, scene, timeline)
+        if len(predicates) == 0:
+            return
+        self.__mutex.acquire()
+        self.__generation += 1
+        if self.__cache_policy == KB_CACHE_SITUATIONS:
+            nb_invalidated = len(self.__cache)
+            self.__cache = {}
+        else:
+            invalidated = [query for query, (result, query_predicates) in self.__cache.items()
+                           if query_predicates is None or len(query_predicates & predicates) > 0]
+            for query in invalidated:
+                del self.__cache[query]
+            nb_invalidated = len(invalidated)
+        self.__mutex.release()
+        self.__statistics.record_invalidations(nb_invalidated)
+
+    def changed_predicates(self, changes, scene, timeline):
+        """
+        Return the predicates of the facts the changes may add or remove
+        """
+        predicates = set()
+        situations = list(changes.situations_to_update)
+        for situation_id in changes.situations_to_delete:
+            if timeline.situations().has(situation_id):
+                situations.append(timeline.situations()[situation_id])
+        for situation in situations:
+            for predicate in [get_property(situation, "predicate"), get_property(situation, "action")]:
+                if predicate != "":
+                    predicates.add(predicate)
+                    predicates.update(SIDE_PREDICATES.get(predicate, []))
+        if len(changes.nodes_to_delete) > 0:
+            predicates.update(NODE_PREDICATES)
+        else:
+            # the pose updates do not change the facts of the nodes
+            for node in changes.nodes_to_update:
+                if not scene.nodes().has(node.id):
+                    predicates.update(NODE_PREDICATES)
+                    break
+                previous = scene.nodes()[node.id]
+                if previous.name != node.name or get_property(previous, "class") != get_property(node, "class"):
+                    predicates.update(NODE_PREDICATES)
+                    break
+        # the situations without predicate may still be matched by their description
+        if len(situations) > 0 and len(predicates) == 0:
+            predicates.add("")
+        return predicates
+
+    def cache_statistics(self):
+        return self.__statistics
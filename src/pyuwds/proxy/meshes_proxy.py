@@ -4,8 +4,8 @@ from pyuwds.types.meshes import Meshes
 
 class PushMeshProxy(ServiceProxy):
 
-    def __init__(self, client):
-        super(PushMeshProxy, self).__init__(client, 'uwds/push_mesh', PushMesh)
+    def __init__(self, client, transport=None):
+        super(PushMeshProxy, self).__init__(client, 'uwds/push_mesh', PushMesh, transport)
 
     def _fill_request(self, mesh):
         push_mesh_request = PushMeshRequest()
@@ -14,8 +14,8 @@ class PushMeshProxy(ServiceProxy):
 
 class GetMeshProxy(DataProxy):
 
-    def __init__(self, client, meshes):
-        super(GetMeshProxy, self).__init__(client, 'uwds/get_mesh', meshes, GetMesh)
+    def __init__(self, client, meshes, transport=None):
+        super(GetMeshProxy, self).__init__(client, 'uwds/get_mesh', meshes, GetMesh, transport)
 
     def _save_data_from_remote(self, get_mesh_response):
         if get_mesh_response.success:
@@ -30,10 +30,10 @@ class GetMeshProxy(DataProxy):
 
 class MeshesProxy(object):
 
-    def __init__(self, client):
+    def __init__(self, client, transport=None):
         self.__meshes = Meshes()
-        self.__push_mesh_proxy = PushMeshProxy(client)
-        self.__get_mesh_proxy = GetMeshProxy(client, self.__meshes)
+        self.__push_mesh_proxy = PushMeshProxy(client, transport)
+        self.__get_mesh_proxy = GetMeshProxy(client, self.__meshes, transport)
 
     def push_mesh_to_remote(self, mesh):
         try:
@@ -1,15 +1,17 @@
 import rospy
 from uwds_msgs.msg import Invalidations
+from transport import get_default_transport
 
 class ServiceProxy(object):
 
-    def __init__(self, client, service_name, service_msg):
+    def __init__(self, client, service_name, service_msg, transport=None):
         self.client = client
         self.service_name = service_name
-        self.__service_client = rospy.ServiceProxy(service_name, service_msg)
+        self.transport = transport if transport is not None else get_default_transport()
+        self.__service_client = self.transport.service_proxy(service_name, service_msg)
 
     def call(self, *param):
-        rospy.wait_for_service(self.service_name)
+        self.transport.wait_for_service(self.service_name)
         try:
             service_request = self._fill_request(*param)
             service_response = self.__service_client(service_request)
@@ -26,8 +28,8 @@ class ServiceProxy(object):
 
 class DataProxy(ServiceProxy):
 
-    def __init__(self, client, service_name, data, service_msg):
-        super(DataProxy, self).__init__(client, service_name, service_msg)
+    def __init__(self, client, service_name, data, service_msg, transport=None):
+        super(DataProxy, self).__init__(client, service_name, service_msg, transport)
         self.data = data
 
     def get_data_from_remote(self, *param):
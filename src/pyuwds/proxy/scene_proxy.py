@@ -5,8 +5,8 @@ from pyuwds.types.scene import Scene
 
 class GetSceneProxy(DataProxy):
 
-    def __init__(self, client, world_name, scene, meshes):
-        super(GetSceneProxy, self).__init__(client, 'uwds/get_scene', scene, GetScene)
+    def __init__(self, client, world_name, scene, meshes, transport=None):
+        super(GetSceneProxy, self).__init__(client, 'uwds/get_scene', scene, GetScene, transport)
         self.__world_name = world_name
         self.__meshes = meshes
 
@@ -31,9 +31,9 @@ class GetSceneProxy(DataProxy):
      
 class SceneProxy(object):
 
-    def __init__(self, client, world_name, meshes_proxy):
+    def __init__(self, client, world_name, meshes_proxy, transport=None):
         self.__scene = Scene()
-        self.__get_scene_proxy = GetSceneProxy(client, world_name, self.__scene, meshes_proxy)
+        self.__get_scene_proxy = GetSceneProxy(client, world_name, self.__scene, meshes_proxy, transport)
 
     def get_scene_from_remote(self):
         return self.__get_scene_proxy.get_data_from_remote()
@@ -5,8 +5,8 @@ from pyuwds.types.timeline import Timeline
 
 class GetTimeLineProxy(DataProxy):
 
-    def __init__(self, client, world_name, timeline):
-        super(GetTimeLineProxy, self).__init__(client, 'uwds/get_timeline', timeline, GetTimeline)
+    def __init__(self, client, world_name, timeline, transport=None):
+        super(GetTimeLineProxy, self).__init__(client, 'uwds/get_timeline', timeline, GetTimeline, transport)
         self.__world_name = world_name
 
     def _save_data_from_remote(self, get_timeline_response):
@@ -27,9 +27,9 @@ class GetTimeLineProxy(DataProxy):
 
 class TimelineProxy(object):
     
-    def __init__(self, client, world_name):
+    def __init__(self, client, world_name, transport=None):
         self.__timeline = Timeline()
-        self.__get_timeline_proxy = GetTimeLineProxy(client, world_name, self.__timeline)
+        self.__get_timeline_proxy = GetTimeLineProxy(client, world_name, self.__timeline, transport)
 
     def get_timeline_from_remote(self):
         return self.__get_timeline_proxy.get_data_from_remote()
@@ -1,31 +1,29 @@
 from pyuwds.types.topology import Topology
-from uwds_msgs.srv import GetTopology
+from uwds_msgs.srv import GetTopology, GetTopologyRequest
 from proxy import DataProxy
 
 class GetTopologyProxy (DataProxy):
     
-    def __init__(self, client, topology):
-        #TODO call super
-        self.__world_name = ""
+    def __init__(self, client, topology, transport=None):
+        super(GetTopologyProxy, self).__init__(client, 'uwds/get_topology', topology, GetTopology, transport)
 
-
-    def save_data_from_remote(self, get_topology_srv):
-        if get_topology_srv.response.success:
-            self.data().reset(get_topology_srv.response.worlds, get_topology_srv.response.clients, get_topology_srv.response.client_interactions)
+    def _save_data_from_remote(self, get_topology_response):
+        if get_topology_response is not None and get_topology_response.success:
+            self.data.reset(get_topology_response.worlds, get_topology_response.clients, get_topology_response.client_interactions)
             return True
         return False
 
     def _fill_request(self):
-        return GetTopology()
+        return GetTopologyRequest()
 
 class TopologyProxy:
 
-    def __init__(self, client):
+    def __init__(self, client, transport=None):
         self.__topology = Topology()
-        self.__get_topology_proxy = GetTopologyProxy(client, self.__topology)
+        self.__get_topology_proxy = GetTopologyProxy(client, self.__topology, transport)
 
     def get_topology_from_remote(self):
         return self.__get_topology_proxy.get_data_from_remote()
 
     def topology(self):
-        return self.__topology
\ No newline at end of file
+        return self.__topology
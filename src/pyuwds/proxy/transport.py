@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import copy
+import rospy
+from threading import Thread, Lock, Condition
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class Transport(object):
+    """
+    The communication layer used by the Underworlds proxies
+
+    Provides services, publishers, subscribers and parameters so that the
+    proxies do not depend on a specific middleware.
+    """
+    def get_param(self, param_name, default=None):
+        raise NotImplementedError
+
+    def wait_for_service(self, service_name):
+        raise NotImplementedError
+
+    def service_proxy(self, service_name, service_msg):
+        raise NotImplementedError
+
+    def service(self, service_name, service_msg, handler):
+        raise NotImplementedError
+
+    def publisher(self, topic_name, msg_type, queue_size):
+        raise NotImplementedError
+
+    def subscriber(self, topic_name, msg_type, callback, queue_size):
+        raise NotImplementedError
+
+
+class RospyTransport(Transport):
+    """
+    The ROS transport, every message goes through the ROS master and TCPROS
+    """
+    def get_param(self, param_name, default=None):
+        return rospy.get_param(param_name, default)
+
+    def wait_for_service(self, service_name):
+        rospy.wait_for_service(service_name)
+
+    def service_proxy(self, service_name, service_msg):
+        return rospy.ServiceProxy(service_name, service_msg)
+
+    def service(self, service_name, service_msg, handler):
+        return rospy.Service(service_name, service_msg, handler)
+
+    def publisher(self, topic_name, msg_type, queue_size):
+        return rospy.Publisher(topic_name, msg_type, queue_size=queue_size)
+
+    def subscriber(self, topic_name, msg_type, callback, queue_size):
+        return rospy.Subscriber(topic_name, msg_type, callback, queue_size=queue_size)
+
+
+class InProcessServiceProxy(object):
+
+    def __init__(self, transport, service_name, service_msg):
+        self.__transport = transport
+        self.__service_name = service_name
+        self.__service_msg = service_msg
+
+    def __call__(self, request):
+        handler = self.__transport._handler(self.__service_name)
+        if handler is None:
+            raise rospy.ServiceException("service [%s] unavailable" % self.__service_name)
+        try:
+            response = handler(request)
+        except Exception as e:
+            raise rospy.ServiceException("service [%s] responded with an error: %s" % (self.__service_name, e))
+        if response is None:
+            raise rospy.ServiceException("service [%s] returned no response" % self.__service_name)
+        # handlers may return the response fields the same way rospy allows it
+        if isinstance(response, (tuple, list)):
+            return self.__service_msg._response_class(*response)
+        if isinstance(response, dict):
+            return self.__service_msg._response_class(**response)
+        return response
+
+    def close(self):
+        pass
+
+
+class InProcessService(object):
+
+    def __init__(self, transport, service_name):
+        self.__transport = transport
+        self.resolved_name = service_name
+
+    def shutdown(self, reason=''):
+        self.__transport._unregister_service(self.resolved_name)
+
+
+class InProcessPublisher(object):
+
+    def __init__(self, transport, topic_name):
+        self.__transport = transport
+        self.name = topic_name
+
+    def publish(self, msg):
+        for subscriber in self.__transport._subscribers(self.name):
+            subscriber._push(msg)
+
+    def get_num_connections(self):
+        return len(self.__transport._subscribers(self.name))
+
+    def unregister(self):
+        pass
+
+
+class InProcessSubscriber(object):
+    """
+    Dispatch the messages of a topic to a callback from a dedicated thread,
+    dropping the oldest ones when the queue is full like rospy does
+    """
+    def __init__(self, transport, topic_name, callback, queue_size, copy_messages):
+        self.__transport = transport
+        self.name = topic_name
+        self.__callback = callback
+        self.__copy_messages = copy_messages
+        self.__queue = queue.Queue(maxsize=queue_size if queue_size is not None else 0)
+        self.__thread = Thread(target=self.__run, name="uwds" + topic_name)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def _push(self, msg):
+        if self.__copy_messages:
+            msg = copy.deepcopy(msg)
+        while True:
+            try:
+                self.__queue.put_nowait(msg)
+                return
+            except queue.Full:
+                try:
+                    self.__queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def __run(self):
+        while True:
+            msg = self.__queue.get()
+            if msg is None:
+                return
+            try:
+                self.__callback(msg)
+            except Exception as e:
+                rospy.logerr("[inProcessTransport] Exception occurred in callback of '%s' topic : %s" % (self.name, e))
+
+    def unregister(self):
+        self.__transport._unregister_subscriber(self)
+        self._push(None)
+
+
+class InProcessTransport(Transport):
+    """
+    The in-process transport, messages are handed over as objects between
+    the clients living in the same Python process
+
+    No ROS master is needed and nothing is serialized. Each subscriber
+    receives its own deep copy of the published message, as with rospy,
+    since the mirrors modify the elements they apply. The copies may only
+    be disabled when all the subscribers are read-only.
+    """
+    def __init__(self, params=None, copy_messages=True):
+        """
+        @type params: dict
+        @param params: The parameters served by get_param
+        @type copy_messages: bool
+        @param copy_messages: Deep copy the messages for each subscriber, False to share them with read-only subscribers
+        """
+        self.__params = params if params is not None else {}
+        self.__copy_messages = copy_messages
+        self.__services = {}
+        self.__topics = {}
+        self.__mutex = Lock()
+        self.__services_available = Condition(self.__mutex)
+        if not rospy.rostime.is_rostime_initialized():
+            # no node is initialized, use the wall clock for rospy.Time.now()
+            rospy.rostime.set_rostime_initialized(True)
+
+    def get_param(self, param_name, default=None):
+        return self.__params.get(param_name, default)
+
+    def set_param(self, param_name, value):
+        self.__params[param_name] = value
+
+    def wait_for_service(self, service_name):
+        self.__services_available.acquire()
+        while service_name not in self.__services:
+            self.__services_available.wait(0.1)
+        self.__services_available.release()
+
+    def service_proxy(self, service_name, service_msg):
+        return InProcessServiceProxy(self, service_name, service_msg)
+
+    def service(self, service_name, service_msg, handler):
+        self.__services_available.acquire()
+        if service_name in self.__services:
+            self.__services_available.release()
+            raise rospy.ServiceException("service [%s] already registered" % service_name)
+        self.__services[service_name] = handler
+        self.__services_available.notify_all()
+        self.__services_available.release()
+        return InProcessService(self, service_name)
+
+    def publisher(self, topic_name, msg_type, queue_size):
+        return InProcessPublisher(self, topic_name)
+
+    def subscriber(self, topic_name, msg_type, callback, queue_size):
+        subscriber = InProcessSubscriber(self, topic_name, callback, queue_size, self.__copy_messages)
+        self.__mutex.acquire()
+        self.__topics[topic_name] = self.__topics.get(topic_name, []) + [subscriber]
+        self.__mutex.release()
+        return subscriber
+
+    def _handler(self, service_name):
+        return self.__services.get(service_name)
+
+    def _subscribers(self, topic_name):
+        # the list is replaced on each change, no need to copy it
+        return self.__topics.get(topic_name, [])
+
+    def _unregister_service(self, service_name):
+        self.__mutex.acquire()
+        if service_name in self.__services:
+            del self.__services[service_name]
+        self.__mutex.release()
+
+    def _unregister_subscriber(self, subscriber):
+        self.__mutex.acquire()
+        self.__topics[subscriber.name] = [s for s in self.__topics.get(subscriber.name, []) if s is not subscriber]
+        self.__mutex.release()
+
+
+_default_transport = [RospyTransport()]
+
+
+def get_default_transport():
+    """
+    Return the transport used by the proxies created without one
+    """
+    return _default_transport[0]
+
+
+def set_default_transport(transport):
+    """
+    Select the transport used by the proxies created without one
+    """
+    _default_transport[0] = transport
@@ -2,12 +2,18 @@
 from proxy import ServiceProxy
 from scene_proxy import SceneProxy
 from timeline_proxy import TimelineProxy
-from knowledge_base_proxy import KnowledgeBaseProxy
+from knowledge_base_proxy import KnowledgeBaseProxy, KB_CACHE_NONE
+from pyuwds.types.changes_log import ChangesLog
+from pyuwds.types.pose_table import PoseTable, DEFAULT_CAPACITY
+from pyuwds.tools.statistics import WorldStatistics, nb_changes_elements, message_size
+from pyuwds.tools.tracing import get_tracer, strip_trace
+from transport import get_default_transport
 
 from uwds_msgs.msg import Client, Invalidations, ChangesInContextStamped, Connection
 from uwds_msgs.srv import AdvertiseConnection, AdvertiseConnectionRequest
 from std_msgs.msg import Header
 import rospy
+import time
 
 
 READ = Connection.READ
@@ -15,10 +21,12 @@ WRITE = Connection.WRITE
 
 ConnectionTypeNames = {READ: "read", WRITE: "write"}
 
+DEFAULT_CHANGES_LOG_SIZE = 100
+
 class AdvertiseConnectionProxy(ServiceProxy):
 
-    def __init__(self, client, world_name):
-        super(AdvertiseConnectionProxy, self).__init__(client, 'uwds/advertise_connection', AdvertiseConnection)
+    def __init__(self, client, world_name, transport=None):
+        super(AdvertiseConnectionProxy, self).__init__(client, 'uwds/advertise_connection', AdvertiseConnection, transport)
         self.__world_name = world_name
 
     def _fill_request(self, connection_type, action):
@@ -31,23 +39,29 @@ class AdvertiseConnectionProxy(ServiceProxy):
 
 class WorldProxy(object):
 
-    def __init__(self, client, meshes_proxy, world_name):
+    def __init__(self, client, meshes_proxy, world_name, changes_log_size=DEFAULT_CHANGES_LOG_SIZE, transport=None):
         self.__client = client
+        self.__transport = transport if transport is not None else get_default_transport()
         self.__world_name = world_name
         self.__global_frame_id = ""
         self.__meshes_proxy = meshes_proxy
-        self.__scene_proxy = SceneProxy(client, world_name, meshes_proxy)
-        self.__timeline_proxy = TimelineProxy(client, world_name)
-        self.__knowledge_base_proxy = KnowledgeBaseProxy(client, world_name)
-        self.__advertise_connection_proxy = AdvertiseConnectionProxy(client, world_name)
+        self.__scene_proxy = SceneProxy(client, world_name, meshes_proxy, self.__transport)
+        self.__timeline_proxy = TimelineProxy(client, world_name, self.__transport)
+        self.__statistics = WorldStatistics()
+        self.__knowledge_base_proxy = KnowledgeBaseProxy(client, world_name, self.__transport,
+                                                         cache_policy=self.__transport.get_param("~kb_cache", KB_CACHE_NONE),
+                                                         statistics=self.__statistics.kb_cache)
+        self.__advertise_connection_proxy = AdvertiseConnectionProxy(client, world_name, self.__transport)
         self.__ever_connected = False
         self.__ever_send_changes = False
+        self.__changes_log = ChangesLog(changes_log_size)
+        self.__pose_table = None
         self.__scene_proxy.get_scene_from_remote()
         self.__timeline_proxy.get_timeline_from_remote()
 
 
-        self.__changes_subscriber = rospy.Subscriber(world_name + '/changes', ChangesInContextStamped, self.changes_callback, queue_size=20)
-        self.__changes_publisher = rospy.Publisher(world_name + '/changes', ChangesInContextStamped, queue_size=20)
+        self.__changes_subscriber = self.__transport.subscriber(world_name + '/changes', ChangesInContextStamped, self.changes_callback, 20)
+        self.__changes_publisher = self.__transport.publisher(world_name + '/changes', ChangesInContextStamped, 20)
 
 
     def meshes(self):
@@ -72,18 +86,98 @@ class WorldProxy(object):
         return False
 
     def changes_callback(self, msg):
+        received = time.time()
+        if not msg.header.stamp.is_zero():
+            self.__statistics.delay.record((rospy.Time.now() - msg.header.stamp).to_sec())
+        nb_bytes = message_size(msg) if self.__statistics.count_bytes else 0
+        self.__statistics.throughput.record(nb_changes_elements(msg.changes), nb_bytes, received)
+        tracer = get_tracer(self.__client.name)
+        trace = tracer.extract(msg.changes, msg.ctxt.client.name) if tracer.enabled() and self.__ever_connected else None
+        # the trace context is not a state of the world
+        changes = strip_trace(msg.changes)
+        self.__knowledge_base_proxy.invalidate(changes, self.scene(), self.timeline())
         inv = Invalidations()
-        inv.node_ids_deleted = self.scene().remove(msg.changes.nodes_to_delete)
-        inv.node_ids_updated = self.scene().update(msg.changes.nodes_to_update)
-
-        inv.situation_ids_deleted = self.timeline().remove(msg.changes.situations_to_delete)
-        inv.situation_ids_updated = self.timeline().update(msg.changes.situations_to_update)
-        inv.mesh_ids_deleted = msg.changes.meshes_to_delete
-        self.meshes().remove(msg.changes.meshes_to_delete)
-        u = self.meshes().update(msg.changes.meshes_to_update)
+        inv.node_ids_deleted = self.scene().remove(changes.nodes_to_delete)
+        inv.node_ids_updated = self.scene().update(changes.nodes_to_update)
+
+        inv.situation_ids_deleted = self.timeline().remove(changes.situations_to_delete)
+        inv.situation_ids_updated = self.timeline().update(changes.situations_to_update)
+        inv.mesh_ids_deleted = changes.meshes_to_delete
+        self.meshes().remove(changes.meshes_to_delete)
+        u = self.meshes().update(changes.meshes_to_update)
         inv.mesh_ids_updated = u
+        self.__changes_log.append(msg.header, changes)
+        pose_table = self.__pose_table
+        if pose_table is not None:
+            pose_table.remove(inv.node_ids_deleted)
+            pose_table.update(changes.nodes_to_update)
+        applied = time.time()
+        self.__statistics.apply.record(applied - received)
         if self.__ever_connected:
-            self.__on_changes(self.__world_name, msg.header, inv)
+            if trace is not None:
+                tracer.set_current(trace)
+            try:
+                self.__on_changes(self.__world_name, msg.header, inv)
+            finally:
+                if trace is not None:
+                    tracer.set_current(None)
+            self.__statistics.on_changes.record(time.time() - applied)
+        if trace is not None:
+            publisher_name, published = trace.last_hop()
+            tracer.span(publisher_name + " -> " + self.__world_name, published, received, trace, world=self.__world_name)
+            tracer.span("onChanges " + self.__world_name, received, time.time(), trace, world=self.__world_name)
+
+    def statistics(self):
+        """
+        Return the instrumentation of the local world (delays, apply and
+        callback durations, throughput)
+        """
+        return self.__statistics
+
+    def version(self):
+        """
+        Return the version of the last change batch applied to the local world
+        """
+        return self.__changes_log.version()
+
+    def changes_since(self, version):
+        """
+        Return the compacted changes applied to the local world since the given version
+
+        @return: a (version, changes) tuple, or None if a full resync is needed
+        """
+        return self.__changes_log.since(version)
+
+    def share_poses(self, capacity=DEFAULT_CAPACITY):
+        """
+        Write the node poses of the local world into a shared-memory table
+        that the other processes of the machine can read with PoseTable
+
+        Only one process per world should share its poses. The table is
+        removed by unshare_poses, or at the shutdown of the node.
+        """
+        if self.__pose_table is None:
+            self.__pose_table = PoseTable(self.__world_name, capacity, create=True)
+            self.__pose_table.update(list(self.scene().nodes()))
+            rospy.on_shutdown(self.unshare_poses)
+        return self.__pose_table
+
+    def unshare_poses(self):
+        """
+        Stop sharing the node poses and remove the shared-memory table
+        """
+        pose_table = self.__pose_table
+        self.__pose_table = None
+        if pose_table is not None:
+            pose_table.unlink()
+
+    def close(self):
+        """
+        Stop receiving and sending the changes of the world
+        """
+        self.__changes_subscriber.unregister()
+        self.__changes_publisher.unregister()
+        self.unshare_poses()
 
     def update(self, changes, header=None):
         if header is None:
@@ -97,6 +191,9 @@ class WorldProxy(object):
             msg.ctxt.world = self.__world_name
             msg.header = header
             msg.changes = changes
+            tracer = get_tracer(self.__client.name)
+            if tracer.enabled():
+                msg.changes = tracer.inject(changes, self.__client.name)
 
             while self.__changes_publisher.get_num_connections() < 1:
                 rospy.sleep(0.15)
@@ -1,19 +1,38 @@
+from threading import Lock
 from world_proxy import WorldProxy
 
 class WorldsProxy(object):
 
-    def __init__(self, client, meshes):
+    def __init__(self, client, meshes, transport=None):
         self.__client = client
         self.__meshes = meshes
+        self.__transport = transport
         self.__worlds = {}
+        self.__mutex = Lock()
 
     def __getitem__(self, world_name):
-        if world_name not in self.__worlds.keys():
-            self.__worlds[world_name] = WorldProxy(self.__client, self.__meshes, world_name)
-        return self.__worlds[world_name]
+        world = self.__worlds.get(world_name)
+        if world is None:
+            # a single proxy per world when several threads access it first
+            self.__mutex.acquire()
+            try:
+                if world_name not in self.__worlds:
+                    self.__worlds[world_name] = WorldProxy(self.__client, self.__meshes, world_name, transport=self.__transport)
+                world = self.__worlds[world_name]
+            finally:
+                self.__mutex.release()
+        return world
 
     def close(self):
+        for world in self.__worlds.values():
+            world.close()
         self.__worlds.clear()
 
+    def statistics(self):
+        """
+        Return the statistics of each world as a dict
+        """
+        return dict((world_name, world.statistics().to_dict()) for world_name, world in self.__worlds.items())
+
     def has(self, world_name):
         return True if world_name in self.__worlds else False
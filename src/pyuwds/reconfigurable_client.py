@@ -1,8 +1,9 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import json
 import rospy
-from std_msgs.msg import Header
+from std_msgs.msg import Header, String
 from uwds_msgs.msg import Invalidations
 from uwds_msgs.srv import ReconfigureInputs, List
 from pyuwds.uwds_client import UwdsClient
@@ -15,20 +16,26 @@ class ReconfigurableClient(UwdsClient):
     @type self.node_name: string
     @param self.node_name: The client name
     """
-    def __init__(self, client_name, client_type):
+    def __init__(self, client_name, client_type, transport=None):
         """
         The Underworlds client
 
         @type self.node_name: string
         @param self.node_name: The client name
         """
-        super(ReconfigurableClient, self).__init__(client_name, client_type)
-        input_worlds = rospy.get_param("~default_inputs", "")
-        self.__use_single_input = rospy.get_param("~use_single_input", False)
+        super(ReconfigurableClient, self).__init__(client_name, client_type, transport)
+        self.onChanges = self.profiler.wrap(self.onChanges)
+        input_worlds = self.transport.get_param("~default_inputs", "")
+        self.__use_single_input = self.transport.get_param("~use_single_input", False)
+        self.__statistics_count_bytes = self.transport.get_param("~statistics_count_bytes", False)
+        statistics_rate = self.transport.get_param("~statistics_rate", 0.0)
         self.input_worlds = input_worlds.split(" ")
         self.reconfigure(input_worlds.split(" "))
-        self.__reconfigure_service_server = rospy.Service(client_name+"/reconfigure_inputs", ReconfigureInputs, self.reconfigureInputs)
-        self.__list_inputs_service_server = rospy.Service(client_name+"/list_inputs", List, self.listInputs)
+        self.__reconfigure_service_server = self.transport.service(client_name+"/reconfigure_inputs", ReconfigureInputs, self.profiler.wrap(self.reconfigureInputs))
+        self.__list_inputs_service_server = self.transport.service(client_name+"/list_inputs", List, self.profiler.wrap(self.listInputs))
+        if statistics_rate > 0.0:
+            self.__statistics_publisher = self.transport.publisher(client_name+"/statistics", String, 1)
+            self.__statistics_timer = rospy.Timer(rospy.Duration(1.0/statistics_rate), self.handleStatisticsTimer)
 
     def reconfigure(self, inputs):
         if len(inputs) > 1 and self.__use_single_input:
@@ -37,6 +44,7 @@ class ReconfigurableClient(UwdsClient):
         self.onReconfigure(inputs)
         for input in inputs:
             self.ctx.worlds()[input].connect(self.onChanges)
+            self.ctx.worlds()[input].statistics().count_bytes = self.__statistics_count_bytes
             invalidations = Invalidations()
             scene = self.ctx.worlds()[input].scene()
             timeline = self.ctx.worlds()[input].timeline()
@@ -65,6 +73,15 @@ class ReconfigurableClient(UwdsClient):
         except Exception as e:
             return [], False, str(e)
 
+    def statistics(self):
+        """
+        Return the statistics of the input worlds as a dict
+        """
+        return self.ctx.worlds().statistics()
+
+    def handleStatisticsTimer(self, timer):
+        self.__statistics_publisher.publish(String(data=json.dumps(self.statistics())))
+
     def onChanges(self, world_name, header, invalidations):
         raise NotImplementedError
 
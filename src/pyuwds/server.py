@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import rospy
+from threading import Lock
+from std_msgs.msg import Time
+from uwds_msgs.msg import Client, ChangesInContextStamped
+from uwds_msgs.srv import GetScene, GetSceneResponse, GetTimeline, GetTimelineResponse
+from uwds_msgs.srv import GetMesh, GetMeshResponse, PushMesh, PushMeshResponse
+from uwds_msgs.srv import GetTopology, GetTopologyResponse
+from uwds_msgs.srv import AdvertiseConnection, AdvertiseConnectionResponse
+from types.gen_uuid import gen_uuid
+from types.meshes import Meshes
+from types.worlds import Worlds
+from types.topology import Topology
+from proxy.transport import get_default_transport
+from tools.tracing import strip_trace
+
+RESERVED_WORLD = "uwds"
+
+
+class UnderworldsServer(object):
+    """
+    The Underworlds server, in Python
+
+    Provides the same services and per-world change topics than the C++
+    server on top of the pyuwds data structures, over any transport. Each
+    world has its own lock so that the change streams of different worlds
+    are applied concurrently.
+    """
+    def __init__(self, transport=None, name="uwds", subscriber_buffer_size=30, verbose=False):
+        """
+        @type transport: Transport
+        @param transport: The transport to use, the default one if None
+        @type name: string
+        @param name: The server name
+        @type subscriber_buffer_size: int
+        @param subscriber_buffer_size: The queue size of the change subscribers
+        @type verbose: bool
+        @param verbose: Log the client requests
+        """
+        self.__transport = transport if transport is not None else get_default_transport()
+        self.__client = Client(name=name, id=gen_uuid(), type=Client.UNDEFINED)
+        self.__subscriber_buffer_size = subscriber_buffer_size
+        self.__verbose = verbose
+
+        self.__meshes = Meshes()
+        self.__worlds = Worlds(self.__meshes)
+        self.__topology = Topology()
+
+        self.__changes_subscribers = {}
+        self.__changes_subscribers_mutex = Lock()
+
+        self.__services = []
+        self.__services.append(self.__transport.service("uwds/get_topology", GetTopology, self.handle_get_topology))
+        self.__services.append(self.__transport.service("uwds/push_mesh", PushMesh, self.handle_push_mesh))
+        self.__services.append(self.__transport.service("uwds/get_mesh", GetMesh, self.handle_get_mesh))
+        self.__services.append(self.__transport.service("uwds/get_timeline", GetTimeline, self.handle_get_timeline))
+        self.__services.append(self.__transport.service("uwds/get_scene", GetScene, self.handle_get_scene))
+        self.__services.append(self.__transport.service("uwds/advertise_connection", AdvertiseConnection, self.handle_advertise_connection))
+        rospy.loginfo("[%s::init] Underworlds server ready !" % self.name())
+
+    def name(self):
+        return self.__client.name
+
+    def worlds(self):
+        return self.__worlds
+
+    def meshes(self):
+        return self.__meshes
+
+    def topology(self):
+        return self.__topology
+
+    def __check_world(self, world_name):
+        if world_name == RESERVED_WORLD:
+            raise RuntimeError("World namespace <%s> reserved." % RESERVED_WORLD)
+        if world_name == "":
+            raise RuntimeError("Empty world namespace.")
+
+    def changes_callback(self, msg):
+        try:
+            self.__check_world(msg.ctxt.world)
+            world = self.__worlds[msg.ctxt.world]
+            world.lock()
+            try:
+                world.apply_changes(msg.header, strip_trace(msg.changes))
+            finally:
+                world.unlock()
+        except Exception as e:
+            rospy.logerr("[%s::changesCallback] Exception occured when receiving changes from <%s> : %s" % (self.name(), msg.ctxt.world, e))
+
+    def handle_advertise_connection(self, req):
+        if self.__verbose:
+            rospy.loginfo("[%s::advertiseConnection] Client <%s> requested 'uwds/advertise_connection' in <%s> world" % (self.name(), req.connection.ctxt.client.name, req.connection.ctxt.world))
+        try:
+            self.__check_world(req.connection.ctxt.world)
+            self.__changes_subscribers_mutex.acquire()
+            try:
+                if req.connection.ctxt.world not in self.__changes_subscribers:
+                    self.__changes_subscribers[req.connection.ctxt.world] = self.__transport.subscriber(req.connection.ctxt.world + "/changes", ChangesInContextStamped, self.changes_callback, self.__subscriber_buffer_size)
+                    if self.__verbose:
+                        rospy.loginfo("[%s::advertiseConnection] Changes subscriber for world <%s> created" % (self.name(), req.connection.ctxt.world))
+            finally:
+                self.__changes_subscribers_mutex.release()
+            self.__topology.update(req.connection.ctxt, req.connection.type, req.connection.action)
+            return AdvertiseConnectionResponse(success=True)
+        except Exception as e:
+            rospy.logerr("[%s::advertiseConnection] Exception occured while registering the <%s> client connection to world <%s> : %s" % (self.name(), req.connection.ctxt.client.name, req.connection.ctxt.world, e))
+            return AdvertiseConnectionResponse(success=False, error=str(e))
+
+    def handle_get_scene(self, req):
+        try:
+            self.__check_world(req.ctxt.world)
+        except RuntimeError as e:
+            return GetSceneResponse(success=False, error=str(e))
+        world = self.__worlds[req.ctxt.world]
+        world.lock()
+        try:
+            nodes = list(world.scene().nodes())
+            root_id = world.scene().root_id()
+        finally:
+            world.unlock()
+        return GetSceneResponse(nodes=nodes, root_id=root_id, success=True)
+
+    def handle_get_timeline(self, req):
+        try:
+            self.__check_world(req.ctxt.world)
+        except RuntimeError as e:
+            return GetTimelineResponse(success=False, error=str(e))
+        world = self.__worlds[req.ctxt.world]
+        world.lock()
+        try:
+            situations = list(world.timeline().situations())
+            origin = world.timeline().origin()
+        finally:
+            world.unlock()
+        return GetTimelineResponse(situations=situations, origin=Time(data=origin), success=True)
+
+    def handle_get_mesh(self, req):
+        if self.__meshes.has(req.mesh_id):
+            return GetMeshResponse(mesh=self.__meshes[req.mesh_id], success=True)
+        rospy.logwarn("[%s::getMesh] Mesh <%s> not existing" % (self.name(), req.mesh_id))
+        return GetMeshResponse(success=False, error="Requested mesh <" + req.mesh_id + "> not existing")
+
+    def handle_push_mesh(self, req):
+        if not self.__meshes.has(req.mesh.id):
+            self.__meshes.update([req.mesh])
+            return PushMeshResponse(success=True)
+        rospy.logwarn("[%s::pushMesh] Mesh <%s> already existing" % (self.name(), req.mesh.id))
+        return PushMeshResponse(success=False, error="Pushed mesh <" + req.mesh.id + "> already existing")
+
+    def handle_get_topology(self, req):
+        res = GetTopologyResponse()
+        self.__topology._lock()
+        try:
+            res.clients = list(self.__topology.clients())
+            for client_interactions in self.__topology.client_interactions():
+                for client_interaction in client_interactions:
+                    if client_interaction.ctxt.world not in res.worlds:
+                        res.worlds.append(client_interaction.ctxt.world)
+                    res.client_interactions.append(client_interaction)
+            res.success = True
+        except Exception as e:
+            res.success = False
+            res.error = str(e)
+        finally:
+            self.__topology._unlock()
+        return res
+
+    def shutdown(self):
+        for service in self.__services:
+            service.shutdown()
+        self.__changes_subscribers_mutex.acquire()
+        for subscriber in self.__changes_subscribers.values():
+            subscriber.unregister()
+        self.__changes_subscribers.clear()
+        self.__changes_subscribers_mutex.release()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+DEFAULT_NB_TABLES = 8
+DEFAULT_NB_BITS = 12
+DEFAULT_NB_PROBES = 2
+REBUILD_RATIO = 0.1
+MIN_REBUILD_SIZE = 256
+CHUNK_SIZE = 10000
+
+
+class LSHIndex(object):
+    """
+    Approximate nearest neighbours by cosine similarity, with random projection LSH
+
+    Each table hashes a vector into the signs of its projections on
+    nb_bits random hyperplanes, the vectors of close directions sharing
+    the same code with a high probability. A query returns the ids found
+    in its bucket of each table, plus the nb_probes buckets obtained by
+    flipping its least certain bits, and the caller ranks these candidates
+    exactly. More tables and probes raise the recall, more bits lower the
+    number of candidates (and the latency).
+
+    The buckets are the runs of the per-table sorted codes, looked up by
+    binary search. The ids inserted since the last sort are kept in small
+    per-table dicts and the deleted ids are masked, the tables being sorted
+    again when the insertions exceed a fraction of the index.
+    """
+    def __init__(self, dim, nb_tables=DEFAULT_NB_TABLES, nb_bits=DEFAULT_NB_BITS, nb_probes=DEFAULT_NB_PROBES, seed=0):
+        """
+        @type dim: int
+        @param dim: The dimension of the vectors
+        @type nb_tables: int
+        @param nb_tables: The number of hash tables
+        @type nb_bits: int
+        @param nb_bits: The number of hyperplanes per table
+        @type nb_probes: int
+        @param nb_probes: The default number of neighbouring buckets probed per table
+        @type seed: int
+        @param seed: The seed of the hyperplanes
+        """
+        if nb_bits > 62:
+            raise ValueError("At most 62 bits per table are supported")
+        self.nb_tables = nb_tables
+        self.nb_bits = nb_bits
+        self.nb_probes = nb_probes
+        rand = np.random.RandomState(seed)
+        self.__hyperplanes = rand.standard_normal((dim, nb_tables * nb_bits)).astype(np.float32)
+        self.__powers = (2 ** np.arange(nb_bits, dtype=np.int64))
+        self.__codes = np.zeros((0, nb_tables), dtype=np.int64)
+        self.__alive = np.zeros(0, dtype=bool)
+        self.__size = 0
+        self.__sorted_codes = [np.zeros(0, dtype=np.int64) for t in range(0, nb_tables)]
+        self.__sorted_ids = [np.zeros(0, dtype=np.int64) for t in range(0, nb_tables)]
+        self.__pending = [{} for t in range(0, nb_tables)]
+        self.__nb_pending = 0
+
+    def __len__(self):
+        return self.__size
+
+    def hash(self, vectors):
+        """
+        Return the (len(vectors), nb_tables) codes of the vectors
+        """
+        projections = np.dot(vectors, self.__hyperplanes).reshape((len(vectors), self.nb_tables, self.nb_bits))
+        return np.dot(projections > 0.0, self.__powers)
+
+    def insert(self, ids, vectors):
+        """
+        Insert or move vectors, given as the rows of a matrix with their integer ids
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        self.__reserve(ids.max() + 1)
+        codes = np.zeros((len(ids), self.nb_tables), dtype=np.int64)
+        for begin in range(0, len(ids), CHUNK_SIZE):
+            codes[begin:begin + CHUNK_SIZE] = self.hash(np.asarray(vectors[begin:begin + CHUNK_SIZE], dtype=np.float32))
+        self.__size += len(np.unique(ids[~self.__alive[ids]]))
+        self.__codes[ids] = codes
+        self.__alive[ids] = True
+        if self.__nb_pending + len(ids) > max(MIN_REBUILD_SIZE, REBUILD_RATIO * self.__size):
+            self.rebuild()
+            return
+        # the entries of the sorted tables with an outdated code are filtered by the caller ranking
+        for t in range(0, self.nb_tables):
+            pending = self.__pending[t]
+            for id, code in zip(ids.tolist(), codes[:, t].tolist()):
+                pending.setdefault(code, []).append(id)
+        self.__nb_pending += len(ids)
+
+    def remove(self, ids):
+        """
+        Remove vectors by id, unknown ids are ignored
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        ids = ids[ids < len(self.__alive)]
+        ids = ids[self.__alive[ids]]
+        self.__alive[ids] = False
+        self.__size -= len(ids)
+
+    def rebuild(self):
+        """
+        Sort the tables again, merging the pending insertions and dropping the removed ids
+        """
+        ids = np.flatnonzero(self.__alive)
+        for t in range(0, self.nb_tables):
+            codes = self.__codes[ids, t]
+            order = np.argsort(codes, kind="mergesort")
+            self.__sorted_codes[t] = codes[order]
+            self.__sorted_ids[t] = ids[order]
+            self.__pending[t] = {}
+        self.__nb_pending = 0
+
+    def candidates(self, vector, nb_probes=None):
+        """
+        Return the ids of the vectors likely to be close to the given one
+        """
+        if nb_probes is None:
+            nb_probes = self.nb_probes
+        projections = np.dot(np.asarray(vector, dtype=np.float32), self.__hyperplanes).reshape((self.nb_tables, self.nb_bits))
+        codes = np.dot(projections > 0.0, self.__powers)
+        # the least certain bits are the ones with the smallest projections
+        flips = np.argsort(np.abs(projections), axis=1)[:, :nb_probes]
+        found = []
+        for t in range(0, self.nb_tables):
+            table_codes = [codes[t]] + [codes[t] ^ self.__powers[bit] for bit in flips[t]]
+            sorted_codes = self.__sorted_codes[t]
+            begins = np.searchsorted(sorted_codes, table_codes, side="left")
+            ends = np.searchsorted(sorted_codes, table_codes, side="right")
+            for begin, end, code in zip(begins, ends, table_codes):
+                if end > begin:
+                    found.append(self.__sorted_ids[t][begin:end])
+                if self.__nb_pending > 0 and code in self.__pending[t]:
+                    found.append(np.array(self.__pending[t][code], dtype=np.int64))
+        if len(found) == 0:
+            return np.zeros(0, dtype=np.int64)
+        ids = np.unique(np.concatenate(found))
+        return ids[self.__alive[ids]]
+
+    def __reserve(self, capacity):
+        if capacity > len(self.__alive):
+            capacity = max(capacity, 2 * len(self.__alive))
+            codes = np.zeros((capacity, self.nb_tables), dtype=np.int64)
+            codes[:len(self.__codes)] = self.__codes
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:len(self.__alive)] = self.__alive
+            self.__codes = codes
+            self.__alive = alive
@@ -1,73 +1,287 @@
 #!/usr/bin/python
 # -*- coding: UTF-8 -*-
+import os
+import hashlib
+import tempfile
+from itertools import izip
 import numpy as np
 import scipy.spatial.distance as distance
+from ann import LSHIndex, DEFAULT_NB_TABLES, DEFAULT_NB_BITS, DEFAULT_NB_PROBES
+
+CACHE_VERSION = 1
+CACHE_CHUNK_SIZE = 10000
+
+QUANTIZATIONS = {"float16": np.float16, "int8": np.int8}
+
+
+def default_cache_dir(glove_file_path):
+    cache_dir = os.path.dirname(os.path.abspath(glove_file_path))
+    if not os.access(cache_dir, os.W_OK):
+        cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "uwds", "glove")
+    return cache_dir
+
+
+def cache_key(glove_file_path, stoplist, keep):
+    """
+    Return the key identifying the binary cache of a GloVe file loaded with the given options
+    """
+    stat = os.stat(glove_file_path)
+    key = "%d:%s:%d:%d:%d:%s" % (CACHE_VERSION, os.path.abspath(glove_file_path), stat.st_size,
+                                 int(stat.st_mtime), stoplist, ",".join(sorted(keep)))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
 
 class GloveManager:
-    def __init__(self, glove_file_path, stoplist=0, keep=[], additionnal_symbols_file_path=""):
-        self.load_glove_file(glove_file_path, stoplist, additionnal_symbols_file_path)
-
-    def load_glove_file(self, glove_file_path, stoplist=0, keep=[], additionnal_symbols_file_path=""):
-        self.word_to_vector = {}
-        self.word_to_index = {}
-        self.index_to_word = {}
-
-        with open(glove_file_path, 'r') as f:
-            i = 0
-            for line in f:
-                record = line.strip().split()
-                if i > stoplist:
-                    insert = True
-                else:
-                    insert = False
-                if record[0] in keep:
-                    insert = True
-                i += 1
-                if insert:
-                    token = record[0]
-                    self.word_to_vector[token] = np.array(record[1:], dtype=np.float64)
-
-            tokens = sorted(self.word_to_vector.keys())
-            for idx, tok in enumerate(tokens):
-                kerasIdx = idx + 1
-                self.word_to_index[tok] = kerasIdx
-                self.index_to_word[kerasIdx] = tok
-
-        self.vector_dim = next(iter(self.word_to_vector.values())).shape[0]
-        self.vocabulary_size = len(self.word_to_vector)
+    """
+    The GloVe embeddings
+
+    The text file is converted once into a binary cache: the vocabulary
+    (one word per line, sorted) and a float32 matrix whose row i is the
+    vector of the word of index i, row 0 being the zero padding vector.
+    Following starts memory-map the matrix, so that its pages are loaded
+    on demand and shared between the processes using the same cache.
+
+    With a quantization ("float16" or "int8"), the similarities are
+    computed from a quantized copy of the matrix: each row is normalized
+    then quantized, and a per-row scale gives back the original vector.
+    The rows are 2x (float16) or 4x (int8) smaller than the float32 ones
+    and the cosines are computed in NumPy, without scipy.
+    """
+    def __init__(self, glove_file_path, stoplist=0, keep=[], additionnal_symbols_file_path="", cache_dir=None, quantization=None):
+        self.load_glove_file(glove_file_path, stoplist, keep, additionnal_symbols_file_path, cache_dir, quantization)
+
+    def load_glove_file(self, glove_file_path, stoplist=0, keep=[], additionnal_symbols_file_path="", cache_dir=None, quantization=None):
+        if quantization is not None and quantization not in QUANTIZATIONS:
+            raise ValueError("Unknown quantization '%s', expected one of %s" % (quantization, ", ".join(sorted(QUANTIZATIONS))))
+        if cache_dir is None:
+            cache_dir = default_cache_dir(glove_file_path)
+        cache_path = os.path.join(cache_dir, os.path.basename(glove_file_path) + "." + cache_key(glove_file_path, stoplist, keep))
+        if not os.path.exists(cache_path + ".npy") or not os.path.exists(cache_path + ".vocab"):
+            self.convert_glove_file(glove_file_path, cache_path, stoplist, keep)
+
+        with open(cache_path + ".vocab", "r") as f:
+            self.vocabulary = f.read().split("\n")
+        # a plain array view of the mapping, the memmap subclass slows down every row operation
+        self.embedding_matrix = np.load(cache_path + ".npy", mmap_mode="r").view(np.ndarray)
+        self.word_to_index = dict(izip(self.vocabulary, xrange(1, len(self.vocabulary) + 1)))
+        self.index_to_word = dict(izip(xrange(1, len(self.vocabulary) + 1), self.vocabulary))
+        self.vector_dim = self.embedding_matrix.shape[1]
+        self.vocabulary_size = len(self.vocabulary)
+
+        self.quantization = quantization
+        self.quantized_matrix = None
+        self.scales = None
+        self.ann_index = None
+        self.__row_norms = None
+        if quantization is not None:
+            quantized_path = cache_path + "." + quantization
+            if not os.path.exists(quantized_path + ".npy") or not os.path.exists(quantized_path + ".scales.npy"):
+                self.quantize_embedding_matrix(quantized_path, quantization)
+            self.quantized_matrix = np.load(quantized_path + ".npy", mmap_mode="r").view(np.ndarray)
+            self.scales = np.load(quantized_path + ".scales.npy", mmap_mode="r").view(np.ndarray)
 
         if additionnal_symbols_file_path != "":
             symbols_to_add = []
-            if additionnal_symbols_file_path is not None:
-                with open(file_path, 'r') as f:
-                    for line in f:
-                        for symbol in line.split(" "):
-                            if symbol not in self.word_vector:
-                                symbols_to_add.append(symbol)
-
-            idx = 0
+            with open(additionnal_symbols_file_path, 'r') as f:
+                for line in f:
+                    for symbol in line.strip().split(" "):
+                        if symbol != "" and symbol not in self.word_to_index and symbol not in symbols_to_add:
+                            symbols_to_add.append(symbol)
             nb_symbols_to_add = len(symbols_to_add)
+            # one-hot dimensions for the symbols, the matrix is no more mapped
+            matrix = np.zeros((self.vocabulary_size + nb_symbols_to_add + 1, self.vector_dim + nb_symbols_to_add), dtype=np.float32)
+            matrix[:self.vocabulary_size + 1, :self.vector_dim] = self.embedding_matrix
+            for idx, symbol in enumerate(symbols_to_add):
+                index = self.vocabulary_size + idx + 1
+                matrix[index, self.vector_dim + idx] = 1.0
+                self.vocabulary.append(symbol)
+                self.word_to_index[symbol] = index
+                self.index_to_word[index] = symbol
+            self.embedding_matrix = matrix
+            if quantization is not None:
+                quantized_matrix = np.zeros(matrix.shape, dtype=QUANTIZATIONS[quantization])
+                quantized_matrix[:self.vocabulary_size + 1, :self.vector_dim] = self.quantized_matrix
+                scales = np.zeros(matrix.shape[0], dtype=np.float32)
+                scales[:self.vocabulary_size + 1] = self.scales
+                one = 127 if quantization == "int8" else 1.0
+                for idx in range(0, nb_symbols_to_add):
+                    quantized_matrix[self.vocabulary_size + idx + 1, self.vector_dim + idx] = one
+                    scales[self.vocabulary_size + idx + 1] = 1.0 / one
+                self.quantized_matrix = quantized_matrix
+                self.scales = scales
+            self.vector_dim = self.embedding_matrix.shape[1]
+            self.vocabulary_size = len(self.vocabulary)
 
-            for symbol in symbols_to_add:
-                self.word_to_vector[symbol] = np.zeros(self.vector_dim+nb_symbols_to_add)
-                self.word_to_vector[symbol][self.vector_dim+idx] = 1.0
-                kerasIdx = idx + 1
-                self.word_to_index[symbol] = kerasIdx
-                self.index_to_word[kerasIdx] = symbol
-                idx += 1
-
-            for word, vector in self.word_to_vector.items():
-                if len(vector) < self.vector_dim+nb_symbols_to_add:
-                    self.word_to_vector[word] = np.append(vector, np.zeros(nb_symbols_to_add))
+    def convert_glove_file(self, glove_file_path, cache_path, stoplist=0, keep=[]):
+        """
+        Convert the GloVe text file into the binary cache
+        """
+        cache_dir = os.path.dirname(cache_path)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        words = []
+        seen = set()
+        vector_dim = None
+        # the rows are first written in file order, then sorted by word
+        with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".rows") as rows_file:
+            with open(glove_file_path, 'r') as f:
+                i = 0
+                for line in f:
+                    record = line.strip().split()
+                    if i > stoplist:
+                        insert = True
+                    else:
+                        insert = False
+                    if record[0] in keep:
+                        insert = True
+                    i += 1
+                    if insert and record[0] not in seen:
+                        vector = np.array(record[1:], dtype=np.float32)
+                        if vector_dim is None:
+                            vector_dim = vector.shape[0]
+                        vector.tofile(rows_file)
+                        words.append(record[0])
+                        seen.add(record[0])
+            rows_file.flush()
+            rows = np.memmap(rows_file.name, dtype=np.float32, mode="r", shape=(len(words), vector_dim))
+            order = sorted(range(0, len(words)), key=words.__getitem__)
+            npy_path = cache_path + ".npy.%d.tmp" % os.getpid()
+            matrix = np.lib.format.open_memmap(npy_path, mode="w+", dtype=np.float32, shape=(len(words) + 1, vector_dim))
+            matrix[0] = 0.0
+            for begin in range(0, len(order), CACHE_CHUNK_SIZE):
+                matrix[begin + 1:begin + 1 + CACHE_CHUNK_SIZE] = rows[order[begin:begin + CACHE_CHUNK_SIZE]]
+            matrix.flush()
+            del matrix
+            del rows
+        vocab_path = cache_path + ".vocab.%d.tmp" % os.getpid()
+        with open(vocab_path, "w") as f:
+            f.write("\n".join(words[idx] for idx in order))
+        # renamed last so that an interrupted conversion is done again
+        os.rename(vocab_path, cache_path + ".vocab")
+        os.rename(npy_path, cache_path + ".npy")
 
-            self.vector_dim = next(iter(self.word_to_vector.values())).shape[0]
-            self.vocabulary_size = len(self.word_to_index)
+    def quantize_embedding_matrix(self, quantized_path, quantization):
+        """
+        Write the quantized matrix and its per-row scales next to the binary cache
+        """
+        dtype = QUANTIZATIONS[quantization]
+        npy_path = quantized_path + ".npy.%d.tmp" % os.getpid()
+        scales_path = quantized_path + ".scales.npy.%d.tmp" % os.getpid()
+        quantized_matrix = np.lib.format.open_memmap(npy_path, mode="w+", dtype=dtype, shape=self.embedding_matrix.shape)
+        scales = np.lib.format.open_memmap(scales_path, mode="w+", dtype=np.float32, shape=(self.embedding_matrix.shape[0],))
+        for begin in range(0, self.embedding_matrix.shape[0], CACHE_CHUNK_SIZE):
+            rows = self.embedding_matrix[begin:begin + CACHE_CHUNK_SIZE].astype(np.float64)
+            norms = np.sqrt((rows * rows).sum(axis=1))
+            # the padding row stays zero with a zero scale
+            norms[norms == 0.0] = 1.0
+            rows /= norms[:, np.newaxis]
+            if quantization == "int8":
+                # the largest component of each row is mapped to 127
+                maximums = np.abs(rows).max(axis=1)
+                maximums[maximums == 0.0] = 1.0
+                quantized_matrix[begin:begin + CACHE_CHUNK_SIZE] = np.rint(rows * (127.0 / maximums[:, np.newaxis]))
+                scales[begin:begin + CACHE_CHUNK_SIZE] = norms * maximums / 127.0
+            else:
+                quantized_matrix[begin:begin + CACHE_CHUNK_SIZE] = rows
+                scales[begin:begin + CACHE_CHUNK_SIZE] = norms
+        scales[0] = 0.0
+        quantized_matrix.flush()
+        scales.flush()
+        del quantized_matrix
+        del scales
+        os.rename(scales_path, quantized_path + ".scales.npy")
+        os.rename(npy_path, quantized_path + ".npy")
 
     def get_vector(self, word):
-        return self.word_to_vector[word]
+        return self.embedding_matrix[self.word_to_index[word]]
+
+    def rows(self, indexes):
+        """
+        Return the float32 vectors of the given word indexes, dequantized if needed
+        """
+        if self.quantized_matrix is not None:
+            rows = self.quantized_matrix[indexes].astype(np.float32)
+            rows *= self.scales[indexes][:, np.newaxis]
+            return rows
+        return self.embedding_matrix[indexes]
+
+    def row_norms(self):
+        """
+        Return the norms of the vectors of the vocabulary, computed on first use
+        """
+        if self.__row_norms is None:
+            norms = np.zeros(self.vocabulary_size + 1, dtype=np.float32)
+            for begin in range(0, self.vocabulary_size + 1, CACHE_CHUNK_SIZE):
+                rows = self.rows(np.arange(begin, min(begin + CACHE_CHUNK_SIZE, self.vocabulary_size + 1)))
+                norms[begin:begin + CACHE_CHUNK_SIZE] = np.sqrt(np.einsum("ij,ij->i", rows, rows))
+            self.__row_norms = norms
+        return self.__row_norms
+
+    def build_ann_index(self, nb_tables=DEFAULT_NB_TABLES, nb_bits=DEFAULT_NB_BITS, nb_probes=DEFAULT_NB_PROBES, seed=0):
+        """
+        Index the vocabulary for the approximate nearest_words searches
+        """
+        self.ann_index = LSHIndex(self.vector_dim, nb_tables, nb_bits, nb_probes, seed)
+        # the hash only depends on the directions, the quantized rows are hashed without their scales
+        matrix = self.quantized_matrix if self.quantized_matrix is not None else self.embedding_matrix
+        for begin in range(1, self.vocabulary_size + 1, CACHE_CHUNK_SIZE):
+            end = min(begin + CACHE_CHUNK_SIZE, self.vocabulary_size + 1)
+            self.ann_index.insert(np.arange(begin, end), matrix[begin:end])
+        return self.ann_index
+
+    def nearest_words(self, sentence, k=10, nb_probes=None):
+        """
+        Return the words of the vocabulary closest to the sentence
+
+        The candidates come from the ANN index if built, otherwise the whole
+        vocabulary is ranked.
+
+        @type sentence: string
+        @param sentence: The query, a word or a sentence
+        @type k: int
+        @param k: The number of words, at most the number of candidates
+        @type nb_probes: int
+        @param nb_probes: The number of probes of the ANN index, its default if None
+        @rtype: list
+        @return: The (word, similarity) pairs by decreasing similarity
+        """
+        if k <= 0:
+            return []
+        query = np.asarray(self.sentence_vector(sentence), dtype=np.float32)
+        norm = np.sqrt(np.dot(query, query))
+        if norm == 0.0:
+            return []
+        query /= norm
+        norms = self.row_norms()
+        if self.ann_index is not None:
+            candidates = self.ann_index.candidates(query, nb_probes)
+            scores = np.dot(self.rows(candidates), query) / np.maximum(norms[candidates], 1e-12)
+        else:
+            candidates = np.arange(1, self.vocabulary_size + 1)
+            scores = np.zeros(self.vocabulary_size, dtype=np.float32)
+            for begin in range(0, self.vocabulary_size, CACHE_CHUNK_SIZE):
+                indexes = candidates[begin:begin + CACHE_CHUNK_SIZE]
+                scores[begin:begin + CACHE_CHUNK_SIZE] = np.dot(self.rows(indexes), query) / np.maximum(norms[indexes], 1e-12)
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        if k < len(scores):
+            best = np.argpartition(-scores, k - 1)[:k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind="mergesort")]
+        return [(self.index_to_word[candidates[i]], float(scores[i])) for i in best]
+
+    def memory_size(self):
+        """
+        Return the size in bytes of the matrix used for the similarities
+        """
+        if self.quantized_matrix is not None:
+            return self.quantized_matrix.nbytes + self.scales.nbytes
+        return self.embedding_matrix.nbytes
 
     def has(self, word):
-        return word in self.word_to_vector
+        return word in self.word_to_index
 
     def cosine_similarity(self, vector1, vector2):
         try:
@@ -75,7 +289,26 @@ class GloveManager:
         except ValueError:
             0.0
 
+    def quantized_cosine_similarity(self, vector1, vector2):
+        norms = np.sqrt(np.dot(vector1, vector1) * np.dot(vector2, vector2))
+        if norms == 0.0:
+            return 0.0
+        return float(np.dot(vector1, vector2) / norms)
+
+    def quantized_sentence_vector(self, sentence):
+        """
+        Return the average of the (dequantized) vectors of the known words of the sentence
+        """
+        word_to_index = self.word_to_index
+        indexes = [word_to_index[word] for word in sentence.split(" ") if word in word_to_index]
+        if len(indexes) == 0:
+            return np.zeros(self.vector_dim, dtype=np.float32)
+        # the scales weight the quantized rows in a single product
+        return np.dot(self.scales[indexes], self.quantized_matrix[indexes].astype(np.float32)) / len(indexes)
+
     def sentence_vector(self, sentence):
+        if self.quantized_matrix is not None:
+            return self.quantized_sentence_vector(sentence)
         ponderation = 0
         first_word = True
         vector = np.zeros(self.vector_dim)
@@ -88,7 +321,8 @@ class GloveManager:
                     vector = np.add(vector, self.get_vector(word))
                 ponderation += 1
         if not np.allclose(vector, np.zeros(self.vector_dim)):
-            return np.true_divide(vector, ponderation)
+            # float64 like the vectors were before the float32 cache, scipy is slower on float32
+            return np.true_divide(vector, ponderation, dtype=np.float64)
         else:
             return vector
 
@@ -96,16 +330,76 @@ class GloveManager:
         try:
             sentence1_vector = self.sentence_vector(sentence1)
             sentence2_vector = self.sentence_vector(sentence2)
+            if self.quantized_matrix is not None:
+                return self.quantized_cosine_similarity(sentence1_vector, sentence2_vector)
             return self.cosine_similarity(sentence1_vector, sentence2_vector)
         except Exception as e:
             return 0.0
 
+    def sentence_vectors(self, sentences):
+        """
+        Return the sentence vectors of several sentences as the rows of a matrix
+
+        The rows of all the known words are gathered at once and averaged
+        per sentence, the sentences without known words have a zero row.
+
+        @type sentences: list
+        @param sentences: The sentences
+        @rtype: numpy.ndarray
+        @return: The (len(sentences), vector_dim) float64 matrix
+        """
+        vectors = np.zeros((len(sentences), self.vector_dim))
+        word_to_index = self.word_to_index
+        indexes = []
+        starts = []
+        lengths = []
+        positions = []
+        for position, sentence in enumerate(sentences):
+            sentence_indexes = [word_to_index[word] for word in sentence.split(" ") if word in word_to_index]
+            if len(sentence_indexes) > 0:
+                starts.append(len(indexes))
+                lengths.append(len(sentence_indexes))
+                positions.append(position)
+                indexes += sentence_indexes
+        if len(positions) == 0:
+            return vectors
+        rows = self.rows(indexes)
+        sums = np.add.reduceat(rows, starts, axis=0, dtype=np.float64)
+        vectors[positions] = sums / np.array(lengths, dtype=np.float64)[:, np.newaxis]
+        return vectors
+
+    def match_many(self, query, sentences):
+        """
+        Return the similarities between the query and each sentence
+
+        The query is embedded once, the sentences together with
+        sentence_vectors, and the cosines come from a single matrix-vector
+        product. The sentences without known words have a zero similarity.
+
+        @type query: string
+        @param query: The query sentence
+        @type sentences: list
+        @param sentences: The candidate sentences
+        @rtype: numpy.ndarray
+        @return: The similarities, in the order of the sentences
+        """
+        query_vector = np.asarray(self.sentence_vector(query), dtype=np.float64)
+        query_norm = np.sqrt(np.dot(query_vector, query_vector))
+        if query_norm == 0.0 or len(sentences) == 0:
+            return np.zeros(len(sentences))
+        vectors = self.sentence_vectors(sentences)
+        norms = np.sqrt(np.einsum("ij,ij->i", vectors, vectors)) * query_norm
+        scores = np.dot(vectors, query_vector)
+        valid = norms > 0.0
+        scores[valid] /= norms[valid]
+        scores[~valid] = 0.0
+        return scores
+
     def get_embedding_matrix(self):
-        embedding_matrix = np.zeros((self.vocabulary_size, self.vector_dim))
-        for word, i in self.word_to_index.items():
-            vector = self.get_vector(word)
-            embedding_matrix[i] = vector
-        return embedding_matrix
+        """
+        Return the (vocabulary_size + 1, vector_dim) embedding matrix, row 0 being the padding
+        """
+        return self.embedding_matrix
 
     def get_evaluated_sentence(self, sentence):
         first_word = True
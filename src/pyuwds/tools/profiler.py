@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import cProfile
+import pstats
+import rospy
+from io import BytesIO
+from threading import Lock, local
+
+DEFAULT_INTERVAL = 60.0
+DEFAULT_TOP = 20
+DEFAULT_MAX_FILES = 10
+
+
+def default_output_dir():
+    return os.path.join(os.environ.get("ROS_HOME", os.path.expanduser("~/.ros")), "uwds_profiles")
+
+
+def profiling_enabled(transport):
+    """
+    Return True if the profiling is activated by the '~profiling' param or
+    the UWDS_PROFILING environment variable
+    """
+    default = os.environ.get("UWDS_PROFILING", "").lower() in ["1", "true", "yes", "on"]
+    return transport.get_param("~profiling", default)
+
+
+class _ThreadProfile(object):
+    """
+    The profile of one thread, swapped by the dumps under its lock
+    """
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.lock = Lock()
+        self.depth = 0
+
+
+class Profiler(object):
+    """
+    Deterministic profiler of the client callbacks
+
+    The wrapped callbacks are profiled with one cProfile instance per thread
+    (subscribers, timers and services run in their own threads), merged at
+    each dump. Dumps are written in rotating .prof files readable with
+    pstats or snakeviz and a summary of the hottest functions is logged.
+    When disabled, wrap() returns the callbacks untouched.
+    """
+    def __init__(self, name, enabled=False, interval=DEFAULT_INTERVAL, top=DEFAULT_TOP,
+                 output_dir=None, max_files=DEFAULT_MAX_FILES):
+        """
+        @type name: string
+        @param name: The prefix of the dump files
+        @type enabled: bool
+        @param enabled: Activate the profiling
+        @type interval: float
+        @param interval: The dump period in seconds, no periodic dump if <= 0
+        @type top: int
+        @param top: The number of functions of the logged summary
+        @type output_dir: string
+        @param output_dir: The dump directory, $ROS_HOME/uwds_profiles if None
+        @type max_files: int
+        @param max_files: The number of dump files kept before overwriting the oldest
+        """
+        self.__name = name.strip("/").replace("/", "_")
+        self.__enabled = enabled
+        self.__top = top
+        self.__output_dir = output_dir if output_dir is not None else default_output_dir()
+        self.__max_files = max_files
+        self.__nb_dumps = 0
+        self.__profiles = []
+        self.__profiles_mutex = Lock()
+        self.__local = local()
+        self.__timer = None
+        if self.__enabled:
+            if not os.path.isdir(self.__output_dir):
+                os.makedirs(self.__output_dir)
+            if interval > 0:
+                self.__timer = rospy.Timer(rospy.Duration(interval), self.handleTimer)
+            rospy.loginfo("[%s::profiler] Profiling enabled, dumps in '%s'" % (name, self.__output_dir))
+
+    def enabled(self):
+        return self.__enabled
+
+    def __thread_profile(self):
+        thread_profile = getattr(self.__local, "profile", None)
+        if thread_profile is None:
+            thread_profile = _ThreadProfile()
+            self.__local.profile = thread_profile
+            self.__profiles_mutex.acquire()
+            self.__profiles.append(thread_profile)
+            self.__profiles_mutex.release()
+        return thread_profile
+
+    def wrap(self, callback):
+        """
+        Return the callback profiled, or the callback itself if disabled
+        """
+        if not self.__enabled:
+            return callback
+
+        def profiled(*args, **kwargs):
+            thread_profile = self.__thread_profile()
+            if thread_profile.depth == 0:
+                thread_profile.lock.acquire()
+                thread_profile.profile.enable()
+            thread_profile.depth += 1
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                thread_profile.depth -= 1
+                if thread_profile.depth == 0:
+                    thread_profile.profile.disable()
+                    thread_profile.lock.release()
+        profiled.__name__ = getattr(callback, "__name__", "callback")
+        profiled.__doc__ = getattr(callback, "__doc__", None)
+        return profiled
+
+    def collect(self):
+        """
+        Merge and reset the profiles of all the threads
+
+        @return: the merged pstats.Stats, or None if nothing was profiled
+        """
+        self.__profiles_mutex.acquire()
+        profiles = list(self.__profiles)
+        self.__profiles_mutex.release()
+        stats = None
+        for thread_profile in profiles:
+            thread_profile.lock.acquire()
+            profile = thread_profile.profile
+            thread_profile.profile = cProfile.Profile()
+            thread_profile.lock.release()
+            profile.create_stats()
+            if len(profile.stats) == 0:
+                continue
+            if stats is None:
+                stats = pstats.Stats(profile, stream=BytesIO())
+            else:
+                stats.add(profile)
+        return stats
+
+    def dump(self):
+        """
+        Write the profile collected since the last dump and log its hottest functions
+
+        @return: the dump file path, or None if nothing was profiled
+        """
+        stats = self.collect()
+        if stats is None:
+            return None
+        filename = os.path.join(self.__output_dir, "%s_%03d.prof" % (self.__name, self.__nb_dumps % self.__max_files))
+        self.__nb_dumps += 1
+        stats.dump_stats(filename)
+        summary = BytesIO()
+        stats.stream = summary
+        stats.sort_stats("cumulative").print_stats(self.__top)
+        rospy.loginfo("[%s::profiler] Profile dumped in '%s'\n%s" % (self.__name, filename, summary.getvalue()))
+        return filename
+
+    def handleTimer(self, event):
+        try:
+            self.dump()
+        except Exception as e:
+            rospy.logwarn("[%s::profiler] Exception occurred while dumping the profile : %s" % (self.__name, e))
+
+    def shutdown(self):
+        if self.__timer is not None:
+            self.__timer.shutdown()
+            self.__timer = None
+        if self.__enabled:
+            self.dump()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import zlib
+import struct
+import rospy
+from io import BytesIO
+from threading import Lock
+from std_msgs.msg import Header
+from uwds_msgs.msg import Client, Mesh, ChangesInContextStamped
+from uwds_msgs.srv import GetScene, GetSceneRequest, GetSceneResponse
+from uwds_msgs.srv import GetTimeline, GetTimelineRequest, GetTimelineResponse
+from uwds_msgs.srv import GetMesh, GetMeshRequest
+from pyuwds.types.gen_uuid import gen_uuid
+from pyuwds.server import UnderworldsServer
+from pyuwds.proxy.transport import InProcessTransport, get_default_transport, set_default_transport
+from pyuwds.tools.statistics import nb_changes_elements
+
+MAGIC = b"UWDSREC\0"
+VERSION = 1
+FILE_HEADER = struct.Struct("<8sII")
+# kind, world index, stamp secs, stamp nsecs, payload length
+RECORD_HEADER = struct.Struct("<BHIII")
+# record offset, kind, world index, stamp secs, stamp nsecs
+INDEX_ENTRY = struct.Struct("<QBHII")
+# index offset, number of records, worlds table offset
+FOOTER = struct.Struct("<QQQ8s")
+STRING_LENGTH = struct.Struct("<H")
+
+COMPRESSED = 1
+
+SCENE = 1
+TIMELINE = 2
+MESH = 3
+CHANGES = 4
+
+RecordKindNames = {SCENE: "scene", TIMELINE: "timeline", MESH: "mesh", CHANGES: "changes"}
+RecordKindTypes = {SCENE: GetSceneResponse, TIMELINE: GetTimelineResponse, MESH: Mesh, CHANGES: ChangesInContextStamped}
+
+
+class ChangesRecorder(object):
+    """
+    Record the initial state and the change stream of some worlds
+
+    The file starts with a snapshot of each world (scene, timeline and the
+    meshes they use) followed by the change batches as received, each record
+    being the ROS serialization of the message, optionally compressed. An
+    index of the records and the table of the world names are written at
+    the end of the file when the recorder is closed.
+    """
+    def __init__(self, filename, worlds, transport=None, compress=True, name="uwds_recorder"):
+        """
+        @type filename: string
+        @param filename: The file to write
+        @type worlds: list
+        @param worlds: The names of the worlds to record
+        @type transport: Transport
+        @param transport: The transport to use, the default one if None
+        @type compress: bool
+        @param compress: Compress the records with zlib
+        """
+        self.__transport = transport if transport is not None else get_default_transport()
+        self.__client = Client(name=name, id=gen_uuid(), type=Client.MONITOR)
+        self.__compress = compress
+        self.__file = open(filename, "wb")
+        self.__file.write(FILE_HEADER.pack(MAGIC, VERSION, COMPRESSED if compress else 0))
+        self.__worlds = []
+        self.__index = []
+        self.__meshes_recorded = set()
+        self.__mutex = Lock()
+        self.__subscribers = []
+        self.__pending_changes = {}
+        for world_name in worlds:
+            self.__worlds.append(world_name)
+            # changes received during the snapshot are kept and written after it
+            self.__pending_changes[world_name] = []
+            self.__subscribers.append(self.__transport.subscriber(world_name+"/changes", ChangesInContextStamped, self.changes_callback, 100))
+        for world_name in worlds:
+            self.__record_snapshot(world_name)
+
+    def __write(self, kind, world_name, stamp, msg):
+        buff = BytesIO()
+        msg.serialize(buff)
+        payload = buff.getvalue()
+        if self.__compress:
+            payload = zlib.compress(payload, 1)
+        world_index = self.__worlds.index(world_name)
+        self.__index.append((self.__file.tell(), kind, world_index, stamp.secs, stamp.nsecs))
+        self.__file.write(RECORD_HEADER.pack(kind, world_index, stamp.secs, stamp.nsecs, len(payload)))
+        self.__file.write(payload)
+
+    def __record_snapshot(self, world_name):
+        self.__transport.wait_for_service("uwds/get_scene")
+        scene_request = GetSceneRequest()
+        scene_request.ctxt.client = self.__client
+        scene_request.ctxt.world = world_name
+        scene = self.__transport.service_proxy("uwds/get_scene", GetScene)(scene_request)
+        timeline_request = GetTimelineRequest()
+        timeline_request.ctxt.client = self.__client
+        timeline_request.ctxt.world = world_name
+        timeline = self.__transport.service_proxy("uwds/get_timeline", GetTimeline)(timeline_request)
+        stamp = rospy.Time.now()
+        self.__mutex.acquire()
+        try:
+            for node in scene.nodes:
+                self.__record_meshes(world_name, stamp, node.properties)
+            self.__write(SCENE, world_name, stamp, scene)
+            self.__write(TIMELINE, world_name, stamp, timeline)
+            for msg in self.__pending_changes.pop(world_name):
+                self.__record_changes(msg)
+        finally:
+            self.__mutex.release()
+
+    def __record_meshes(self, world_name, stamp, properties):
+        for property in properties:
+            if property.name == "meshes" and property.data != "":
+                for mesh_id in property.data.split(","):
+                    if mesh_id not in self.__meshes_recorded:
+                        response = self.__transport.service_proxy("uwds/get_mesh", GetMesh)(GetMeshRequest(mesh_id=mesh_id))
+                        if response.success:
+                            self.__write(MESH, world_name, stamp, response.mesh)
+                            self.__meshes_recorded.add(mesh_id)
+
+    def __record_changes(self, msg):
+        for mesh in msg.changes.meshes_to_update:
+            self.__meshes_recorded.add(mesh.id)
+        self.__write(CHANGES, msg.ctxt.world, msg.header.stamp, msg)
+
+    def changes_callback(self, msg):
+        self.__mutex.acquire()
+        try:
+            if self.__file.closed:
+                return
+            if msg.ctxt.world in self.__pending_changes:
+                self.__pending_changes[msg.ctxt.world].append(msg)
+            else:
+                self.__record_changes(msg)
+        finally:
+            self.__mutex.release()
+
+    def nb_records(self):
+        return len(self.__index)
+
+    def close(self):
+        """
+        Stop the recording and write the index
+        """
+        for subscriber in self.__subscribers:
+            subscriber.unregister()
+        self.__mutex.acquire()
+        try:
+            index_offset = self.__file.tell()
+            for entry in self.__index:
+                self.__file.write(INDEX_ENTRY.pack(*entry))
+            worlds_offset = self.__file.tell()
+            self.__file.write(STRING_LENGTH.pack(len(self.__worlds)))
+            for world_name in self.__worlds:
+                encoded = world_name.encode("utf-8")
+                self.__file.write(STRING_LENGTH.pack(len(encoded)))
+                self.__file.write(encoded)
+            self.__file.write(FOOTER.pack(index_offset, len(self.__index), worlds_offset, MAGIC))
+            self.__file.close()
+        finally:
+            self.__mutex.release()
+
+
+class ChangesRecord(object):
+    """
+    Read a file written by the ChangesRecorder
+
+    Files whose recording was interrupted have no index, it is rebuilt by
+    scanning the records.
+    """
+    def __init__(self, filename):
+        self.__file = open(filename, "rb")
+        magic, version, flags = FILE_HEADER.unpack(self.__file.read(FILE_HEADER.size))
+        if magic != MAGIC:
+            raise RuntimeError("'%s' is not an Underworlds record" % filename)
+        if version != VERSION:
+            raise RuntimeError("Unsupported record version %d" % version)
+        self.__compressed = flags & COMPRESSED
+        self.__file.seek(0, os.SEEK_END)
+        size = self.__file.tell()
+        footer = None
+        if size >= FILE_HEADER.size + FOOTER.size:
+            self.__file.seek(size - FOOTER.size)
+            footer = FOOTER.unpack(self.__file.read(FOOTER.size))
+        if footer is not None and footer[3] == MAGIC:
+            self.__read_index(*footer[:3])
+        else:
+            rospy.logwarn("[changesRecord::init] No index found in '%s', scanning the records" % filename)
+            self.__scan(size)
+
+    def __read_index(self, index_offset, nb_records, worlds_offset):
+        self.__file.seek(index_offset)
+        data = self.__file.read(nb_records * INDEX_ENTRY.size)
+        self.__index = [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) for i in range(0, nb_records)]
+        self.__file.seek(worlds_offset)
+        self.__worlds = []
+        for i in range(0, STRING_LENGTH.unpack(self.__file.read(STRING_LENGTH.size))[0]):
+            length = STRING_LENGTH.unpack(self.__file.read(STRING_LENGTH.size))[0]
+            self.__worlds.append(self.__file.read(length).decode("utf-8"))
+
+    def __scan(self, size):
+        self.__index = []
+        offset = FILE_HEADER.size
+        worlds = {}
+        while offset + RECORD_HEADER.size <= size:
+            self.__file.seek(offset)
+            kind, world_index, secs, nsecs, length = RECORD_HEADER.unpack(self.__file.read(RECORD_HEADER.size))
+            if kind not in RecordKindTypes or offset + RECORD_HEADER.size + length > size:
+                break
+            self.__index.append((offset, kind, world_index, secs, nsecs))
+            if kind == CHANGES and world_index not in worlds:
+                worlds[world_index] = self.__read(offset)[3].ctxt.world
+            offset += RECORD_HEADER.size + length
+        self.__worlds = [worlds.get(i, "") for i in range(0, max(worlds.keys()) + 1 if len(worlds) > 0 else 0)]
+
+    def __read(self, offset):
+        self.__file.seek(offset)
+        kind, world_index, secs, nsecs, length = RECORD_HEADER.unpack(self.__file.read(RECORD_HEADER.size))
+        payload = self.__file.read(length)
+        if self.__compressed:
+            payload = zlib.decompress(payload)
+        msg = RecordKindTypes[kind]()
+        msg.deserialize(payload)
+        return kind, world_index, rospy.Time(secs, nsecs), msg
+
+    def worlds(self):
+        return list(self.__worlds)
+
+    def __len__(self):
+        return len(self.__index)
+
+    def nb_changes(self):
+        return len([entry for entry in self.__index if entry[1] == CHANGES])
+
+    def start(self):
+        """
+        Return the stamp of the first change batch, None if no changes were recorded
+        """
+        for entry in self.__index:
+            if entry[1] == CHANGES:
+                return rospy.Time(entry[3], entry[4])
+        return None
+
+    def records(self, kinds=None, worlds=None):
+        """
+        Iterate over the records in file order
+
+        @return: a generator of (kind, world_name, stamp, msg) tuples
+        """
+        for offset, kind, world_index, secs, nsecs in self.__index:
+            if kinds is not None and kind not in kinds:
+                continue
+            if worlds is not None and self.__worlds[world_index] not in worlds:
+                continue
+            kind, world_index, stamp, msg = self.__read(offset)
+            yield kind, self.__worlds[world_index], stamp, msg
+
+    def close(self):
+        self.__file.close()
+
+
+class ChangesReplayer(object):
+    """
+    Replay a record into clients living in the same process
+
+    An in-process Underworlds server is seeded with the recorded snapshots
+    and becomes the default transport, so that any UwdsClient created
+    afterwards (e.g. a ReconfigurableClient subclass) connects to it. The
+    change batches are then published at the recorded pace multiplied by
+    the speed factor, or as fast as the clients consume them.
+    """
+    def __init__(self, filename, params=None):
+        """
+        @type filename: string
+        @param filename: The record to replay
+        @type params: dict
+        @param params: The parameters of the in-process transport, the
+                       recorded worlds are the '~default_inputs' if not given
+        """
+        self.__record = ChangesRecord(filename)
+        params = dict(params) if params is not None else {}
+        params.setdefault("~default_inputs", " ".join(self.__record.worlds()))
+        self.__transport = InProcessTransport(params)
+        self.__server = UnderworldsServer(self.__transport, name="uwds_replay_server")
+        self.__seed()
+        self.__previous_transport = get_default_transport()
+        set_default_transport(self.__transport)
+        self.__publishers = {}
+
+    def __seed(self):
+        for kind, world_name, stamp, msg in self.__record.records(kinds=[SCENE, TIMELINE, MESH]):
+            world = self.__server.worlds()[world_name]
+            if kind == MESH:
+                self.__server.meshes().update([msg])
+            elif kind == SCENE:
+                world.scene().reset(msg.root_id)
+                world.scene().update([node for node in msg.nodes if node.id != msg.root_id])
+            elif kind == TIMELINE:
+                world.timeline().reset(msg.origin.data)
+                world.timeline().update(msg.situations)
+
+    def transport(self):
+        return self.__transport
+
+    def server(self):
+        return self.__server
+
+    def record(self):
+        return self.__record
+
+    def replay(self, client, speed=1.0, restamp=True, max_backlog=10, timeout=10.0):
+        """
+        Publish the recorded change batches to the given client
+
+        @type client: UwdsClient
+        @param client: The client under test, created after the replayer
+        @type speed: float
+        @param speed: The replay speed factor, as fast as possible if <= 0
+        @type restamp: bool
+        @param restamp: Stamp the change batches at their publication so that the delays are measured
+        @type max_backlog: int
+        @param max_backlog: The number of messages published and not yet received
+                            by the client before waiting for it, so that none is dropped
+        @type timeout: float
+        @param timeout: The time to wait for the client to process the last messages
+        @return: the throughput and the client statistics as a dict
+        """
+        start = self.__record.start()
+        worlds = client.ctx.worlds()
+        published = {}
+        nb_elements = 0
+        wall_start = time.time()
+        for kind, world_name, stamp, msg in self.__record.records(kinds=[CHANGES]):
+            if speed > 0:
+                delay = (stamp - start).to_sec() / speed - (time.time() - wall_start)
+                if delay > 0:
+                    time.sleep(delay)
+            if world_name not in self.__publishers:
+                self.__publishers[world_name] = self.__transport.publisher(world_name+"/changes", ChangesInContextStamped, 20)
+                published[world_name] = 0
+            if worlds.has(world_name):
+                received = worlds[world_name].statistics().throughput.totals()[0]
+                while published[world_name] - received >= max_backlog:
+                    time.sleep(0.0005)
+                    received = worlds[world_name].statistics().throughput.totals()[0]
+            if restamp:
+                msg.header = Header(seq=msg.header.seq, stamp=rospy.Time.now(), frame_id=msg.header.frame_id)
+            self.__publishers[world_name].publish(msg)
+            published[world_name] += 1
+            nb_elements += nb_changes_elements(msg.changes)
+        # wait for the client to process the last messages
+        deadline = time.time() + timeout
+        for world_name, nb_published in published.items():
+            if worlds.has(world_name):
+                while worlds[world_name].statistics().on_changes.count() < nb_published and time.time() < deadline:
+                    time.sleep(0.001)
+        duration = time.time() - wall_start
+        nb_messages = sum(published.values())
+        return {"messages": nb_messages,
+                "elements": nb_elements,
+                "duration": duration,
+                "messages_per_sec": nb_messages / duration if duration > 0 else 0.0,
+                "elements_per_sec": nb_elements / duration if duration > 0 else 0.0,
+                "worlds": worlds.statistics()}
+
+    def close(self):
+        set_default_transport(self.__previous_transport)
+        self.__server.shutdown()
+        self.__record.close()
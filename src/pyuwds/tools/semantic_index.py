@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from threading import Lock
+import numpy as np
+
+INITIAL_CAPACITY = 64
+
+
+class SemanticIndex(object):
+    """
+    Normalized sentence vectors of a set of elements, searched by cosine similarity
+
+    Each element (a node name, a situation description...) is a row of a
+    matrix of unit vectors, attributed to an owner (e.g. the subject of a
+    situation) so that the results give the best score of each owner.
+    The rows are updated incrementally: an element is only embedded again
+    when its sentence changes (its owner is updated in place), and a removed row is replaced by the last
+    one. A search is then a single matrix-vector product followed by a
+    top-k selection, whatever the number of queries. With an ANN index, only
+    the rows it proposes are scored.
+    """
+    def __init__(self, glove, preprocess=None, capacity=INITIAL_CAPACITY, ann=None):
+        """
+        @type glove: GloveManager
+        @param glove: The embeddings
+        @type preprocess: function
+        @param preprocess: Applied to the sentences before the embedding, e.g. to clean them
+        @type capacity: int
+        @param capacity: The initial number of rows
+        @type ann: LSHIndex
+        @param ann: An empty approximate index of the rows, the search is exact if None
+        """
+        self.__glove = glove
+        self.__ann = ann
+        self.__preprocess = preprocess if preprocess is not None else lambda sentence: sentence
+        self.__matrix = np.zeros((capacity, glove.vector_dim), dtype=np.float32)
+        self.__owner_ids = np.zeros(capacity, dtype=np.int32)
+        self.__size = 0
+        self.__rows = {}
+        self.__keys = []
+        self.__sentences = {}
+        # the owners are numbered to compute the best score of each owner in NumPy
+        self.__owner_to_id = {}
+        self.__owners = []
+        self.__owner_references = []
+        self.__free_owner_ids = []
+        self.__mutex = Lock()
+
+    def __len__(self):
+        return self.__size
+
+    def has(self, key):
+        return key in self.__rows
+
+    def update(self, key, sentence, owner=None):
+        """
+        Add or update an element, its owner being itself if None
+        """
+        self.update_many([key], [sentence], [owner])
+
+    def update_many(self, keys, sentences, owners=None):
+        """
+        Add or update several elements, embedded together
+        """
+        if owners is None:
+            owners = [None] * len(keys)
+        self.__mutex.acquire()
+        try:
+            owners = [owners[i] if owners[i] is not None else keys[i] for i in range(0, len(keys))]
+            changed = []
+            for i in range(0, len(keys)):
+                key = keys[i]
+                if self.__sentences.get(key) != sentences[i]:
+                    changed.append(i)
+                elif self.__owners[self.__owner_ids[self.__rows[key]]] != owners[i]:
+                    # same sentence, only the owner of the row changes
+                    row = self.__rows[key]
+                    self.__release_owner(self.__owner_ids[row])
+                    self.__owner_ids[row] = self.__acquire_owner(owners[i])
+            if len(changed) == 0:
+                return
+            vectors = self.__glove.sentence_vectors([self.__preprocess(sentences[i]) for i in changed])
+            norms = np.sqrt(np.einsum("ij,ij->i", vectors, vectors))
+            norms[norms == 0.0] = 1.0
+            vectors /= norms[:, np.newaxis]
+            rows = []
+            for position, i in enumerate(changed):
+                key = keys[i]
+                if key in self.__rows:
+                    row = self.__rows[key]
+                    self.__release_owner(self.__owner_ids[row])
+                else:
+                    row = self.__append_row(key)
+                self.__matrix[row] = vectors[position]
+                self.__owner_ids[row] = self.__acquire_owner(owners[i])
+                self.__sentences[key] = sentences[i]
+                rows.append(row)
+            if self.__ann is not None:
+                self.__ann.insert(rows, vectors)
+        finally:
+            self.__mutex.release()
+
+    def remove(self, key):
+        """
+        Remove an element, unknown keys are ignored
+        """
+        self.__mutex.acquire()
+        try:
+            if key not in self.__rows:
+                return
+            row = self.__rows.pop(key)
+            del self.__sentences[key]
+            self.__release_owner(self.__owner_ids[row])
+            last = self.__size - 1
+            if self.__ann is not None:
+                self.__ann.remove([last])
+            if row != last:
+                self.__matrix[row] = self.__matrix[last]
+                self.__owner_ids[row] = self.__owner_ids[last]
+                self.__keys[row] = self.__keys[last]
+                self.__rows[self.__keys[row]] = row
+                if self.__ann is not None:
+                    self.__ann.insert([row], self.__matrix[row:row + 1])
+            self.__keys.pop()
+            self.__size -= 1
+        finally:
+            self.__mutex.release()
+
+    def search(self, sentence, threshold=-1.0, k=0):
+        """
+        Return the owners whose elements are similar to the sentence
+
+        @type sentence: string
+        @param sentence: The query
+        @type threshold: float
+        @param threshold: The similarity an owner must exceed
+        @type k: int
+        @param k: The maximum number of results, unlimited if 0
+        @rtype: list
+        @return: The (owner, similarity) pairs by decreasing similarity
+        """
+        query = np.asarray(self.__glove.sentence_vector(self.__preprocess(sentence)), dtype=np.float32)
+        norm = np.sqrt(np.dot(query, query))
+        if norm == 0.0:
+            return []
+        query /= norm
+        self.__mutex.acquire()
+        try:
+            if self.__ann is not None:
+                rows = self.__ann.candidates(query)
+                scores = np.dot(self.__matrix[rows], query)
+                candidates = rows[scores > threshold]
+                scores = scores[scores > threshold]
+            else:
+                scores = np.dot(self.__matrix[:self.__size], query)
+                candidates = np.flatnonzero(scores > threshold)
+                scores = scores[candidates]
+            if len(candidates) == 0:
+                return []
+            best = np.full(len(self.__owners), -np.inf, dtype=np.float32)
+            np.maximum.at(best, self.__owner_ids[candidates], scores)
+            selected = np.flatnonzero(best > threshold)
+            if k > 0 and len(selected) > k:
+                selected = selected[np.argpartition(-best[selected], k - 1)[:k]]
+            selected = selected[np.argsort(-best[selected], kind="mergesort")]
+            owners = self.__owners
+            return [(owners[i], float(best[i])) for i in selected]
+        finally:
+            self.__mutex.release()
+
+    def __append_row(self, key):
+        if self.__size == self.__matrix.shape[0]:
+            matrix = np.zeros((2 * self.__matrix.shape[0], self.__matrix.shape[1]), dtype=np.float32)
+            matrix[:self.__size] = self.__matrix
+            owner_ids = np.zeros(2 * self.__matrix.shape[0], dtype=np.int32)
+            owner_ids[:self.__size] = self.__owner_ids
+            self.__matrix = matrix
+            self.__owner_ids = owner_ids
+        row = self.__size
+        self.__size += 1
+        self.__rows[key] = row
+        self.__keys.append(key)
+        return row
+
+    def __acquire_owner(self, owner):
+        if owner in self.__owner_to_id:
+            owner_id = self.__owner_to_id[owner]
+            self.__owner_references[owner_id] += 1
+            return owner_id
+        if len(self.__free_owner_ids) > 0:
+            owner_id = self.__free_owner_ids.pop()
+            self.__owners[owner_id] = owner
+            self.__owner_references[owner_id] = 1
+        else:
+            owner_id = len(self.__owners)
+            self.__owners.append(owner)
+            self.__owner_references.append(1)
+        self.__owner_to_id[owner] = owner_id
+        return owner_id
+
+    def __release_owner(self, owner_id):
+        self.__owner_references[owner_id] -= 1
+        if self.__owner_references[owner_id] == 0:
+            del self.__owner_to_id[self.__owners[owner_id]]
+            self.__owners[owner_id] = None
+            self.__free_owner_ids.append(owner_id)
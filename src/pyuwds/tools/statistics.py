@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+import time
+from io import BytesIO
+from collections import deque
+from threading import Lock
+
+HISTOGRAM_MIN = 1e-6  # 1us
+HISTOGRAM_FACTOR = 1.5
+HISTOGRAM_NB_BUCKETS = 48  # up to ~ 300s
+
+RATE_WINDOW = 10.0
+
+
+class Histogram(object):
+    """
+    Histogram of durations in seconds over logarithmic buckets
+    """
+    def __init__(self):
+        self.__buckets = [0] * (HISTOGRAM_NB_BUCKETS + 1)
+        self.__count = 0
+        self.__sum = 0.0
+        self.__min = float("inf")
+        self.__max = 0.0
+        self.__mutex = Lock()
+
+    def record(self, value):
+        if value < HISTOGRAM_MIN:
+            index = 0
+        else:
+            index = min(int(math.log(value / HISTOGRAM_MIN) / math.log(HISTOGRAM_FACTOR)) + 1, HISTOGRAM_NB_BUCKETS)
+        self.__mutex.acquire()
+        self.__buckets[index] += 1
+        self.__count += 1
+        self.__sum += value
+        self.__min = min(self.__min, value)
+        self.__max = max(self.__max, value)
+        self.__mutex.release()
+
+    def count(self):
+        return self.__count
+
+    def mean(self):
+        return self.__sum / self.__count if self.__count > 0 else 0.0
+
+    def percentile(self, percent):
+        """
+        Return the upper bound of the bucket holding the given percentile
+        """
+        self.__mutex.acquire()
+        buckets = list(self.__buckets)
+        count = self.__count
+        maximum = self.__max
+        self.__mutex.release()
+        if count == 0:
+            return 0.0
+        rank = count * percent / 100.0
+        cumulated = 0
+        for index, nb in enumerate(buckets):
+            cumulated += nb
+            if cumulated >= rank:
+                return min(HISTOGRAM_MIN * pow(HISTOGRAM_FACTOR, index), maximum)
+        return maximum
+
+    def reset(self):
+        self.__mutex.acquire()
+        self.__buckets = [0] * (HISTOGRAM_NB_BUCKETS + 1)
+        self.__count = 0
+        self.__sum = 0.0
+        self.__min = float("inf")
+        self.__max = 0.0
+        self.__mutex.release()
+
+    def to_dict(self):
+        return {"count": self.__count,
+                "mean": self.mean(),
+                "min": self.__min if self.__count > 0 else 0.0,
+                "max": self.__max,
+                "p50": self.percentile(50),
+                "p90": self.percentile(90),
+                "p99": self.percentile(99)}
+
+
+class RateCounter(object):
+    """
+    Count events and their sizes over a sliding window of one-second slots
+    """
+    def __init__(self, window=RATE_WINDOW):
+        self.__window = window
+        self.__slots = deque()
+        self.__totals = [0, 0, 0]
+        # the second of the first event, the rates are averaged over less than the window before it is full
+        self.__start = None
+        self.__mutex = Lock()
+
+    def record(self, nb_elements=0, nb_bytes=0, now=None):
+        now = now if now is not None else time.time()
+        second = int(now)
+        self.__mutex.acquire()
+        if len(self.__slots) == 0 or self.__slots[-1][0] != second:
+            # pruned here too, the rates may never be read
+            self.__prune(now)
+            self.__slots.append([second, 0, 0, 0])
+        if self.__start is None:
+            self.__start = second
+        slot = self.__slots[-1]
+        slot[1] += 1
+        slot[2] += nb_elements
+        slot[3] += nb_bytes
+        self.__totals[0] += 1
+        self.__totals[1] += nb_elements
+        self.__totals[2] += nb_bytes
+        self.__mutex.release()
+
+    def rates(self, now=None):
+        """
+        Return the (messages, elements, bytes) per second over the window
+        """
+        now = now if now is not None else time.time()
+        self.__mutex.acquire()
+        self.__prune(now)
+        sums = [sum(s[i] for s in self.__slots) for i in range(1, 4)]
+        duration = self.__window
+        if self.__start is not None:
+            duration = min(self.__window, max(now - self.__start, 1.0))
+        self.__mutex.release()
+        return tuple(float(s) / duration for s in sums)
+
+    def __prune(self, now):
+        while len(self.__slots) > 0 and self.__slots[0][0] <= now - self.__window:
+            self.__slots.popleft()
+
+    def totals(self):
+        return tuple(self.__totals)
+
+    def to_dict(self):
+        messages, elements, bytes = self.rates()
+        return {"messages_per_sec": messages,
+                "elements_per_sec": elements,
+                "bytes_per_sec": bytes,
+                "total_messages": self.__totals[0],
+                "total_elements": self.__totals[1],
+                "total_bytes": self.__totals[2]}
+
+
+class CacheStatistics(object):
+    """
+    Count the hits, misses and invalidated entries of a cache
+    """
+    def __init__(self):
+        self.__hits = 0
+        self.__misses = 0
+        self.__invalidations = 0
+        self.__mutex = Lock()
+
+    def record_hit(self):
+        self.__mutex.acquire()
+        self.__hits += 1
+        self.__mutex.release()
+
+    def record_miss(self):
+        self.__mutex.acquire()
+        self.__misses += 1
+        self.__mutex.release()
+
+    def record_invalidations(self, nb_entries):
+        self.__mutex.acquire()
+        self.__invalidations += nb_entries
+        self.__mutex.release()
+
+    def hit_rate(self):
+        total = self.__hits + self.__misses
+        return float(self.__hits) / total if total > 0 else 0.0
+
+    def reset(self):
+        self.__mutex.acquire()
+        self.__hits = 0
+        self.__misses = 0
+        self.__invalidations = 0
+        self.__mutex.release()
+
+    def to_dict(self):
+        return {"hits": self.__hits,
+                "misses": self.__misses,
+                "invalidations": self.__invalidations,
+                "hit_rate": self.hit_rate()}
+
+
+def nb_changes_elements(changes):
+    return len(changes.nodes_to_update) + len(changes.nodes_to_delete) \
+        + len(changes.situations_to_update) + len(changes.situations_to_delete) \
+        + len(changes.meshes_to_update) + len(changes.meshes_to_delete)
+
+
+def message_size(msg):
+    """
+    Return the serialized size of a ROS message (costs a serialization)
+    """
+    buff = BytesIO()
+    msg.serialize(buff)
+    return buff.tell()
+
+
+class WorldStatistics(object):
+    """
+    The instrumentation of a world mirror: delay from the publish stamp to
+    the receipt, time to apply the changes to the mirror, duration of the
+    client callback, message/element/byte rates and knowledge base cache
+    """
+    def __init__(self, count_bytes=False):
+        """
+        @type count_bytes: bool
+        @param count_bytes: Measure the message sizes, costs a serialization per message
+        """
+        self.count_bytes = count_bytes
+        self.delay = Histogram()
+        self.apply = Histogram()
+        self.on_changes = Histogram()
+        self.throughput = RateCounter()
+        self.kb_cache = CacheStatistics()
+
+    def reset(self):
+        self.delay.reset()
+        self.apply.reset()
+        self.on_changes.reset()
+        self.throughput = RateCounter()
+        self.kb_cache.reset()
+
+    def to_dict(self):
+        return {"delay": self.delay.to_dict(),
+                "apply": self.apply.to_dict(),
+                "on_changes": self.on_changes.to_dict(),
+                "throughput": self.throughput.to_dict(),
+                "kb_cache": self.kb_cache.to_dict()}
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import random
+from uwds_msgs.msg import Node, Property, Situation
+from pyuwds.types.gen_uuid import gen_uuid
+from pyuwds.types.nodes import MESH, CAMERA, ENTITY
+from pyuwds.types.situations import FACT
+
+CLASSES = ["Cup", "Table", "Box", "Bin", "Ball", "Shelf", "Chair", "Bottle"]
+COLORS = ["red", "green", "blue", "yellow", "orange", "black", "white"]
+NODE_TYPES = [MESH, MESH, MESH, ENTITY, CAMERA]
+PREDICATES = ["isOnTop", "isIn", "isNextTo", "isAbove", "isVisible"]
+
+
+def synthetic_node(index, rand, node_type=None):
+    """
+    Return a node with random name, pose and the properties used by the
+    reasoners (class, aabb for the meshes, field of view for the cameras)
+    """
+    node = Node(id=gen_uuid(), name="%s_%s_%d" % (rand.choice(COLORS), rand.choice(CLASSES).lower(), index))
+    node.type = node_type if node_type is not None else rand.choice(NODE_TYPES)
+    node.position.pose.position.x = rand.uniform(-5.0, 5.0)
+    node.position.pose.position.y = rand.uniform(-5.0, 5.0)
+    node.position.pose.position.z = rand.uniform(0.0, 2.0)
+    node.position.pose.orientation.w = 1.0
+    node.properties.append(Property("class", rand.choice(CLASSES)))
+    if node.type == MESH:
+        node.properties.append(Property("aabb", "%f,%f,%f" % (rand.uniform(0.05, 1.0), rand.uniform(0.05, 1.0), rand.uniform(0.05, 1.0))))
+    if node.type == CAMERA:
+        node.properties.append(Property("hfov", "60.0"))
+        node.properties.append(Property("aspect", "1.3333"))
+        node.properties.append(Property("clipnear", "0.1"))
+        node.properties.append(Property("clipfar", "100.0"))
+    return node
+
+
+def synthetic_nodes(size, seed=0):
+    rand = random.Random(seed)
+    return [synthetic_node(i, rand) for i in range(0, size)]
+
+
+def synthetic_situation(subject, object, rand, stamp):
+    """
+    Return a fact between the two given nodes, started at the given stamp
+    """
+    predicate = rand.choice(PREDICATES)
+    situation = Situation(id=gen_uuid(), type=FACT)
+    situation.description = "%s(%s,%s)" % (predicate, subject.name, object.name)
+    situation.confidence = rand.uniform(0.5, 1.0)
+    situation.start.data = stamp
+    situation.properties.append(Property("subject", subject.id))
+    situation.properties.append(Property("object", object.id))
+    situation.properties.append(Property("predicate", predicate))
+    return situation
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import copy
+import json
+import time
+import uuid
+import zlib
+from threading import local, current_thread
+from uwds_msgs.msg import Property
+
+TRACE_PROPERTY = "_uwds_trace"
+
+
+def _with_trace_property(elements, data):
+    """
+    Return the elements with a copy of the first one, whose trace property is set to data (removed if None)
+    """
+    first = copy.copy(elements[0])
+    first.properties = [property for property in first.properties if property.name != TRACE_PROPERTY]
+    if data is not None:
+        first.properties.append(Property(name=TRACE_PROPERTY, data=data))
+    return [first] + list(elements[1:])
+
+
+def strip_trace(changes):
+    """
+    Return the changes without their trace property, to be applied to a world
+
+    The given changes are left untouched, a copy is only made if they carry a trace.
+    """
+    stripped = changes
+    for field in ["nodes_to_update", "situations_to_update"]:
+        elements = getattr(changes, field)
+        if len(elements) > 0 and any(property.name == TRACE_PROPERTY for property in elements[0].properties):
+            if stripped is changes:
+                stripped = copy.copy(changes)
+            setattr(stripped, field, _with_trace_property(elements, None))
+    return stripped
+
+
+class TraceContext(object):
+    """
+    The trace of a change through the clients: a trace id and the
+    publication time of each hop
+    """
+    def __init__(self, trace_id=None, hops=None):
+        self.trace_id = trace_id if trace_id is not None else uuid.uuid4().hex[:16]
+        self.hops = hops if hops is not None else []
+
+    def hop(self, client_name, stamp):
+        """
+        Return a new context extended by the given hop
+        """
+        return TraceContext(self.trace_id, self.hops + [(client_name, stamp)])
+
+    def last_hop(self):
+        return self.hops[-1] if len(self.hops) > 0 else (None, None)
+
+    def to_string(self):
+        return ";".join([self.trace_id] + ["%s@%.6f" % (client_name, stamp) for client_name, stamp in self.hops])
+
+    @staticmethod
+    def from_string(data):
+        fields = data.split(";")
+        hops = []
+        for field in fields[1:]:
+            client_name, stamp = field.rsplit("@", 1)
+            hops.append((client_name, float(stamp)))
+        return TraceContext(fields[0], hops)
+
+
+class Tracer(object):
+    """
+    Propagate trace contexts along the filter chains and export the spans
+
+    The context of a change batch travels in a reserved property of its
+    first updated node or situation, set on a copy of the published changes
+    and stripped by the receivers before applying them (see strip_trace),
+    so that it is never stored as a world state. When receiving changes, the context is
+    made current in the thread of the onChanges callback, and it is kept as
+    the last received one for the publications made from timers. Spans are
+    appended as Chrome trace events, one JSON object per line, to a file
+    that all the clients of the machine can share.
+    """
+    def __init__(self, client_name=None, filename=None):
+        """
+        @type client_name: string
+        @param client_name: The name of the client, shown as the process name
+                            so that the clients sharing a process are told apart
+        @type filename: string
+        @param filename: The spans file, tracing is disabled if None
+        """
+        self.__enabled = filename is not None
+        self.__local = local()
+        self.__last_received = None
+        self.__pid = zlib.crc32(client_name.encode("utf-8")) & 0x7fffffff if client_name is not None else os.getpid()
+        self.__fd = None
+        if self.__enabled:
+            self.__fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            self.__write({"name": "process_name", "ph": "M", "pid": self.__pid, "args": {"name": client_name}})
+
+    def enabled(self):
+        return self.__enabled
+
+    def current(self):
+        return getattr(self.__local, "trace", None)
+
+    def set_current(self, trace):
+        self.__local.trace = trace
+        if trace is not None:
+            self.__last_received = trace
+
+    def extract(self, changes, publisher_name):
+        """
+        Return the trace context of a change batch, or None if its publisher did not trace it
+        """
+        for elements in [changes.nodes_to_update, changes.situations_to_update]:
+            if len(elements) > 0:
+                for property in elements[0].properties:
+                    if property.name == TRACE_PROPERTY:
+                        trace = TraceContext.from_string(property.data)
+                        # a property forwarded untouched by an untraced client is stale
+                        if trace.last_hop()[0] == publisher_name:
+                            return trace
+                        return None
+        return None
+
+    def inject(self, changes, client_name):
+        """
+        Return a copy of a change batch carrying the current trace context, extended by this hop
+
+        Starts a new trace if no changes were received before. The given
+        changes are left untouched, and returned as is if they have no
+        updated node or situation to carry the context.
+        """
+        trace = self.current()
+        if trace is None:
+            trace = self.__last_received if self.__last_received is not None else TraceContext()
+        for field in ["nodes_to_update", "situations_to_update"]:
+            elements = getattr(changes, field)
+            if len(elements) > 0:
+                trace = trace.hop(client_name, time.time())
+                traced = copy.copy(changes)
+                setattr(traced, field, _with_trace_property(elements, trace.to_string()))
+                return traced
+        return changes
+
+    def span(self, name, start, end, trace, **args):
+        """
+        Export a span, start and end being wall clock times in seconds
+        """
+        args["trace_id"] = trace.trace_id
+        self.__write({"name": name, "cat": "uwds", "ph": "X", "pid": self.__pid,
+                      "tid": current_thread().ident, "ts": start * 1e6, "dur": (end - start) * 1e6, "args": args})
+
+    def __write(self, event):
+        # one write per event so that the lines of several processes do not interleave
+        os.write(self.__fd, (json.dumps(event) + "\n").encode("utf-8"))
+
+    def close(self):
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+            self.__enabled = False
+
+
+_disabled_tracer = Tracer()
+_tracers = {}
+
+
+def get_tracer(client_name):
+    """
+    Return the tracer of the given client, a disabled one unless the client configured it
+    """
+    return _tracers.get(client_name, _disabled_tracer)
+
+
+def set_tracer(client_name, tracer):
+    _tracers[client_name] = tracer
+
+
+def load_events(filename):
+    """
+    Return the events of a spans file, skipping truncated lines
+    """
+    events = []
+    with open(filename) as trace_file:
+        for line in trace_file:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                pass
+    return events
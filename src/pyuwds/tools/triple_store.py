@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from threading import RLock
+
+
+def parse_query(query):
+    """
+    Parse an Oro query as sent by the QueryKnowledgeBaseProxy
+
+    The query is either a single pattern, whose subject is the selected
+    variable ("?o isOn table"), or the selected variable followed by the
+    patterns ("?o, ?o isOn ?t, ?t rdf:type Table").
+
+    @type query: string
+    @param query: The query
+    @rtype: tuple
+    @return: The selected variable and the list of (subject, predicate, object) patterns
+    """
+    tokens = [token.strip() for token in query.split(",")]
+    patterns_str = tokens[1:] if len(tokens) > 1 else tokens
+    patterns = []
+    for pattern_str in patterns_str:
+        pattern = tuple(pattern_str.split())
+        if len(pattern) != 3:
+            raise ValueError("Invalid pattern '%s' in '%s', expected 'subject predicate object'" % (pattern_str, query))
+        patterns.append(pattern)
+    variable = tokens[0].split()[0] if tokens[0] != "" else ""
+    if not variable.startswith("?"):
+        raise ValueError("No variable selected by '%s'" % query)
+    if not any(variable in pattern for pattern in patterns):
+        raise ValueError("The variable %s is not used by '%s'" % (variable, query))
+    return variable, patterns
+
+
+def is_variable(term):
+    return term.startswith("?")
+
+
+class TripleStore(object):
+    """
+    An in-memory set of (subject, predicate, object) facts, indexed to answer conjunctive queries
+
+    The facts are asserted by sources (a node, a situation...): the facts of
+    a source are replaced or retracted together, and a fact asserted by
+    several sources stays until the last one retracts it. The facts are
+    indexed by subject, predicate and object (SPO), predicate, object and
+    subject (POS), and object, subject and predicate (OSP), so that any
+    pattern with at least one constant is a dict lookup.
+
+    A query is evaluated pattern by pattern, starting with the most
+    selective one, each pattern being matched with the variables bound by
+    the previous ones.
+    """
+    def __init__(self):
+        self.__spo = {}
+        self.__pos = {}
+        self.__osp = {}
+        self.__references = {}
+        self.__sources = {}
+        self.__mutex = RLock()
+
+    def __len__(self):
+        return len(self.__references)
+
+    def __contains__(self, triple):
+        return triple in self.__references
+
+    def sources(self):
+        return list(self.__sources.keys())
+
+    def triples(self, source):
+        """
+        Return the facts asserted by a source
+        """
+        return set(self.__sources.get(source, []))
+
+    def set_triples(self, source, triples):
+        """
+        Replace the facts asserted by a source
+        """
+        self.__mutex.acquire()
+        try:
+            triples = set(triples)
+            previous = self.__sources.get(source, set())
+            for triple in previous - triples:
+                self.__release(triple)
+            for triple in triples - previous:
+                self.__acquire(triple)
+            if len(triples) > 0:
+                self.__sources[source] = triples
+            elif source in self.__sources:
+                del self.__sources[source]
+        finally:
+            self.__mutex.release()
+
+    def add_triples(self, source, triples):
+        """
+        Add facts to the ones asserted by a source
+        """
+        self.__mutex.acquire()
+        try:
+            self.set_triples(source, self.__sources.get(source, set()) | set(triples))
+        finally:
+            self.__mutex.release()
+
+    def remove_triples(self, source):
+        """
+        Retract the facts asserted by a source, unknown sources are ignored
+        """
+        self.set_triples(source, [])
+
+    def clear(self):
+        self.__mutex.acquire()
+        self.__spo = {}
+        self.__pos = {}
+        self.__osp = {}
+        self.__references = {}
+        self.__sources = {}
+        self.__mutex.release()
+
+    def match(self, subject=None, predicate=None, object=None):
+        """
+        Return the facts matching a pattern, None matching any term
+        """
+        self.__mutex.acquire()
+        try:
+            return list(self.__match(subject, predicate, object))
+        finally:
+            self.__mutex.release()
+
+    def query(self, query):
+        """
+        Evaluate an Oro query
+
+        @type query: string
+        @param query: The query, e.g. "?o isOn table" or "?o, ?o isOn ?t, ?t rdf:type Table"
+        @rtype: list
+        @return: The distinct values of the selected variable
+        """
+        variable, patterns = parse_query(query)
+        self.__mutex.acquire()
+        try:
+            bindings = [{}]
+            remaining = list(patterns)
+            while len(remaining) > 0 and len(bindings) > 0:
+                pattern = min(remaining, key=lambda p: self.__cost(p, bindings[0]))
+                remaining.remove(pattern)
+                bindings = [b for binding in bindings for b in self.__extend(pattern, binding)]
+        finally:
+            self.__mutex.release()
+        result = []
+        found = set()
+        for binding in bindings:
+            value = binding[variable]
+            if value not in found:
+                found.add(value)
+                result.append(value)
+        return result
+
+    def __cost(self, pattern, binding):
+        """
+        The estimated number of matches of a pattern, the bound variables being constants
+        """
+        subject, predicate, object = [binding.get(t, t) if is_variable(t) else t for t in pattern]
+        bound = [not is_variable(t) for t in [subject, predicate, object]]
+        if all(bound):
+            return 0
+        if bound[0] and bound[1]:
+            return len(self.__spo.get(subject, {}).get(predicate, ()))
+        if bound[1] and bound[2]:
+            return len(self.__pos.get(predicate, {}).get(object, ()))
+        if bound[2] and bound[0]:
+            return len(self.__osp.get(object, {}).get(subject, ()))
+        # the number of distinct keys underestimates the matches, only the ordering matters
+        if bound[0]:
+            return len(self.__spo.get(subject, ())) + 1
+        if bound[2]:
+            return len(self.__osp.get(object, ())) + 1
+        if bound[1]:
+            return len(self.__pos.get(predicate, ())) + 1
+        return len(self.__references) + 1
+
+    def __extend(self, pattern, binding):
+        """
+        Yield the binding extended by each fact matching the pattern
+        """
+        terms = [binding.get(t, t) if is_variable(t) else t for t in pattern]
+        for triple in self.__match(*[None if is_variable(t) else t for t in terms]):
+            extended = binding
+            for term, value in zip(terms, triple):
+                if is_variable(term):
+                    if extended is binding:
+                        extended = dict(binding)
+                    # the same variable used twice in the pattern
+                    if extended.setdefault(term, value) != value:
+                        break
+            else:
+                yield extended
+
+    def __match(self, subject, predicate, object):
+        if subject is not None:
+            if predicate is not None:
+                objects = self.__spo.get(subject, {}).get(predicate, ())
+                if object is not None:
+                    return [(subject, predicate, object)] if object in objects else []
+                return [(subject, predicate, o) for o in objects]
+            if object is not None:
+                return [(subject, p, object) for p in self.__osp.get(object, {}).get(subject, ())]
+            return [(subject, p, o) for p, objects in self.__spo.get(subject, {}).items() for o in objects]
+        if predicate is not None:
+            if object is not None:
+                return [(s, predicate, object) for s in self.__pos.get(predicate, {}).get(object, ())]
+            return [(s, predicate, o) for o, subjects in self.__pos.get(predicate, {}).items() for s in subjects]
+        if object is not None:
+            return [(s, p, object) for s, predicates in self.__osp.get(object, {}).items() for p in predicates]
+        return list(self.__references.keys())
+
+    def __acquire(self, triple):
+        if triple in self.__references:
+            self.__references[triple] += 1
+            return
+        self.__references[triple] = 1
+        subject, predicate, object = triple
+        self.__spo.setdefault(subject, {}).setdefault(predicate, set()).add(object)
+        self.__pos.setdefault(predicate, {}).setdefault(object, set()).add(subject)
+        self.__osp.setdefault(object, {}).setdefault(subject, set()).add(predicate)
+
+    def __release(self, triple):
+        self.__references[triple] -= 1
+        if self.__references[triple] > 0:
+            return
+        del self.__references[triple]
+        subject, predicate, object = triple
+        for index, first, second, third in [(self.__spo, subject, predicate, object),
+                                            (self.__pos, predicate, object, subject),
+                                            (self.__osp, object, subject, predicate)]:
+            level = index[first]
+            level[second].discard(third)
+            if len(level[second]) == 0:
+                del level[second]
+                if len(level) == 0:
+                    del index[first]
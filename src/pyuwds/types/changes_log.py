@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import deque
+from threading import Lock
+from uwds_msgs.msg import Changes
+
+
+class ChangesLog(object):
+    """
+    Bounded ring buffer of the change batches applied to a world mirror
+
+    Each batch is tagged with a monotonically increasing version, so that a
+    consumer that knows the version it last saw can catch up with the
+    compacted changes instead of refetching the whole world.
+    """
+    def __init__(self, size):
+        """
+        @type size: int
+        @param size: The maximum number of change batches kept
+        """
+        self.__entries = deque(maxlen=size)
+        self.__version = 0
+        self.__mutex = Lock()
+
+    def _lock(self):
+        self.__mutex.acquire()
+
+    def _unlock(self):
+        self.__mutex.release()
+
+    def append(self, header, changes):
+        """
+        Record a change batch and return its version
+        """
+        self._lock()
+        self.__version += 1
+        self.__entries.append((self.__version, header, changes))
+        version = self.__version
+        self._unlock()
+        return version
+
+    def version(self):
+        return self.__version
+
+    def oldest_version(self):
+        """
+        Return the version of the oldest batch still in the buffer
+        """
+        self._lock()
+        version = self.__entries[0][0] if len(self.__entries) > 0 else self.__version + 1
+        self._unlock()
+        return version
+
+    def since(self, version):
+        """
+        Return the compacted changes applied after the given version
+
+        @return: a (version, changes) tuple, or None when the requested
+                 batches are no longer in the buffer and a full resync
+                 of the world is needed
+        """
+        self._lock()
+        current = self.__version
+        entries = [e for e in self.__entries if e[0] > version]
+        self._unlock()
+        if version > current or version < 0:
+            return None
+        if version < current and (len(entries) == 0 or entries[0][0] != version + 1):
+            return None
+        return current, self.compact([e[2] for e in entries])
+
+    def reset(self):
+        """
+        Drop the buffered batches, later consumers will have to resync
+        """
+        self._lock()
+        self.__entries.clear()
+        self._unlock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @staticmethod
+    def compact(changes_list):
+        """
+        Merge successive change batches into a single one, keeping only
+        the latest state of each element
+        """
+        nodes, nodes_deleted = ChangesLog.__merge(changes_list, "nodes_to_update", "nodes_to_delete")
+        situations, situations_deleted = ChangesLog.__merge(changes_list, "situations_to_update", "situations_to_delete")
+        meshes, meshes_deleted = ChangesLog.__merge(changes_list, "meshes_to_update", "meshes_to_delete")
+        compacted = Changes()
+        compacted.nodes_to_update = list(nodes.values())
+        compacted.nodes_to_delete = list(nodes_deleted)
+        compacted.situations_to_update = list(situations.values())
+        compacted.situations_to_delete = list(situations_deleted)
+        compacted.meshes_to_update = list(meshes.values())
+        compacted.meshes_to_delete = list(meshes_deleted)
+        return compacted
+
+    @staticmethod
+    def __merge(changes_list, to_update, to_delete):
+        updated = {}
+        deleted = set()
+        for changes in changes_list:
+            # deletions are applied before updates in a batch, see World.apply_changes
+            for id in getattr(changes, to_delete):
+                if id in updated:
+                    del updated[id]
+                deleted.add(id)
+            for element in getattr(changes, to_update):
+                deleted.discard(element.id)
+                updated[element.id] = element
+        return updated, deleted
@@ -1,13 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from threading import Lock
+from threading import RLock
 
 class ConcurrentContainer(object):
 
     def __init__(self):
         self.__map = {}
-        self.__mutex = Lock()
+        self.__mutex = RLock()
 
     def _lock(self):
         self.__mutex.acquire()
@@ -40,7 +40,7 @@ class ConcurrentContainer(object):
         self._unlock()
 
     def has(self, id):
-        return id in self.ids()
+        return id in self.__map
 
     def __len__(self):
         return len(self.__map)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import mmap
+import time
+import struct
+import tempfile
+import rospy
+
+MAGIC = b"UWDSPOSE"
+HEADER = struct.Struct("<8sII")
+# bumped on each slot allocation or release
+GENERATION = struct.Struct("<Q")
+SEQUENCE = struct.Struct("<Q")
+ID_SIZE = 64
+# id, position, orientation, linear & angular velocity, last_update
+SLOT_DATA = struct.Struct("<%ds13d2I" % ID_SIZE)
+SLOT_SIZE = SEQUENCE.size + SLOT_DATA.size
+
+DEFAULT_CAPACITY = 1024
+# a slot still being written after this delay belongs to a dead writer
+READ_TIMEOUT = 0.01
+NB_SPINS = 100
+# the readers check at most this often if the writer created the table again
+REMAP_CHECK_PERIOD = 0.1
+
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def pose_table_path(world_name):
+    return os.path.join(SHM_DIR, "uwds_poses_" + world_name.strip("/").replace("/", "_"))
+
+
+class PoseTable(object):
+    """
+    Shared-memory table of the node poses of a world
+
+    One mirror process writes the poses of the world nodes into fixed-size
+    slots, the other processes of the machine read them directly from the
+    shared pages without deserializing the change stream. Each slot is
+    protected by a sequence counter (seqlock): the writer makes it odd while
+    writing and even when done, readers retry when it changed under them.
+    Structural changes still go through the normal change stream.
+
+    The readers map the table again when its writer creates a new one, and
+    give up reading a slot left odd by a writer dead while writing it.
+    """
+    def __init__(self, world_name, capacity=DEFAULT_CAPACITY, create=False):
+        """
+        @type world_name: string
+        @param world_name: The world shared
+        @type capacity: int
+        @param capacity: The number of slots, only used by the writer
+        @type create: bool
+        @param create: Create the table as its writer, otherwise attach to it
+        """
+        self.__path = pose_table_path(world_name)
+        self.__writer = create
+        if create:
+            if os.path.exists(self.__path):
+                # readers still attached keep the previous pages
+                os.remove(self.__path)
+            fd = os.open(self.__path, os.O_CREAT | os.O_TRUNC | os.O_RDWR, 0o644)
+            size = HEADER.size + GENERATION.size + capacity * SLOT_SIZE
+            os.ftruncate(fd, size)
+            self.__map = mmap.mmap(fd, size)
+            os.close(fd)
+            HEADER.pack_into(self.__map, 0, MAGIC, capacity, ID_SIZE)
+            GENERATION.pack_into(self.__map, HEADER.size, 0)
+            self.__free_slots = list(reversed(range(capacity)))
+        else:
+            self.__map, capacity = self.__open()
+        self.__inode = os.stat(self.__path).st_ino
+        self.__last_remap_check = time.time()
+        self.__capacity = capacity
+        self.__slots = {}
+        self.__generation = -1
+
+    def __open(self):
+        fd = os.open(self.__path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            table = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        magic, capacity, id_size = HEADER.unpack_from(table, 0)
+        if magic != MAGIC or id_size != ID_SIZE:
+            table.close()
+            raise RuntimeError("'%s' is not an Underworlds pose table" % self.__path)
+        return table, capacity
+
+    def __check_remap(self):
+        """
+        Map the table again if its writer created a new one (reader side)
+        """
+        now = time.time()
+        if now - self.__last_remap_check < REMAP_CHECK_PERIOD:
+            return
+        self.__last_remap_check = now
+        try:
+            inode = os.stat(self.__path).st_ino
+        except OSError:
+            # no writer, the last poses are kept
+            return
+        if inode != self.__inode:
+            table, capacity = self.__open()
+            self.__map.close()
+            self.__map = table
+            self.__capacity = capacity
+            self.__inode = inode
+            self.__slots = {}
+            self.__generation = -1
+
+    def capacity(self):
+        return self.__capacity
+
+    def __offset(self, slot):
+        return HEADER.size + GENERATION.size + slot * SLOT_SIZE
+
+    def __read_generation(self):
+        return GENERATION.unpack_from(self.__map, HEADER.size)[0]
+
+    def __bump_generation(self):
+        GENERATION.pack_into(self.__map, HEADER.size, self.__read_generation() + 1)
+
+    def __write(self, slot, data):
+        offset = self.__offset(slot)
+        sequence = SEQUENCE.unpack_from(self.__map, offset)[0]
+        SEQUENCE.pack_into(self.__map, offset, sequence + 1)
+        SLOT_DATA.pack_into(self.__map, offset + SEQUENCE.size, *data)
+        SEQUENCE.pack_into(self.__map, offset, sequence + 2)
+
+    def __read(self, slot):
+        offset = self.__offset(slot)
+        nb_tries = 0
+        start = None
+        while True:
+            before = SEQUENCE.unpack_from(self.__map, offset)[0]
+            if before % 2 == 0:
+                data = SLOT_DATA.unpack_from(self.__map, offset + SEQUENCE.size)
+                if SEQUENCE.unpack_from(self.__map, offset)[0] == before:
+                    return data
+            nb_tries += 1
+            if nb_tries > NB_SPINS:
+                # the writer is slow or dead, yield the CPU until the timeout
+                if start is None:
+                    start = time.time()
+                elif time.time() - start > READ_TIMEOUT:
+                    raise RuntimeError("Slot %d of '%s' is still being written, its writer may be dead" % (slot, self.__path))
+                time.sleep(0.0001)
+
+    def update(self, nodes):
+        """
+        Write the poses of the given nodes (writer side)
+        """
+        for node in nodes:
+            node_id = node.id.encode("utf-8") if not isinstance(node.id, bytes) else node.id
+            if len(node_id) > ID_SIZE:
+                rospy.logwarn("[poseTable::update] Node id <%s> too long to be shared" % node.id)
+                continue
+            allocated = node.id not in self.__slots
+            if allocated:
+                if len(self.__free_slots) == 0:
+                    rospy.logwarn("[poseTable::update] Table full, pose of node <%s> not shared" % node.id)
+                    continue
+                self.__slots[node.id] = self.__free_slots.pop()
+            pose = node.position.pose
+            twist = node.velocity.twist
+            self.__write(self.__slots[node.id], (node_id,
+                         pose.position.x, pose.position.y, pose.position.z,
+                         pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w,
+                         twist.linear.x, twist.linear.y, twist.linear.z,
+                         twist.angular.x, twist.angular.y, twist.angular.z,
+                         node.last_update.data.secs, node.last_update.data.nsecs))
+            if allocated:
+                # published once the slot is filled so readers never index an empty slot
+                self.__bump_generation()
+
+    def remove(self, node_ids):
+        """
+        Release the slots of the given nodes (writer side)
+        """
+        for node_id in node_ids:
+            if node_id in self.__slots:
+                slot = self.__slots.pop(node_id)
+                self.__write(slot, (b"",) + (0.0,) * 13 + (0, 0))
+                self.__free_slots.append(slot)
+                self.__bump_generation()
+
+    def __lookup(self, node_id):
+        if node_id in self.__slots:
+            data = self.__read(self.__slots[node_id])
+            if data[0].rstrip(b"\0").decode("utf-8") == node_id:
+                return data
+        if self.__read_generation() == self.__generation:
+            return None
+        # the slots changed since the last lookup, rebuild the index from the table
+        found = None
+        for slot_id, data in self.__rebuild():
+            if slot_id == node_id:
+                found = data
+        return found
+
+    def __rebuild(self):
+        self.__generation = self.__read_generation()
+        self.__slots = {}
+        for slot in range(0, self.__capacity):
+            data = self.__read(slot)
+            slot_id = data[0].rstrip(b"\0").decode("utf-8")
+            if slot_id != "":
+                self.__slots[slot_id] = slot
+                yield slot_id, data
+
+    def pose(self, node_id):
+        """
+        Read the pose of the given node
+
+        @return: a (position, orientation, linear, angular, last_update) tuple
+                 or None if the node is not in the table
+        """
+        if self.__writer:
+            if node_id not in self.__slots:
+                return None
+            data = self.__read(self.__slots[node_id])
+        else:
+            self.__check_remap()
+            data = self.__lookup(node_id)
+            if data is None:
+                return None
+        return data[1:4], data[4:8], data[8:11], data[11:14], rospy.Time(data[14], data[15])
+
+    def node_ids(self):
+        """
+        Return the ids of the nodes currently in the table
+        """
+        if not self.__writer:
+            self.__check_remap()
+            return [slot_id for slot_id, data in self.__rebuild()]
+        return list(self.__slots.keys())
+
+    def close(self):
+        self.__map.close()
+
+    def unlink(self):
+        """
+        Remove the table from the shared memory (writer side)
+        """
+        self.close()
+        if os.path.exists(self.__path):
+            os.remove(self.__path)
@@ -20,6 +20,7 @@ class Timeline(object):
 
     def remove(self, situation_ids):
         self.__situations.remove(situation_ids)
+        return situation_ids
 
     def reset(self, origin):
         self.__origin = origin
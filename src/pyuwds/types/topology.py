@@ -8,6 +8,7 @@ import rospy
 class Topology (ConcurrentContainer):
 
     def __init__(self):
+        super(Topology, self).__init__()
         self.__clients = ConcurrentContainer()
         self.__client_interactions_by_world = ConcurrentContainer()
 
@@ -20,35 +21,39 @@ class Topology (ConcurrentContainer):
     def client_interactions_by_world(self, world_name):
         return self.__client_interactions_by_world[world_name]
 
+    def worlds(self):
+        return list(self.__client_interactions_by_world.ids())
+
     def update(self, ctx, interaction_type, action_type):
         self._lock()
 
         if action_type == Connection.CONNECT:
-            self.__clients.update(ctx.client.id, ctx.client)
+            self.__clients.update([ctx.client.id], [ctx.client])
 
             if not self.__client_interactions_by_world.has(ctx.world):
-                self.__client_interactions_by_world.update(ctx.world, ConcurrentContainer())
+                self.__client_interactions_by_world.update([ctx.world], [ConcurrentContainer()])
 
             interaction_msg = ClientInteraction(ctxt=ctx, type=interaction_type)
-            self.client_interactions_by_world(ctx.world).update(interaction_msg.ctxt.client.id, interaction_msg)
+            self.client_interactions_by_world(ctx.world).update([interaction_msg.ctxt.client.id], [interaction_msg])
 
         elif action_type == Connection.DISCONNECT:
-            self.client_interactions_by_world(ctx.world).remove(ctx.client.id)
+            if self.__client_interactions_by_world.has(ctx.world):
+                self.client_interactions_by_world(ctx.world).remove([ctx.client.id])
 
         self._unlock()
 
     def reset(self, worlds=None, clients=None, client_interactions=None):
-        self.reset()
+        self._lock()
+        self.__clients.reset()
+        self.__client_interactions_by_world.reset()
 
         if worlds is not None and clients is not None and client_interactions is not None:
-            self._lock()
-
             for client in clients:
-                self.__clients.update(client.id, client)
+                self.__clients.update([client.id], [client])
 
             for client_interaction in client_interactions:
                 if not self.__client_interactions_by_world.has(client_interaction.ctxt.world):
-                    self.__client_interactions_by_world.update(client_interaction.ctxt.world, ConcurrentContainer())
-                self.client_interactions_by_world(client_interaction.ctxt.world).update(client_interaction.ctxt.client.id, client_interaction)
+                    self.__client_interactions_by_world.update([client_interaction.ctxt.world], [ConcurrentContainer()])
+                self.client_interactions_by_world(client_interaction.ctxt.world).update([client_interaction.ctxt.client.id], [client_interaction])
 
-            self._unlock()
+        self._unlock()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from threading import Lock
 from scene import Scene
 from timeline import Timeline
 from uwds_msgs.msg import Invalidations
@@ -14,6 +15,25 @@ class World:
         self.__timeline = Timeline()
         self.__meshes = meshes
         self.__name = name
+        self.__mutex = Lock()
+
+    def lock(self):
+        self.__mutex.acquire()
+
+    def unlock(self):
+        self.__mutex.release()
+
+    def name(self):
+        return self.__name
+
+    def scene(self):
+        return self.__scene
+
+    def timeline(self):
+        return self.__timeline
+
+    def meshes(self):
+        return self.__meshes
 
     def apply_changes(self, header, changes):
         invalidations = Invalidations()
@@ -24,12 +44,9 @@ class World:
         invalidations.situation_ids_deleted = self.__timeline.remove(changes.situations_to_delete)
         invalidations.situation_ids_updated = self.__timeline.update(changes.situations_to_update)
 
-        for mesh_id in changes.meshes_to_delete:
-            del self.__meshes[mesh_id]
-            invalidations.mesh_ids_deleted.append(mesh_id)
-        for mesh in changes.meshes_to_update:
-            self.__meshes[mesh.id] = mesh
-            invalidations.mesh_ids_updated.append(mesh.id)
+        self.__meshes.remove(changes.meshes_to_delete)
+        invalidations.mesh_ids_deleted = changes.meshes_to_delete
+        invalidations.mesh_ids_updated = self.__meshes.update(changes.meshes_to_update)
         return invalidations
 
     def reset(self):
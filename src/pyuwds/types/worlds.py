@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from concurrent_container import ConcurrentContainer
+from world import World
+
+class Worlds(ConcurrentContainer):
+    """
+    The Underworlds worlds data structure, the worlds are created on first access
+    """
+    def __init__(self, meshes):
+        super(Worlds, self).__init__()
+        self.__meshes = meshes
+
+    def __getitem__(self, world_name):
+        self._lock()
+        if not self.has(world_name):
+            super(Worlds, self).__setitem__(world_name, World(world_name, self.__meshes))
+        world = super(Worlds, self).__getitem__(world_name)
+        self._unlock()
+        return world
@@ -6,6 +6,7 @@ from uwds_msgs.msg import Client
 from proxy.meshes_proxy import MeshesProxy
 from proxy.topology_proxy import TopologyProxy
 from proxy.worlds_proxy import WorldsProxy
+from proxy.transport import get_default_transport
 
 UNDEFINED = Client.UNDEFINED
 READER = Client.READER
@@ -25,11 +26,12 @@ ClientTypeNames = {UNDEFINED: "undefined",
 
 class UnderworldsProxy(object):
 
-    def __init__(self, client_name, client_type):
+    def __init__(self, client_name, client_type, transport=None):
         self.__client = Client(name=client_name, id=gen_uuid(), type=client_type)
-        self.__meshes_proxy = MeshesProxy(self.__client)
-        self.__worlds_proxy = WorldsProxy(self.__client, self.__meshes_proxy)
-        self.__topology_proxy = TopologyProxy(self.__client)
+        self.__transport = transport if transport is not None else get_default_transport()
+        self.__meshes_proxy = MeshesProxy(self.__client, self.__transport)
+        self.__worlds_proxy = WorldsProxy(self.__client, self.__meshes_proxy, self.__transport)
+        self.__topology_proxy = TopologyProxy(self.__client, self.__transport)
 
     def worlds(self):
         return self.__worlds_proxy
@@ -43,3 +45,9 @@ class UnderworldsProxy(object):
 
     def name(self):
         return self.__client.name
+
+    def client(self):
+        return self.__client
+
+    def transport(self):
+        return self.__transport
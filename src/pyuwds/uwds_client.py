@@ -1,13 +1,17 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
 import rospy
 from pyuwds.uwds import UnderworldsProxy
+from pyuwds.proxy.transport import get_default_transport
+from pyuwds.tools.tracing import Tracer, set_tracer
+from pyuwds.tools.profiler import Profiler, profiling_enabled, DEFAULT_INTERVAL, DEFAULT_TOP, DEFAULT_MAX_FILES
 
 class UwdsClient(object):
     """
     The Underworlds client
     """
-    def __init__(self, client_name, client_type):
+    def __init__(self, client_name, client_type, transport=None):
         """
         The Underworlds client
 
@@ -15,9 +19,21 @@ class UwdsClient(object):
         @param self.client_name: The client name
         @type self.client_type: string
         @param self.client_type: The client type
+        @type transport: Transport
+        @param transport: The transport to use, the default one if None
         """
-        self.verbose = rospy.get_param("~verbose", True)
-        self.global_frame_id = rospy.get_param("~global_frame_id", "map")
-        self.output_world = rospy.get_param("~output_world", "")
-        self.output_suffix = rospy.get_param("~output_suffix", "")
-        self.ctx = UnderworldsProxy(client_name, client_type)
+        self.transport = transport if transport is not None else get_default_transport()
+        self.verbose = self.transport.get_param("~verbose", True)
+        self.global_frame_id = self.transport.get_param("~global_frame_id", "map")
+        self.output_world = self.transport.get_param("~output_world", "")
+        self.output_suffix = self.transport.get_param("~output_suffix", "")
+        self.ctx = UnderworldsProxy(client_name, client_type, self.transport)
+        trace_file = self.transport.get_param("~trace_file", os.environ.get("UWDS_TRACE_FILE"))
+        if trace_file:
+            set_tracer(client_name, Tracer(client_name, trace_file))
+        self.profiler = Profiler(client_name,
+                                 enabled=profiling_enabled(self.transport),
+                                 interval=self.transport.get_param("~profiling_interval", DEFAULT_INTERVAL),
+                                 top=self.transport.get_param("~profiling_top", DEFAULT_TOP),
+                                 output_dir=self.transport.get_param("~profiling_output_dir", None),
+                                 max_files=self.transport.get_param("~profiling_max_files", DEFAULT_MAX_FILES))